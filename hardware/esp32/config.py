@@ -8,6 +8,24 @@ WIFI_PASSWORD = "SuaSenhaWiFi"
 # Servidor FaceBoi
 SERVER_URL = "http://192.168.1.100:5000"
 API_ENDPOINT = "/api/capture"
+RAW_API_ENDPOINT = "/api/capture/raw"
+BATCH_API_ENDPOINT = "/api/capture/batch"
+
+# Modo de envio da imagem
+# "raw": JPEG binário direto no socket (menos bytes e menos RAM)
+# "json": JPEG em base64 dentro de um JSON (compatibilidade)
+UPLOAD_MODE = "raw"
+
+# Reenvios quando o servidor não responde (seguros: o servidor ignora
+# capturas repetidas pela chave de idempotência)
+SEND_RETRIES = 2
+
+# Fila offline: capturas que não puderam ser enviadas ficam na flash
+# (ou no cartão SD, ex.: "/sd/queue") e são reenviadas em lote
+QUEUE_DIR = "/queue"
+QUEUE_MAX_ITEMS = 20  # Ao encher, descarta a captura mais antiga
+QUEUE_BATCH_SIZE = 5  # Capturas por requisição ao esvaziar a fila
+QUEUE_DRAIN_INTERVAL_MS = 15000  # Intervalo entre tentativas de envio
 
 # Identificação do dispositivo
 DEVICE_ID = "ESP32-CAM-001"
@@ -5,15 +5,19 @@ import time
 import gc
 import urequests
 import ubinascii
+import usocket
 import json
+import os
 from machine import Pin, reset
 
 from config import (
-    SERVER_URL, API_ENDPOINT, DEVICE_ID, CAMERA_POSITION,
-    RFID_ENABLED, CAPTURE_DELAY_MS, DEBUG
+    SERVER_URL, API_ENDPOINT, RAW_API_ENDPOINT, BATCH_API_ENDPOINT, UPLOAD_MODE,
+    DEVICE_ID, CAMERA_POSITION, RFID_ENABLED, CAPTURE_DELAY_MS,
+    SEND_RETRIES, QUEUE_DRAIN_INTERVAL_MS, DEBUG
 )
 from rfid import create_rfid
 from camera_module import create_camera
+from offline_queue import create_queue
 
 # LED indicador (GPIO 4 na ESP32-CAM)
 led = Pin(4, Pin.OUT)
@@ -28,13 +32,25 @@ def blink_led(times=1, delay=200):
         time.sleep_ms(delay)
 
 
-def send_to_server(rfid_tag, image_data):
+def new_capture_id():
+    """
+    Gera a chave de idempotência de uma captura
+    
+    A mesma chave é usada em todas as tentativas de envio; o servidor
+    devolve o resultado original em vez de registrar a captura de novo.
+    """
+    suffix = ubinascii.hexlify(os.urandom(4)).decode()
+    return f"{DEVICE_ID}-{int(time.time())}-{suffix}"
+
+
+def send_to_server(rfid_tag, image_data, capture_id=None):
     """
     Envia dados para o servidor
     
     Args:
         rfid_tag: ID do RFID lido
         image_data: bytes da imagem JPEG
+        capture_id: chave de idempotência da captura
     
     Returns:
         dict: Resposta do servidor ou None em caso de erro
@@ -53,6 +69,8 @@ def send_to_server(rfid_tag, image_data):
             "image_base64": image_b64,
             "timestamp": time.time()
         }
+        if capture_id:
+            payload["capture_id"] = capture_id
         
         if DEBUG:
             print(f"[Server] Enviando para {url}")
@@ -62,7 +80,8 @@ def send_to_server(rfid_tag, image_data):
         headers = {"Content-Type": "application/json"}
         response = urequests.post(url, json=payload, headers=headers, timeout=30)
         
-        if response.status_code == 200:
+        # 200: peso estimado; 202: captura aceita, estimativa assíncrona
+        if response.status_code in (200, 202):
             result = response.json()
             if DEBUG:
                 print(f"[Server] Sucesso: {result}")
@@ -78,13 +97,96 @@ def send_to_server(rfid_tag, image_data):
         return None
 
 
-def process_detection(rfid_tag, cam):
+def _parse_server_url():
+    """Separa host e porta de SERVER_URL (http://host:porta)"""
+    host = SERVER_URL.split("://", 1)[-1].split("/", 1)[0]
+    if ":" in host:
+        host, port = host.split(":", 1)
+        return host, int(port)
+    return host, 80
+
+
+def send_to_server_raw(rfid_tag, image_data, capture_id=None):
+    """
+    Envia a imagem JPEG binária para /api/capture/raw
+    
+    O buffer da câmera é escrito direto no socket, sem base64 e sem
+    montar JSON em memória. Metadados vão nos headers HTTP.
+    
+    Args:
+        rfid_tag: ID do RFID lido
+        image_data: bytes da imagem JPEG
+        capture_id: chave de idempotência da captura
+    
+    Returns:
+        dict: Resposta do servidor ou None em caso de erro
+    """
+    host, port = _parse_server_url()
+    sock = None
+    
+    try:
+        if DEBUG:
+            print(f"[Server] Enviando (raw) para {host}:{port}{RAW_API_ENDPOINT}")
+            print(f"[Server] RFID: {rfid_tag}, Imagem: {len(image_data)} bytes")
+        
+        addr = usocket.getaddrinfo(host, port)[0][-1]
+        sock = usocket.socket()
+        sock.settimeout(30)
+        sock.connect(addr)
+        
+        # Cabeçalho HTTP
+        sock.write(
+            f"POST {RAW_API_ENDPOINT} HTTP/1.0\r\n"
+            f"Host: {host}\r\n"
+            "Content-Type: image/jpeg\r\n"
+            f"Content-Length: {len(image_data)}\r\n"
+            f"X-Device-Id: {DEVICE_ID}\r\n"
+            f"X-Camera-Position: {CAMERA_POSITION}\r\n"
+            f"X-RFID-Tag: {rfid_tag}\r\n"
+            f"X-Timestamp: {time.time()}\r\n"
+            f"X-Capture-Id: {capture_id or ''}\r\n"
+            "\r\n"
+        )
+        
+        # Corpo: buffer da câmera sem cópia
+        sock.write(memoryview(image_data))
+        
+        # Linha de status
+        status_line = sock.readline()
+        status_code = int(status_line.split(None, 2)[1])
+        
+        # Pula headers da resposta
+        while True:
+            line = sock.readline()
+            if not line or line == b"\r\n":
+                break
+        
+        if status_code in (200, 202):
+            result = json.loads(sock.read())
+            if DEBUG:
+                print(f"[Server] Sucesso: {result}")
+            return result
+        else:
+            print(f"[Server] Erro HTTP {status_code}")
+            return None
+            
+    except Exception as e:
+        print(f"[Server] Erro ao enviar: {e}")
+        return None
+        
+    finally:
+        if sock:
+            sock.close()
+
+
+def process_detection(rfid_tag, cam, queue=None):
     """
     Processa uma detecção de RFID
     
     Args:
         rfid_tag: ID do RFID detectado
         cam: Instância da câmera
+        queue: Fila offline para capturas não enviadas
     """
     print(f"\n{'='*40}")
     print(f"[RFID] Tag detectada: {rfid_tag}")
@@ -104,9 +206,34 @@ def process_detection(rfid_tag, cam):
         blink_led(5, 50)  # Erro
         return
     
-    # Envia ao servidor
+    # Envia ao servidor (reenvios usam a mesma chave de idempotência)
     print("[Server] Enviando dados...")
-    result = send_to_server(rfid_tag, image)
+    capture_id = new_capture_id()
+    send = send_to_server_raw if UPLOAD_MODE == "raw" else send_to_server
+    
+    result = None
+    for attempt in range(1 + SEND_RETRIES):
+        if attempt:
+            print(f"[Server] Tentativa {attempt + 1}...")
+            time.sleep_ms(500 * attempt)
+        result = send(rfid_tag, image, capture_id)
+        if result:
+            break
+    
+    # Servidor fora do ar: guarda para reenviar depois
+    queued = False
+    if result is None and queue is not None:
+        try:
+            queue.push({
+                "device_id": DEVICE_ID,
+                "camera_position": CAMERA_POSITION,
+                "rfid_tag": rfid_tag,
+                "capture_id": capture_id,
+                "timestamp": time.time()
+            }, image)
+            queued = True
+        except Exception as e:
+            print(f"[Fila] Erro ao guardar captura: {e}")
     
     # Libera memória
     del image
@@ -116,7 +243,11 @@ def process_detection(rfid_tag, cam):
         # Sucesso - mostra peso estimado se disponível
         if 'estimated_weight' in result:
             print(f"[Peso] Estimativa: {result['estimated_weight']} kg")
+        elif 'capture_id' in result:
+            print(f"[Peso] Captura #{result['capture_id']} em processamento")
         blink_led(1, 500)  # Sucesso
+    elif queued:
+        blink_led(2, 300)  # Guardada na fila offline
     else:
         blink_led(3, 100)  # Erro no envio
     
@@ -149,6 +280,11 @@ def main():
         if rfid is None:
             print("[AVISO] RFID não disponível, modo manual ativado")
     
+    print("[Init] Inicializando fila offline...")
+    queue = create_queue()
+    if queue is not None and len(queue):
+        print(f"[Fila] {len(queue)} capturas pendentes")
+    
     print("\n[Sistema] Pronto! Aguardando detecções...\n")
     blink_led(3, 200)  # Indica pronto
     
@@ -156,6 +292,8 @@ def main():
     last_tag = None
     last_detection_time = 0
     detection_cooldown = 5000  # 5 segundos entre detecções do mesmo tag
+    last_drain_time = 0
+    host, port = _parse_server_url()
     
     # Loop principal
     while True:
@@ -169,10 +307,17 @@ def main():
                 if tag:
                     # Verifica cooldown para evitar leituras duplicadas
                     if tag != last_tag or time.ticks_diff(current_time, last_detection_time) > detection_cooldown:
-                        process_detection(tag, cam)
+                        process_detection(tag, cam, queue)
                         last_tag = tag
                         last_detection_time = current_time
             
+            # Reenvia capturas da fila offline quando ocioso
+            if queue is not None and time.ticks_diff(current_time, last_drain_time) > QUEUE_DRAIN_INTERVAL_MS:
+                last_drain_time = current_time
+                if len(queue):
+                    queue.drain(host, port, BATCH_API_ENDPOINT)
+                    gc.collect()
+            
             # Pequeno delay para não sobrecarregar
             time.sleep_ms(100)
             
@@ -0,0 +1,168 @@
+# FaceBoi ESP32 - Fila Offline
+# Guarda capturas não enviadas na flash/SD e reenvia em lote
+
+import os
+import json
+import usocket
+from config import QUEUE_DIR, QUEUE_MAX_ITEMS, QUEUE_BATCH_SIZE, DEBUG
+
+# Bloco usado para copiar arquivos da flash para o socket
+CHUNK_SIZE = 4096
+
+
+class OfflineQueue:
+    """
+    Fila de capturas persistida em arquivos.
+
+    Cada captura é um arquivo NNNNNNNN.cap com uma linha JSON de
+    metadados seguida dos bytes JPEG - o mesmo formato que o servidor
+    aceita em /api/capture/batch, então o arquivo vai para o socket
+    sem ser decodificado nem carregado inteiro na RAM.
+    """
+
+    def __init__(self, directory=QUEUE_DIR, max_items=QUEUE_MAX_ITEMS):
+        self.directory = directory
+        self.max_items = max_items
+        self._ensure_dir()
+
+    def _ensure_dir(self):
+        path = ""
+        for part in self.directory.strip("/").split("/"):
+            path += "/" + part
+            try:
+                os.mkdir(path)
+            except OSError:
+                pass  # Já existe
+
+    def _files(self):
+        """Arquivos da fila, do mais antigo para o mais novo"""
+        return sorted(f for f in os.listdir(self.directory) if f.endswith(".cap"))
+
+    def _path(self, name):
+        return f"{self.directory}/{name}"
+
+    def __len__(self):
+        return len(self._files())
+
+    def push(self, meta, image_data):
+        """
+        Adiciona uma captura à fila
+
+        Se a fila estiver cheia, descarta a captura mais antiga.
+
+        Args:
+            meta: dict com device_id, camera_position, rfid_tag, capture_id...
+            image_data: bytes da imagem JPEG
+        """
+        files = self._files()
+
+        while len(files) >= self.max_items:
+            oldest = files.pop(0)
+            os.remove(self._path(oldest))
+            print(f"[Fila] Cheia, descartando {oldest}")
+
+        seq = int(files[-1][:8]) + 1 if files else 1
+        name = "{:08d}.cap".format(seq)
+
+        header = dict(meta)
+        header["size"] = len(image_data)
+
+        with open(self._path(name), "wb") as f:
+            f.write(json.dumps(header).encode())
+            f.write(b"\n")
+            f.write(image_data)
+
+        if DEBUG:
+            print(f"[Fila] Captura guardada: {name} ({len(files) + 1} na fila)")
+
+    def drain(self, host, port, endpoint, batch_size=QUEUE_BATCH_SIZE):
+        """
+        Envia um lote de capturas para o servidor
+
+        São removidos os arquivos que o servidor confirma ('created',
+        'duplicate') e os que ele recusa como inválidos ('rejected' -
+        reenviá-los não adianta e eles prenderiam a fila). Os com erro
+        do servidor ou sem resposta ficam para o próximo envio. Reenvios
+        são seguros porque cada captura leva sua capture_id.
+
+        Returns:
+            int: Número de capturas removidas da fila (0 em caso de erro)
+        """
+        names = self._files()[:batch_size]
+        if not names:
+            return 0
+
+        total = 0
+        for name in names:
+            total += os.stat(self._path(name))[6]
+
+        sock = None
+        buf = bytearray(CHUNK_SIZE)
+
+        try:
+            addr = usocket.getaddrinfo(host, port)[0][-1]
+            sock = usocket.socket()
+            sock.settimeout(30)
+            sock.connect(addr)
+
+            sock.write(
+                f"POST {endpoint} HTTP/1.0\r\n"
+                f"Host: {host}\r\n"
+                "Content-Type: application/x-faceboi-batch\r\n"
+                f"Content-Length: {total}\r\n"
+                "\r\n"
+            )
+
+            # Copia cada arquivo para o socket em blocos
+            view = memoryview(buf)
+            for name in names:
+                with open(self._path(name), "rb") as f:
+                    while True:
+                        n = f.readinto(buf)
+                        if not n:
+                            break
+                        sock.write(view[:n])
+
+            status_line = sock.readline()
+            status_code = int(status_line.split(None, 2)[1])
+
+            if status_code != 200:
+                print(f"[Fila] Erro HTTP {status_code}")
+                return 0
+
+            # Pula os cabeçalhos; o corpo vai até o servidor fechar (HTTP/1.0)
+            while sock.readline() not in (b"", b"\r\n"):
+                pass
+            results = json.loads(sock.read()).get("results", [])
+
+        except Exception as e:
+            print(f"[Fila] Erro ao enviar lote: {e}")
+            return 0
+
+        finally:
+            if sock:
+                sock.close()
+
+        # Os resultados vêm na ordem dos arquivos enviados
+        sent = 0
+        for name, result in zip(names, results):
+            outcome = result.get("outcome")
+            if outcome == "rejected":
+                print(f"[Fila] {name} descartada: {result.get('error')}")
+            elif outcome not in ("created", "duplicate"):
+                print(f"[Fila] {name} fica na fila: {result.get('error')}")
+                continue
+            os.remove(self._path(name))
+            sent += 1
+
+        print(f"[Fila] {sent} capturas removidas ({len(self)} restantes)")
+        return sent
+
+
+def create_queue():
+    """Factory function para criar a fila offline"""
+    try:
+        return OfflineQueue()
+    except Exception as e:
+        print(f"[Fila] Erro na inicialização: {e}")
+        return None
@@ -5,13 +5,39 @@ Recebe imagens da ESP32 e estima peso dos animais
 
 import os
 import json
+import time
+import zlib
 import base64
+import binascii
+import threading
 from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS
 
-from config import HOST, PORT, DEBUG, UPLOAD_FOLDER, DATABASE_FILE, MODEL_PATH
+from config import (
+    HOST, PORT, DEBUG, UPLOAD_FOLDER, DATABASE_FILE, LEGACY_DATABASE_FILE, MODEL_PATH,
+    ASYNC_ESTIMATION, ESTIMATION_WORKERS, SEGMENT_MAX_SIDE, SEGMENT_REFINE,
+    PASS_WINDOW_SECONDS, RESULT_CACHE_MB, RESULT_CACHE_DIR,
+    BACKGROUND_DIR, BACKGROUND_THRESHOLD, BACKGROUND_MIN_FRAMES, ROI_DIR, ROI_MIN_SAMPLES,
+    FEATURE_PLUGINS, FEATURE_EXTRA, MODEL_REGISTRY_DIR, MODEL_CHECK_SECONDS,
+    WEIGHT_RAW_DAYS, WEIGHT_DAILY_DAYS, WEIGHT_COMPACT_INTERVAL,
+    IMAGE_SEGMENT_MB, IMAGE_RETENTION_DAYS, IMAGE_COMPACT_RATIO, MAX_IMAGE_MB,
+    EVENT_BUFFER_SIZE, EVENT_MAX_CLIENTS, EVENT_POLL_SECONDS, EVENT_HEARTBEAT_SECONDS
+)
 from weight_model import get_estimator
+from storage import (
+    get_repository, DuplicateCapture, STATUS_PENDING, STATUS_DONE, DEFAULT_PAGE_SIZE,
+    ROLLUP_PERIODS, EXPORT_KINDS
+)
+from transfer import (
+    ndjson_lines, csv_lines, encode_chunks, gzip_chunks, text_lines, read_ndjson, read_csv
+)
+from workers import EstimationQueue
+from imagestore import get_image_store, parse_locator
+from events import get_broker, TooManySubscribers
+from metrics import (
+    registry, Timings, REQUEST_SECONDS, CAPTURES, count_result, observe_stages
+)
 
 # Inicializa Flask
 app = Flask(__name__)
@@ -19,37 +45,555 @@ CORS(app)
 
 # Cria diretórios necessários
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(os.path.dirname(DATABASE_FILE) if os.path.dirname(DATABASE_FILE) else 'data', exist_ok=True)
 os.makedirs('models', exist_ok=True)
 
 # Inicializa estimador de peso
-estimator = get_estimator(MODEL_PATH if os.path.exists(MODEL_PATH) else None)
+estimator_options = {
+    'segment_max_side': SEGMENT_MAX_SIDE,
+    'segment_refine': SEGMENT_REFINE,
+    'cache_bytes': RESULT_CACHE_MB * 1024 * 1024,
+    'cache_dir': RESULT_CACHE_DIR,
+    'background_dir': BACKGROUND_DIR,
+    'background_threshold': BACKGROUND_THRESHOLD,
+    'background_min_frames': BACKGROUND_MIN_FRAMES,
+    'roi_dir': ROI_DIR,
+    'roi_min_samples': ROI_MIN_SAMPLES,
+    'feature_plugins': FEATURE_PLUGINS,
+    'extra_features': FEATURE_EXTRA,
+    'model_registry': MODEL_REGISTRY_DIR,
+    'model_check_interval': MODEL_CHECK_SECONDS
+}
+estimator = get_estimator(MODEL_PATH if os.path.exists(MODEL_PATH) else None, **estimator_options)
 
+# Arquivo de imagens (segmentos append-only em UPLOAD_FOLDER)
+image_store_options = {'segment_max_bytes': IMAGE_SEGMENT_MB * 1024 * 1024}
+image_store = get_image_store(UPLOAD_FOLDER, **image_store_options)
 
-def load_database():
-    """Carrega banco de dados JSON"""
-    if os.path.exists(DATABASE_FILE):
-        with open(DATABASE_FILE, 'r') as f:
-            return json.load(f)
-    return {'cattle': {}, 'captures': []}
+# Inicializa banco de dados
+repository = get_repository(DATABASE_FILE, pass_window=PASS_WINDOW_SECONDS or None)
 
+# Feed ao vivo das capturas concluídas (compartilhado pelos workers via banco)
+broker = get_broker(buffer_size=EVENT_BUFFER_SIZE, max_subscribers=EVENT_MAX_CLIENTS,
+                    repository=repository, poll_interval=EVENT_POLL_SECONDS)
 
-def save_database(db):
-    """Salva banco de dados JSON"""
-    with open(DATABASE_FILE, 'w') as f:
-        json.dump(db, f, indent=2, default=str)
+# Migra o banco JSON antigo, se existir
+if os.path.exists(LEGACY_DATABASE_FILE) and repository.is_empty():
+    imported = repository.import_legacy_json(LEGACY_DATABASE_FILE)
+    os.replace(LEGACY_DATABASE_FILE, LEGACY_DATABASE_FILE + '.migrated')
+    print(f"[Database] {imported} animais importados de {LEGACY_DATABASE_FILE}")
+
+
+def compact_images():
+    """
+    Reescreve segmentos antigos do arquivo de imagens com muitos bytes mortos
+
+    As imagens vivas (referenciadas por alguma captura) são copiadas para
+    o segmento ativo, as capturas passam a apontar para a nova posição e
+    o segmento antigo é apagado. Só um processo compacta por vez.
+    """
+    image_store.prune()
+    
+    with image_store.compaction_lock() as acquired:
+        if not acquired:
+            return
+        
+        if IMAGE_RETENTION_DAYS:
+            expired = repository.expire_images(IMAGE_RETENTION_DAYS)
+            if expired:
+                print(f"[Images] {expired} imagens além da retenção")
+        
+        for segment in image_store.compaction_candidates():
+            locators = repository.segment_images(segment)
+            live = sum(parse_locator(locator)[2] for locator in locators)
+            if live >= image_store.segment_size(segment) * IMAGE_COMPACT_RATIO:
+                continue
+            
+            moved = image_store.relocate(locators)
+            repository.relocate_images(moved)
+            image_store.remove_segment(segment)
+            print(f"[Images] {segment} compactado ({len(moved)} imagens realocadas)")
+
+
+def compaction_loop():
+    """Compacta periodicamente o histórico de pesos antigo (ver compact_weights) e as imagens"""
+    while True:
+        try:
+            raw, daily = repository.compact_weights(WEIGHT_RAW_DAYS, WEIGHT_DAILY_DAYS)
+            if raw or daily:
+                print(f"[Database] Compactados {raw} pesos brutos e {daily} agregados diários")
+        except Exception as e:
+            print(f"[Database] Erro na compactação: {e}")
+        
+        try:
+            compact_images()
+        except Exception as e:
+            print(f"[Images] Erro na compactação: {e}")
+        
+        time.sleep(WEIGHT_COMPACT_INTERVAL)
+
+
+# Thread de compactação por processo (iniciada na primeira requisição,
+# então cada worker após um fork tem a sua)
+_compaction_pid = None
+
+@app.before_request
+def start_compaction():
+    global _compaction_pid
+    if WEIGHT_COMPACT_INTERVAL and _compaction_pid != os.getpid():
+        _compaction_pid = os.getpid()
+        threading.Thread(target=compaction_loop, daemon=True).start()
+
+
+def publish_capture(capture_id, fields=None):
+    """
+    Envia a captura concluída (e o peso fundido da passagem, se houver)
+    para os dashboards conectados em /api/events
+    """
+    event = repository.get_capture(capture_id)
+    if event is None:
+        return
+    
+    event.pop('features', None)
+    if fields and fields.get('pass'):
+        event['pass'] = fields['pass']
+    
+    broker.publish('capture', event)
+
+
+def on_estimation_complete(capture_id, result):
+    """Grava o resultado de uma estimativa assíncrona"""
+    count_result(result)
+    observe_stages(result.pop('timings', None))
+    
+    start = time.perf_counter()
+    fields = repository.complete_capture(capture_id, result)
+    observe_stages({'db_write': time.perf_counter() - start})
+    
+    publish_capture(capture_id, fields)
+    print(f"[Capture] #{capture_id} | Peso: {result.get('estimated_weight', 'N/A')} kg")
+
+
+# Fila de estimativa assíncrona (pool criado sob demanda)
+estimation_queue = EstimationQueue(
+    model_path=MODEL_PATH if os.path.exists(MODEL_PATH) else None,
+    max_workers=ESTIMATION_WORKERS,
+    on_complete=on_estimation_complete,
+    estimator_options=estimator_options,
+    image_store=(UPLOAD_FOLDER, image_store_options)
+)
+
+# Gauges lidos na coleta de /metrics
+registry.gauge('faceboi_queue_depth', 'Capturas aguardando estimativa assíncrona',
+               estimation_queue.pending)
+registry.gauge('faceboi_database_bytes', 'Tamanho do banco SQLite (com WAL)',
+               repository.size_bytes)
+registry.gauge('faceboi_image_segments', 'Segmentos no arquivo de imagens',
+               lambda: len(image_store.segments()))
+registry.gauge('faceboi_event_clients', 'Dashboards conectados em /api/events',
+               broker.subscribers)
+registry.gauge('faceboi_cache_entries', 'Resultados no cache em memória',
+               lambda: len(estimator.cache) if estimator.cache is not None else None)
+
+
+@app.before_request
+def start_timings():
+    g.timings = Timings()
+
+
+@app.after_request
+def finish_timings(response):
+    """
+    Registra a duração da requisição; com ?timings=1 (ou o cabeçalho
+    X-Timings: 1) inclui o tempo de cada etapa na resposta JSON
+    """
+    timings = g.get('timings')
+    if timings is None:
+        return response
+    
+    breakdown = timings.breakdown()
+    REQUEST_SECONDS.observe(
+        breakdown['total'] / 1000,
+        endpoint=request.endpoint or 'unknown',
+        status=response.status_code
+    )
+    
+    wanted = request.args.get('timings') or request.headers.get('X-Timings')
+    if wanted and wanted != '0' and response.is_json and not response.is_streamed:
+        data = response.get_json()
+        if isinstance(data, dict):
+            data['timings'] = breakdown
+            response.set_data(json.dumps(data))
+    
+    return response
+
+
+def stage(name):
+    """Mede uma etapa da requisição atual (ver metrics.Timings)"""
+    return g.timings.stage(name)
+
+
+# Tempo máximo de espera em GET /api/captures/<id>?wait=N
+MAX_WAIT_SECONDS = 30
+
+# Máximo de capturas por requisição em /api/capture/batch
+MAX_BATCH_SIZE = 50
+
+
+def parse_time(value):
+    """
+    Converte since/until (ISO 8601 ou epoch em segundos) para o formato
+    ISO usado no banco
+
+    Raises:
+        ValueError: valor inválido
+    """
+    try:
+        seconds = float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).isoformat()
+    
+    try:
+        return datetime.fromtimestamp(seconds).isoformat()
+    except (OverflowError, OSError):
+        raise ValueError(value)
+
+
+def page_args(default_limit=DEFAULT_PAGE_SIZE):
+    """
+    Lê os parâmetros de paginação da query string
+    (limit, cursor, since, until, fields=a,b,c)
+
+    Raises:
+        ValueError: parâmetro inválido
+    """
+    since = request.args.get('since')
+    until = request.args.get('until')
+    fields = request.args.get('fields')
+    
+    return {
+        'limit': int(request.args.get('limit', default_limit)),
+        'cursor': request.args.get('cursor') or None,
+        'since': parse_time(since) if since else None,
+        'until': parse_time(until) if until else None,
+        'fields': {f.strip() for f in fields.split(',') if f.strip()} if fields else None
+    }
+
+
+def bad_request(error):
+    """Resposta 400 para parâmetros de consulta inválidos"""
+    return jsonify({
+        'success': False,
+        'error': f'Parâmetro inválido: {error}'
+    }), 400
+
+
+def image_key(rfid_tag, camera_position):
+    """Nome da imagem de uma captura (guardado no registro do segmento)"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    return f"{rfid_tag}_{camera_position}_{timestamp}.jpg"
 
 
 def save_image(rfid_tag, camera_position, image_bytes):
-    """Salva imagem no disco"""
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"{rfid_tag}_{camera_position}_{timestamp}.jpg"
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    """
+    Anexa a imagem ao arquivo de imagens
+    
+    Returns:
+        str: Localizador da imagem (gravado em image_path)
+    """
+    with stage('save_image'):
+        return image_store.put(image_key(rfid_tag, camera_position), image_bytes)
+
+
+def save_image_stream(rfid_tag, camera_position, stream, chunk_size=64 * 1024, length=None):
+    """
+    Lê a imagem do stream em blocos e a anexa ao arquivo de imagens
+    
+    Com o tamanho conhecido (Content-Length, cabeçalho do lote) os blocos
+    vão direto para o segmento (ImageStore.put_stream); um corpo truncado
+    não deixa registro. Sem ele (corpo chunked) a imagem precisa ser
+    juntada em memória antes de gravar, limitada a MAX_IMAGE_MB. O tempo
+    medido ('save_image') inclui a recepção do corpo.
+    
+    Args:
+        length: número de bytes a ler (None = até o fim do stream)
+    
+    Returns:
+        tuple: (localizador, ou None se vazia/incompleta; tamanho em bytes)
+    
+    Raises:
+        ValueError: imagem maior que MAX_IMAGE_MB
+    """
+    limit = MAX_IMAGE_MB * 1024 * 1024
+    if length is not None and length > limit:
+        raise ValueError(f'Imagem maior que {MAX_IMAGE_MB} MB')
+    
+    with stage('save_image'):
+        key = image_key(rfid_tag, camera_position)
+        
+        if length is not None:
+            if length == 0:
+                return None, 0
+            return image_store.put_stream(key, stream, length, chunk_size)
+        
+        data = bytearray()
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            data += chunk
+            if len(data) > limit:
+                raise ValueError(f'Imagem maior que {MAX_IMAGE_MB} MB')
+        
+        if not data:
+            return None, 0
+        
+        return image_store.put(key, data), len(data)
+
+
+def wants_async():
+    """Indica se a requisição atual deve usar a estimativa assíncrona"""
+    value = request.args.get('async')
+    if value is None:
+        return ASYNC_ESTIMATION
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def capture_key(client_id, device_id, rfid_tag, timestamp):
+    """
+    Chave de idempotência de uma captura
+    
+    Usa o id gerado pelo cliente; sem ele, a tupla (device_id, rfid_tag,
+    timestamp) - desde que o timestamp tenha vindo do cliente.
+    """
+    if client_id:
+        return str(client_id)
+    if timestamp is not None:
+        return f"{device_id}:{rfid_tag}:{timestamp}"
+    return None
+
+
+def find_original(client_id):
+    """Captura já registrada com a chave de idempotência, ou None"""
+    with stage('dedupe'):
+        return repository.find_capture(client_id)
+
+
+def duplicate_response(record):
+    """
+    Resposta de um reenvio: o resultado da captura original
     
-    with open(filepath, 'wb') as f:
-        f.write(image_bytes)
+    Returns:
+        tuple: (resposta, status HTTP)
+    """
+    CAPTURES.inc(status='duplicate')
     
-    return filepath
+    response = {
+        'success': True,
+        'duplicate': True,
+        'capture_id': record['id'],
+        'rfid_tag': record['rfid_tag'],
+        'device_id': record['device_id'],
+        'camera_position': record['camera_position'],
+        'image_saved': record['image_path']
+    }
+    
+    if record.get('pass_id') is not None:
+        response['pass_id'] = record['pass_id']
+    
+    if record.get('status') == STATUS_PENDING:
+        response['status'] = STATUS_PENDING
+        response['status_url'] = f"/api/captures/{record['id']}"
+        return response, 202
+    
+    if 'estimated_weight' in record:
+        response['estimated_weight'] = record['estimated_weight']
+        response['confidence'] = record['confidence']
+        response['features'] = record['features']
+        
+        recent_weights = repository.recent_weights(record['rfid_tag'], 5)
+        if recent_weights:
+            response['average_weight'] = round(sum(recent_weights) / len(recent_weights), 1)
+    else:
+        response['weight_error'] = record.get('error', 'Erro desconhecido')
+    
+    print(f"[Capture] {record['rfid_tag']} | Reenvio da captura #{record['id']} ignorado")
+    
+    return response, 200
+
+
+def discard_duplicate(image_path, error):
+    """Descarta a imagem de um reenvio que perdeu a corrida e responde com o original"""
+    image_store.discard(image_path)
+    return duplicate_response(error.record)
+
+
+def enqueue_capture(device_id, camera_position, rfid_tag, image_path, client_id=None):
+    """
+    Registra a captura como pendente e enfileira a estimativa
+    
+    Returns:
+        tuple: (resposta, 202)
+    """
+    try:
+        with stage('db_write'):
+            record = repository.add_capture(
+                rfid_tag, device_id, camera_position, image_path,
+                status=STATUS_PENDING, client_id=client_id
+            )
+    except DuplicateCapture as e:
+        return discard_duplicate(image_path, e)
+    
+    estimation_queue.submit(record['id'], image_path, device_id)
+    CAPTURES.inc(status='queued')
+    
+    print(f"[Capture] {rfid_tag} | {camera_position} | Enfileirada #{record['id']}")
+    
+    return {
+        'success': True,
+        'capture_id': record['id'],
+        'status': STATUS_PENDING,
+        'status_url': f"/api/captures/{record['id']}",
+        'rfid_tag': rfid_tag,
+        'device_id': device_id,
+        'camera_position': camera_position,
+        'image_saved': image_path
+    }, 202
+
+
+def capture_response(device_id, camera_position, rfid_tag, image_path, record, result):
+    """Monta a resposta de uma captura processada de forma síncrona"""
+    response = {
+        'success': True,
+        'capture_id': record['id'],
+        'rfid_tag': rfid_tag,
+        'device_id': device_id,
+        'camera_position': camera_position,
+        'image_saved': image_path
+    }
+    
+    if result['success']:
+        response['estimated_weight'] = result['estimated_weight']
+        response['confidence'] = result.get('confidence', 0)
+        response['features'] = result.get('features', {})
+        response['model_version'] = result.get('model_version')
+        
+        # Peso fundido da passagem (todas as vistas recebidas até agora)
+        if record.get('pass'):
+            response['pass'] = record['pass']
+        
+        # Calcula média dos últimos pesos
+        recent_weights = repository.recent_weights(rfid_tag, 5)
+        response['average_weight'] = (
+            round(sum(recent_weights) / len(recent_weights), 1) if recent_weights else None
+        )
+    else:
+        response['weight_error'] = result.get('error', 'Erro desconhecido')
+    
+    publish_capture(record['id'], record)
+    
+    print(f"[Capture] {rfid_tag} | {camera_position} | Peso: {response.get('estimated_weight', 'N/A')} kg")
+    
+    return response
+
+
+def record_result(result):
+    """Conta a estimativa e soma seus tempos por etapa aos da requisição"""
+    count_result(result)
+    g.timings.merge(result.pop('timings', None))
+
+
+def process_capture(device_id, camera_position, rfid_tag, image_path, image_bytes, client_id=None):
+    """
+    Estima o peso, registra a captura e monta a resposta
+    
+    Compartilhado entre /api/capture (base64) e /api/capture/raw (binário).
+    
+    Returns:
+        tuple: (resposta, status HTTP)
+    """
+    # Processa imagem e estima peso
+    result = estimator.process_image(image_bytes, device_id)
+    record_result(result)
+    
+    # Registra captura (e peso, se estimado)
+    try:
+        with stage('db_write'):
+            record = repository.add_capture(
+                rfid_tag, device_id, camera_position, image_path, result, client_id=client_id
+            )
+    except DuplicateCapture as e:
+        return discard_duplicate(image_path, e)
+    
+    return capture_response(device_id, camera_position, rfid_tag, image_path, record, result), 200
+
+
+def process_batch(items, run_async):
+    """
+    Processa as capturas de um upload em lote
+    
+    As imagens já estão salvas; o peso de todas sai de uma única chamada
+    a estimator.process_images e o banco recebe uma única transação.
+    
+    Args:
+        items: dicts com device_id, camera_position, rfid_tag, image_path
+               e client_id
+        run_async: enfileira as estimativas em vez de calcular aqui
+    
+    Returns:
+        list: Uma resposta por captura, na ordem recebida
+    """
+    results = [None] * len(items)
+    
+    if not run_async:
+        images = []
+        with stage('read_image'):
+            for item in items:
+                images.append(image_store.read(item['image_path']))
+        results = estimator.process_images(images, device_ids=[item['device_id'] for item in items])
+        del images
+        
+        for result in results:
+            record_result(result)
+    
+    with stage('db_write'):
+        records = repository.add_captures([
+            {
+                'rfid_tag': item['rfid_tag'],
+                'device_id': item['device_id'],
+                'camera_position': item['camera_position'],
+                'image_path': item['image_path'],
+                'result': result,
+                'status': STATUS_PENDING if run_async else STATUS_DONE,
+                'client_id': item['client_id']
+            }
+            for item, result in zip(items, results)
+        ])
+    
+    responses = []
+    for item, result, record in zip(items, results, records):
+        if isinstance(record, DuplicateCapture):
+            response, _ = discard_duplicate(item['image_path'], record)
+        elif run_async:
+            estimation_queue.submit(record['id'], item['image_path'], item['device_id'])
+            CAPTURES.inc(status='queued')
+            response = {
+                'success': True,
+                'capture_id': record['id'],
+                'status': STATUS_PENDING,
+                'status_url': f"/api/captures/{record['id']}",
+                'rfid_tag': item['rfid_tag'],
+                'device_id': item['device_id'],
+                'camera_position': item['camera_position'],
+                'image_saved': item['image_path']
+            }
+        else:
+            response = capture_response(
+                item['device_id'], item['camera_position'], item['rfid_tag'],
+                item['image_path'], record, result
+            )
+        responses.append(response)
+    
+    return responses
 
 
 @app.route('/health', methods=['GET'])
@@ -58,7 +602,8 @@ def health_check():
     return jsonify({
         'status': 'ok',
         'service': 'FaceBoi Server',
-        'version': '1.0.0-mvp'
+        'version': '1.0.0-mvp',
+        'model_version': estimator.active.version
     })
 
 
@@ -73,11 +618,16 @@ def capture():
         "camera_position": "frontal",
         "rfid_tag": "A1B2C3D4",
         "image_base64": "...",
-        "timestamp": 1234567890
+        "timestamp": 1234567890,
+        "capture_id": "ESP32-CAM-001-1234567890-ab12"   (opcional)
     }
+    
+    Reenvios com o mesmo capture_id (ou mesmo device_id, rfid_tag e
+    timestamp) devolvem o resultado original sem reprocessar.
     """
     try:
-        data = request.get_json()
+        with stage('parse'):
+            data = request.get_json()
         
         # Valida campos obrigatórios
         required = ['device_id', 'rfid_tag', 'image_base64']
@@ -93,97 +643,302 @@ def capture():
         camera_position = data.get('camera_position', 'unknown')
         rfid_tag = data['rfid_tag']
         image_b64 = data['image_base64']
-        timestamp = data.get('timestamp', datetime.now().timestamp())
+        client_id = capture_key(data.get('capture_id'), device_id, rfid_tag, data.get('timestamp'))
+        
+        # Reenvio: devolve o resultado original sem decodificar nem estimar
+        if client_id:
+            original = find_original(client_id)
+            if original is not None:
+                response, status = duplicate_response(original)
+                return jsonify(response), status
         
         # Decodifica imagem
         try:
-            image_bytes = base64.b64decode(image_b64)
+            with stage('b64decode'):
+                image_bytes = base64.b64decode(image_b64)
         except Exception as e:
             return jsonify({
                 'success': False,
                 'error': f'Erro ao decodificar imagem: {e}'
             }), 400
         
+        if len(image_bytes) > MAX_IMAGE_MB * 1024 * 1024:
+            return jsonify({
+                'success': False,
+                'error': f'Imagem maior que {MAX_IMAGE_MB} MB'
+            }), 413
+        
         # Salva imagem
         image_path = save_image(rfid_tag, camera_position, image_bytes)
         
-        # Processa imagem e estima peso
-        result = estimator.process_image(image_bytes)
+        if wants_async():
+            response, status = enqueue_capture(device_id, camera_position, rfid_tag, image_path, client_id)
+        else:
+            response, status = process_capture(
+                device_id, camera_position, rfid_tag, image_path, image_bytes, client_id
+            )
         
-        # Carrega DB
-        db = load_database()
+        return jsonify(response), status
         
-        # Atualiza registro do animal
-        if rfid_tag not in db['cattle']:
-            db['cattle'][rfid_tag] = {
-                'rfid': rfid_tag,
-                'first_seen': datetime.now().isoformat(),
-                'weights': [],
-                'captures': []
-            }
+    except Exception as e:
+        print(f"[ERROR] {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/capture/raw', methods=['POST'])
+def capture_raw():
+    """
+    Recebe captura com a imagem JPEG binária no corpo
+    
+    Evita o base64 (+33% de bytes) e o JSON na ESP32. Metadados vão
+    em headers ou query params:
+        X-Device-Id / device_id
+        X-Camera-Position / camera_position
+        X-RFID-Tag / rfid_tag
+        X-Timestamp / timestamp
+        X-Capture-Id / capture_id  (chave de idempotência, opcional)
+    
+    Corpo: image/jpeg, ou multipart/form-data com o campo "image". No
+    multipart os metadados também podem ir em campos do formulário, mas
+    ler o formulário recebe o corpo inteiro: só acontece se device_id ou
+    rfid_tag não vieram nos headers/query, e então um reenvio não é
+    mais respondido antes da leitura do corpo.
+    """
+    try:
+        multipart = request.mimetype == 'multipart/form-data'
+        use_form = multipart and not all(
+            request.headers.get(header) or request.args.get(param)
+            for header, param in (('X-Device-Id', 'device_id'), ('X-RFID-Tag', 'rfid_tag'))
+        )
         
-        cattle = db['cattle'][rfid_tag]
-        cattle['last_seen'] = datetime.now().isoformat()
+        def meta(header, param, default=None):
+            value = request.headers.get(header) or request.args.get(param)
+            if not value and use_form:
+                value = request.form.get(param)
+            return value or default
         
-        # Registra captura
-        capture_record = {
-            'timestamp': datetime.now().isoformat(),
-            'device_id': device_id,
-            'camera_position': camera_position,
-            'image_path': image_path
-        }
-        
-        if result['success']:
-            capture_record['estimated_weight'] = result['estimated_weight']
-            capture_record['confidence'] = result.get('confidence', 0)
-            capture_record['features'] = result.get('features', {})
-            
-            # Adiciona ao histórico de pesos
-            cattle['weights'].append({
-                'date': datetime.now().isoformat(),
-                'weight': result['estimated_weight'],
-                'confidence': result.get('confidence', 0)
-            })
+        device_id = meta('X-Device-Id', 'device_id')
+        camera_position = meta('X-Camera-Position', 'camera_position', 'unknown')
+        rfid_tag = meta('X-RFID-Tag', 'rfid_tag')
+        client_timestamp = meta('X-Timestamp', 'timestamp')
+        
+        # Valida campos obrigatórios
+        for field, value in (('device_id', device_id), ('rfid_tag', rfid_tag)):
+            if not value:
+                return jsonify({
+                    'success': False,
+                    'error': f'Campo obrigatório ausente: {field}'
+                }), 400
+        
+        client_id = capture_key(
+            request.headers.get('X-Capture-Id') or meta('Idempotency-Key', 'capture_id'),
+            device_id, rfid_tag, client_timestamp
+        )
+        
+        # Reenvio: devolve o resultado original sem ler o corpo
+        if client_id:
+            original = find_original(client_id)
+            if original is not None:
+                response, status = duplicate_response(original)
+                return jsonify(response), status
+        
+        # Salva imagem direto do stream
+        if multipart:
+            upload = request.files.get('image')
+            if upload is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Campo obrigatório ausente: image'
+                }), 400
+            # O werkzeug já guardou a parte do arquivo: o tamanho é conhecido
+            upload.stream.seek(0, os.SEEK_END)
+            length = upload.stream.tell()
+            upload.stream.seek(0)
+            stream = upload.stream
+        else:
+            length, stream = request.content_length, request.stream
+        
+        try:
+            image_path, _ = save_image_stream(rfid_tag, camera_position, stream, length=length)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 413
+        
+        if image_path is None:
+            return jsonify({
+                'success': False,
+                'error': 'Imagem vazia ou incompleta'
+            }), 400
+        
+        if wants_async():
+            response, status = enqueue_capture(device_id, camera_position, rfid_tag, image_path, client_id)
+        else:
+            with stage('read_image'):
+                image_bytes = image_store.read(image_path)
             
-            # Mantém apenas últimos 100 registros
-            cattle['weights'] = cattle['weights'][-100:]
+            response, status = process_capture(
+                device_id, camera_position, rfid_tag, image_path, image_bytes, client_id
+            )
         
-        cattle['captures'].append(capture_record)
-        cattle['captures'] = cattle['captures'][-50:]  # Últimas 50 capturas
+        return jsonify(response), status
         
-        # Adiciona à lista geral de capturas
-        db['captures'].append({
-            'rfid_tag': rfid_tag,
-            **capture_record
-        })
-        db['captures'] = db['captures'][-500:]  # Últimas 500 capturas
+    except Exception as e:
+        print(f"[ERROR] {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/capture/batch', methods=['POST'])
+def capture_batch():
+    """
+    Recebe várias capturas numa única requisição (fila offline da ESP32)
+    
+    Formato application/x-faceboi-batch: para cada captura, uma linha
+    JSON com os metadados e o tamanho da imagem, seguida dos bytes JPEG:
+    
+        {"device_id": "...", "camera_position": "...", "rfid_tag": "...",
+         "capture_id": "...", "timestamp": 1234567890, "size": 51234}\n
+        <51234 bytes JPEG>
+        ...
+    
+    Também aceita application/json: {"captures": [<payload de /api/capture>, ...]}
+    
+    Cada imagem é gravada direto do stream; reenvios (mesma chave de
+    idempotência) devolvem o resultado original.
+    
+    Cada item de 'results' traz 'outcome': 'created' (gravada),
+    'duplicate' (já recebida antes), 'rejected' (inválida - campo
+    ausente, imagem vazia, ilegível ou grande demais; reenviar não
+    adianta) ou 'error' (falha do servidor; pode ser reenviada). Itens
+    depois de um cabeçalho inválido ou além de MAX_BATCH_SIZE não
+    aparecem e devem ser reenviados.
+    """
+    try:
+        items = []
+        responses = {}
         
-        # Salva DB
-        save_database(db)
+        def reject(index, error):
+            responses[index] = {'success': False, 'error': error, 'outcome': 'rejected'}
         
-        # Prepara resposta
-        response = {
-            'success': True,
-            'rfid_tag': rfid_tag,
-            'device_id': device_id,
-            'camera_position': camera_position,
-            'image_saved': image_path
-        }
-        
-        if result['success']:
-            response['estimated_weight'] = result['estimated_weight']
-            response['confidence'] = result.get('confidence', 0)
-            response['features'] = result.get('features', {})
+        def add_item(index, meta, save):
+            device_id = meta.get('device_id')
+            rfid_tag = meta.get('rfid_tag')
+            camera_position = meta.get('camera_position', 'unknown')
             
-            # Calcula média dos últimos pesos
-            recent_weights = [w['weight'] for w in cattle['weights'][-5:]]
-            response['average_weight'] = round(sum(recent_weights) / len(recent_weights), 1)
+            if not device_id or not rfid_tag:
+                save(None)
+                reject(index, 'Campo obrigatório ausente: device_id/rfid_tag')
+                return
+            
+            client_id = capture_key(meta.get('capture_id'), device_id, rfid_tag, meta.get('timestamp'))
+            
+            if client_id:
+                original = find_original(client_id)
+                if original is not None:
+                    save(None)
+                    responses[index], _ = duplicate_response(original)
+                    return
+            
+            try:
+                image_path = save((rfid_tag, camera_position))
+            except (binascii.Error, ValueError) as e:
+                reject(index, f'Imagem inválida: {e}')
+                return
+            if image_path is None:
+                reject(index, 'Imagem vazia ou incompleta')
+                return
+            
+            items.append({
+                'index': index,
+                'device_id': device_id,
+                'camera_position': camera_position,
+                'rfid_tag': rfid_tag,
+                'image_path': image_path,
+                'client_id': client_id
+            })
+        
+        if request.mimetype == 'application/json':
+            with stage('parse'):
+                captures = (request.get_json() or {}).get('captures', [])
+            
+            for index, meta in enumerate(captures[:MAX_BATCH_SIZE]):
+                def save(target, meta=meta):
+                    if target is None or not meta.get('image_base64'):
+                        return None
+                    with stage('b64decode'):
+                        image_bytes = base64.b64decode(meta['image_base64'], validate=True)
+                    if len(image_bytes) > MAX_IMAGE_MB * 1024 * 1024:
+                        raise ValueError(f'Imagem maior que {MAX_IMAGE_MB} MB')
+                    return save_image(*target, image_bytes)
+                add_item(index, meta, save)
         else:
-            response['weight_error'] = result.get('error', 'Erro desconhecido')
+            stream = request.stream
+            index = 0
+            
+            while index < MAX_BATCH_SIZE:
+                header = stream.readline()
+                if not header.strip():
+                    break
+                
+                try:
+                    meta = json.loads(header)
+                    size = int(meta.get('size', 0))
+                except ValueError:
+                    # Sem o tamanho não dá para achar a próxima captura
+                    reject(index, 'Cabeçalho inválido')
+                    break
+                
+                def save(target, size=size):
+                    if target is not None and size <= MAX_IMAGE_MB * 1024 * 1024:
+                        image_path, _ = save_image_stream(*target, stream, length=size)
+                        return image_path
+                    
+                    # Descarta os bytes da imagem sem gravar
+                    remaining = size
+                    while remaining > 0:
+                        chunk = stream.read(min(64 * 1024, remaining))
+                        if not chunk:
+                            break
+                        remaining -= len(chunk)
+                    
+                    if target is not None:
+                        raise ValueError(f'Imagem maior que {MAX_IMAGE_MB} MB')
+                    return None
+                
+                add_item(index, meta, save)
+                index += 1
+        
+        if items:
+            for item, response in zip(items, process_batch(items, wants_async())):
+                responses[item['index']] = response
+        
+        ordered = [responses[i] for i in sorted(responses)]
         
-        print(f"[Capture] {rfid_tag} | {camera_position} | Peso: {response.get('estimated_weight', 'N/A')} kg")
+        # Desfecho de cada item, para o cliente saber o que pode descartar
+        for response in ordered:
+            if 'outcome' in response:
+                continue
+            if not response.get('success'):
+                response['outcome'] = 'error'
+            elif response.get('duplicate'):
+                response['outcome'] = 'duplicate'
+            else:
+                response['outcome'] = 'created'
         
-        return jsonify(response)
+        print(f"[Capture] Lote com {len(ordered)} capturas")
+        
+        return jsonify({
+            'success': True,
+            'count': len(ordered),
+            'results': ordered
+        })
         
     except Exception as e:
         print(f"[ERROR] {e}")
@@ -193,99 +948,490 @@ def capture():
         }), 500
 
 
+@app.route('/api/devices/<device_id>/background', methods=['POST'])
+def learn_background(device_id):
+    """
+    Recebe um quadro do corredor vazio para a referência de fundo da câmera
+    
+    Corpo: image/jpeg, ou multipart/form-data com o campo "image". A
+    referência passa a ser usada na segmentação depois de
+    BACKGROUND_MIN_FRAMES quadros.
+    """
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        image_bytes = upload.read() if upload is not None else b''
+    else:
+        image_bytes = request.get_data()
+    
+    if not image_bytes:
+        return jsonify({
+            'success': False,
+            'error': 'Imagem vazia'
+        }), 400
+    
+    try:
+        background = estimator.learn_background(image_bytes, device_id)
+    except RuntimeError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 409
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Imagem inválida: {e}'
+        }), 400
+    
+    print(f"[Background] {device_id} | {background['frames']} quadros vazios")
+    
+    return jsonify({
+        'success': True,
+        'device_id': device_id,
+        'background': background
+    })
+
+
+@app.route('/api/devices/<device_id>/roi', methods=['GET', 'PUT'])
+def device_roi(device_id):
+    """
+    Região de interesse da câmera
+    
+    GET: ROI aprendida, capturas usadas e ROI manual.
+    PUT: {"roi": [x0, y0, x1, y1]} em frações do quadro (0-1) define uma
+    ROI manual, que substitui a aprendida; {"roi": null} volta à aprendida.
+    """
+    if request.method == 'GET':
+        state = estimator.roi_state(device_id)
+        if state is None:
+            return jsonify({
+                'success': False,
+                'error': 'ROI por câmera desligada (ROI_DIR vazio)'
+            }), 409
+        return jsonify({
+            'success': True,
+            'device_id': device_id,
+            'roi': state
+        })
+    
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or 'roi' not in data:
+        return jsonify({
+            'success': False,
+            'error': 'Envie {"roi": [x0, y0, x1, y1]} ou {"roi": null}'
+        }), 400
+    
+    fractions = data['roi']
+    try:
+        if fractions is not None and (not isinstance(fractions, list) or len(fractions) != 4):
+            raise ValueError('ROI deve ser uma lista [x0, y0, x1, y1]')
+        estimator.set_roi(device_id, fractions)
+    except RuntimeError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 409
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    print(f"[ROI] {device_id} | manual: {fractions}")
+    
+    return jsonify({
+        'success': True,
+        'device_id': device_id,
+        'roi': estimator.roi_state(device_id)
+    })
+
+
+@app.route('/api/models', methods=['GET'])
+def list_models():
+    """Versão do modelo em uso neste processo e versões do registro"""
+    return jsonify({
+        'success': True,
+        **estimator.models_info()
+    })
+
+
+@app.route('/api/models/<version>/activate', methods=['POST'])
+def activate_model(version):
+    """
+    Ativa uma versão do registro sem reiniciar o servidor
+    
+    A versão é carregada e aquecida aqui antes da troca (uma versão
+    inválida não é ativada); os demais processos trocam em até
+    MODEL_CHECK_SECONDS, sem perder capturas em andamento.
+    """
+    try:
+        model = estimator.activate_version(version)
+    except RuntimeError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 409
+    except FileNotFoundError:
+        return jsonify({
+            'success': False,
+            'error': f'Versão não encontrada: {version}'
+        }), 404
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Versão inválida: {e}'
+        }), 400
+    
+    print(f"[Models] Versão ativa: {version}")
+    
+    return jsonify({
+        'success': True,
+        'model': model
+    })
+
+
 @app.route('/api/cattle', methods=['GET'])
 def list_cattle():
-    """Lista todos os animais registrados"""
-    db = load_database()
-    
-    cattle_list = []
-    for rfid, data in db['cattle'].items():
-        cattle_info = {
-            'rfid': rfid,
-            'first_seen': data.get('first_seen'),
-            'last_seen': data.get('last_seen'),
-            'total_captures': len(data.get('captures', []))
-        }
-        
-        # Último peso
-        weights = data.get('weights', [])
-        if weights:
-            cattle_info['last_weight'] = weights[-1]['weight']
-            cattle_info['last_weight_date'] = weights[-1]['date']
-            
-            # Variação de peso
-            if len(weights) >= 2:
-                cattle_info['weight_change'] = round(weights[-1]['weight'] - weights[-2]['weight'], 1)
-        
-        cattle_list.append(cattle_info)
+    """
+    Lista os animais registrados, paginado
+    
+    Query: limit, cursor, since/until (last_seen), fields
+    """
+    try:
+        cattle_list, next_cursor = repository.list_cattle(**page_args())
+    except ValueError as e:
+        return bad_request(e)
     
     return jsonify({
         'success': True,
         'count': len(cattle_list),
-        'cattle': cattle_list
+        'cattle': cattle_list,
+        'next_cursor': next_cursor
     })
 
 
 @app.route('/api/cattle/<rfid_tag>', methods=['GET'])
 def get_cattle(rfid_tag):
     """Retorna detalhes de um animal específico"""
-    db = load_database()
+    cattle = repository.get_cattle(rfid_tag)
     
-    if rfid_tag not in db['cattle']:
+    if cattle is None:
         return jsonify({
             'success': False,
             'error': 'Animal não encontrado'
         }), 404
     
-    cattle = db['cattle'][rfid_tag]
-    
     return jsonify({
         'success': True,
         'cattle': cattle
     })
 
 
+@app.route('/api/cattle/<rfid_tag>/weights', methods=['GET'])
+def cattle_weights(rfid_tag):
+    """
+    Histórico de pesos de um animal (mais recente primeiro), paginado
+    
+    Query: limit, cursor, since/until (data do peso), fields
+    
+    Com resolution=day|week, retorna a série agregada (min/max/média/
+    contagem por período, em ordem cronológica) de todo o histórico,
+    inclusive o já compactado; os pesos brutos cobrem só os últimos
+    WEIGHT_RAW_DAYS dias.
+    """
+    resolution = request.args.get('resolution', 'raw')
+    
+    if resolution in ROLLUP_PERIODS:
+        try:
+            args = page_args()
+        except ValueError as e:
+            return bad_request(e)
+        
+        series = repository.weight_series(rfid_tag, resolution, args['since'], args['until'])
+        if series is None:
+            return jsonify({
+                'success': False,
+                'error': 'Animal não encontrado'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'rfid_tag': rfid_tag,
+            'resolution': resolution,
+            'count': len(series),
+            'weights': series
+        })
+    
+    if resolution != 'raw':
+        return bad_request(f'resolution={resolution}')
+    
+    try:
+        page = repository.weight_history(rfid_tag, **page_args())
+    except ValueError as e:
+        return bad_request(e)
+    
+    if page is None:
+        return jsonify({
+            'success': False,
+            'error': 'Animal não encontrado'
+        }), 404
+    
+    weights, next_cursor = page
+    
+    return jsonify({
+        'success': True,
+        'rfid_tag': rfid_tag,
+        'count': len(weights),
+        'weights': weights,
+        'next_cursor': next_cursor
+    })
+
+
 @app.route('/api/captures/recent', methods=['GET'])
 def recent_captures():
-    """Retorna capturas recentes"""
-    limit = request.args.get('limit', 20, type=int)
+    """
+    Retorna capturas recentes (mais recentes primeiro), paginado
     
-    db = load_database()
-    captures = db.get('captures', [])[-limit:]
-    captures.reverse()  # Mais recentes primeiro
+    Query: limit, cursor, since/until (timestamp), fields
+    """
+    try:
+        captures, next_cursor = repository.recent_captures(**page_args(default_limit=20))
+    except ValueError as e:
+        return bad_request(e)
     
     return jsonify({
         'success': True,
         'count': len(captures),
-        'captures': captures
+        'captures': captures,
+        'next_cursor': next_cursor
     })
 
 
-@app.route('/api/stats', methods=['GET'])
-def stats():
-    """Estatísticas gerais"""
-    db = load_database()
+@app.route('/api/captures/<int:capture_id>', methods=['GET'])
+def get_capture(capture_id):
+    """
+    Retorna uma captura (usado para acompanhar estimativas assíncronas)
+    
+    Com ?wait=N, aguarda até N segundos a estimativa terminar (long-poll).
+    """
+    wait = min(request.args.get('wait', 0, type=float), MAX_WAIT_SECONDS)
+    deadline = time.monotonic() + wait
+    
+    while True:
+        record = repository.get_capture(capture_id)
+        
+        if record is None:
+            return jsonify({
+                'success': False,
+                'error': 'Captura não encontrada'
+            }), 404
+        
+        remaining = deadline - time.monotonic()
+        if record.get('status') != STATUS_PENDING or remaining <= 0:
+            break
+        
+        # Captura de outro processo: consulta o banco periodicamente
+        if not estimation_queue.wait(capture_id, remaining):
+            time.sleep(min(0.25, max(remaining, 0)))
+    
+    return jsonify({
+        'success': True,
+        'capture_id': capture_id,
+        'status': record.get('status', 'done'),
+        'capture': record
+    })
+
+
+@app.route('/api/captures/<int:capture_id>/image', methods=['GET'])
+def capture_image(capture_id):
+    """
+    Retorna o JPEG de uma captura
+    
+    Os bytes vêm direto do mmap do segmento, em blocos, sem carregar a
+    imagem inteira em um buffer intermediário.
+    """
+    record = repository.get_capture(capture_id)
+    
+    try:
+        if record is None or not record.get('image_path'):
+            raise FileNotFoundError
+        data = image_store.read(record['image_path'])
+    except (OSError, ValueError):
+        return jsonify({
+            'success': False,
+            'error': 'Imagem não encontrada'
+        }), 404
+    
+    def chunks(view=data, size=64 * 1024):
+        for start in range(0, len(view), size):
+            yield bytes(view[start:start + size])
+    
+    return Response(chunks(), mimetype='image/jpeg', headers={
+        'Content-Length': str(len(data)),
+        # Uma captura nunca troca de imagem
+        'Cache-Control': 'private, max-age=86400, immutable'
+    })
+
+
+@app.route('/api/passes/<int:pass_id>', methods=['GET'])
+def get_pass(pass_id):
+    """Retorna uma passagem pelo corredor com o peso fundido e suas vistas"""
+    pass_record = repository.get_pass(pass_id)
+    
+    if pass_record is None:
+        return jsonify({
+            'success': False,
+            'error': 'Passagem não encontrada'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'pass': pass_record
+    })
+
+
+@app.route('/api/events', methods=['GET'])
+def events():
+    """
+    Feed ao vivo (Server-Sent Events) das capturas concluídas
+    
+    Cada evento 'capture' traz a captura (sem features) e, quando faz
+    parte de uma passagem, o peso fundido. Na reconexão o navegador
+    envia Last-Event-ID e recebe o que perdeu, se ainda estiver no
+    buffer; senão recebe um evento 'lagged' com o número de perdidos.
+    """
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    
+    try:
+        stream = broker.stream(last_id, heartbeat=EVENT_HEARTBEAT_SECONDS)
+    except TooManySubscribers:
+        return jsonify({
+            'success': False,
+            'error': 'Muitos clientes conectados'
+        }), 503
+    
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Desliga o buffer de proxies (nginx)
+    })
+
+
+def export_kinds():
+    """Tipos pedidos em ?kind= (separados por vírgula; padrão: todos)"""
+    value = request.args.get('kind')
+    if not value:
+        return list(EXPORT_KINDS)
+    kinds = [kind.strip() for kind in value.split(',') if kind.strip()]
+    unknown = [kind for kind in kinds if kind not in EXPORT_KINDS]
+    if unknown:
+        raise ValueError(f"kind={','.join(unknown)}")
+    return kinds
+
+
+@app.route('/api/export', methods=['GET'])
+def export():
+    """
+    Exporta o rebanho em fluxo (memória constante, transferência chunked)
+    
+    Query:
+        format: ndjson (padrão) ou csv (um único kind)
+        kind: cattle, weights, rollups, captures (padrão: todos, nesta ordem)
+        since: só registros com data >= since (sincronização incremental)
+        gzip=1: compacta (também com Accept-Encoding: gzip)
+    
+    Pesos com mais de WEIGHT_RAW_DAYS dias estão em 'rollups' (agregados
+    diários/semanais).
+    """
+    try:
+        kinds = export_kinds()
+        since = request.args.get('since')
+        since = parse_time(since) if since else None
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in ('ndjson', 'csv') or (export_format == 'csv' and len(kinds) != 1):
+            raise ValueError('format (csv exige um único kind)')
+    except ValueError as e:
+        return bad_request(e)
+    
+    if export_format == 'csv':
+        kind = kinds[0]
+        lines = csv_lines(repository.iter_records(kind, since), EXPORT_KINDS[kind][3])
+        mimetype = 'text/csv'
+    else:
+        lines = ndjson_lines(
+            (kind, record) for kind in kinds for record in repository.iter_records(kind, since)
+        )
+        mimetype = 'application/x-ndjson'
     
-    total_cattle = len(db.get('cattle', {}))
-    total_captures = len(db.get('captures', []))
+    chunks = encode_chunks(lines)
+    headers = {
+        'Content-Disposition': f"attachment; filename=faceboi-{'-'.join(kinds)}.{export_format}",
+        'Vary': 'Accept-Encoding'
+    }
+    
+    if request.args.get('gzip') == '1' or 'gzip' in request.accept_encodings:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    
+    return Response(chunks, mimetype=mimetype, headers=headers)
+
+
+@app.route('/api/import', methods=['POST'])
+def bulk_import():
+    """
+    Importa um arquivo no formato de /api/export (gzip aceito)
+    
+    O corpo é lido em fluxo e gravado em lotes de IMPORT_BATCH_SIZE
+    registros por transação. Reimportar o mesmo arquivo não duplica
+    pesos nem capturas.
     
-    # Calcula peso médio
-    all_weights = []
-    for cattle in db.get('cattle', {}).values():
-        weights = cattle.get('weights', [])
-        if weights:
-            all_weights.append(weights[-1]['weight'])
+    Query:
+        format: ndjson (padrão) ou csv
+        kind: tipo dos registros do CSV
+    """
+    export_format = request.args.get('format', 'ndjson')
+    kind = request.args.get('kind')
+    
+    if export_format == 'csv' and kind not in EXPORT_KINDS:
+        return bad_request('kind (obrigatório com format=csv)')
+    if export_format not in ('ndjson', 'csv'):
+        return bad_request('format')
+    
+    lines = text_lines(request.stream)
+    records = read_csv(lines, kind) if export_format == 'csv' else read_ndjson(lines)
+    
+    try:
+        counts = repository.import_records(records)
+    except (ValueError, zlib.error) as e:
+        return jsonify({
+            'success': False,
+            'error': f'Arquivo inválido: {e}'
+        }), 400
     
-    avg_weight = round(sum(all_weights) / len(all_weights), 1) if all_weights else 0
+    print(f"[Import] {counts}")
     
     return jsonify({
         'success': True,
-        'stats': {
-            'total_cattle': total_cattle,
-            'total_captures': total_captures,
-            'average_weight': avg_weight,
-            'weights_count': len(all_weights)
-        }
+        'imported': counts
+    })
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Métricas no formato texto do Prometheus
+    
+    faceboi_stage_seconds{stage}: parse, b64decode, dedupe, save_image,
+    read_image, decode, segment, background, features, estimate, cache,
+    db_write
+    """
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """Estatísticas gerais"""
+    return jsonify({
+        'success': True,
+        'stats': repository.stats()
     })
 
 
@@ -295,8 +1441,9 @@ if __name__ == '__main__':
     print("="*50)
     print(f"Host: {HOST}:{PORT}")
     print(f"Debug: {DEBUG}")
-    print(f"Uploads: {UPLOAD_FOLDER}")
+    print(f"Imagens: {UPLOAD_FOLDER}")
     print(f"Database: {DATABASE_FILE}")
     print("="*50 + "\n")
+    print("Servidor de desenvolvimento; em produção use: gunicorn -c gunicorn.conf.py\n")
     
-    app.run(host=HOST, port=PORT, debug=DEBUG)
+    app.run(host=HOST, port=PORT, debug=DEBUG, threaded=True)
@@ -0,0 +1,341 @@
+"""
+FaceBoi - Modelo de fundo por câmera
+Referência do corredor vazio aprendida para cada device_id
+
+As câmeras são fixas: tudo que não é o animal (cercas, chão, sombras
+fixas) é igual de uma captura para outra. Com uma referência do
+corredor vazio, a segmentação vira uma diferença absoluta com limiar,
+restrita à região que mudou, em vez do threshold adaptativo sobre o
+quadro inteiro (que pega cercas e sombras como "maior contorno").
+
+A referência é uma mediana móvel em escala de cinza e resolução
+reduzida (maior lado BACKGROUND_MAX_SIDE), guardada em um .npz por
+câmera (uint8, poucas dezenas de KB):
+    - quadros do corredor vazio (POST /api/devices/<id>/background)
+      atualizam a imagem inteira;
+    - cada captura segmentada atualiza os pixels fora do animal, então
+      a referência acompanha mudanças lentas de luz ao longo do dia.
+
+Enquanto uma câmera não tem quadros vazios suficientes, a segmentação
+usa o threshold adaptativo de sempre.
+"""
+
+import os
+import re
+import time
+import threading
+
+import numpy as np
+import cv2
+
+
+# Maior lado (px) da referência e da diferença
+BACKGROUND_MAX_SIDE = 320
+
+# Quadros vazios iniciais combinados por média; depois disso a
+# referência anda no máximo MEDIAN_STEP níveis de cinza por quadro
+# (mediana aproximada: um animal de passagem quase não a altera)
+WARMUP_FRAMES = 8
+MEDIAN_STEP = 2
+
+# Fração do quadro alterada acima da qual a referência é considerada
+# desatualizada (mudança de luz, câmera movida) e não é usada
+MAX_CHANGED_FRACTION = 0.9
+
+# Pixels ao redor do contorno que não entram na atualização (sombra)
+EXCLUDE_MARGIN = 5
+
+
+def _model_size(height, width, max_side):
+    """Tamanho (largura, altura) da referência para um quadro height x width"""
+    scale = min(1.0, max_side / max(height, width))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def reduced_gray(image, size):
+    """
+    Plano cinza de uma DecodedImage no tamanho da referência
+
+    Usa a redução do decodificador JPEG (até 1/8) e termina com INTER_AREA.
+    """
+    width, height = size
+    reduction = 1
+    while reduction < 8 and image.shape[1] / (reduction * 2) >= width:
+        reduction *= 2
+    gray = image.gray(reduction)
+    if gray.shape[:2] != (height, width):
+        gray = cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+    return gray
+
+
+class BackgroundModel:
+    """Referência do corredor vazio de uma câmera"""
+
+    def __init__(self, median, frames, source_shape):
+        """
+        Args:
+            median: numpy uint8 (altura, largura) na resolução reduzida
+            frames: quadros vazios já incorporados
+            source_shape: (altura, largura) dos quadros da câmera
+        """
+        self.median = median
+        self.frames = frames
+        self.source_shape = tuple(source_shape)
+        self.updated = time.time()
+
+    @property
+    def size(self):
+        return self.median.shape[1], self.median.shape[0]
+
+    def learn_empty(self, gray):
+        """Incorpora um quadro do corredor vazio"""
+        if self.frames < WARMUP_FRAMES:
+            # Média dos primeiros quadros
+            weight = 1.0 / (self.frames + 1)
+            self.median = cv2.addWeighted(self.median, 1.0 - weight, gray, weight, 0)
+        else:
+            self._step(gray, None)
+        self.frames += 1
+        self.updated = time.time()
+
+    def learn_around(self, gray, exclude):
+        """Incorpora os pixels de uma captura fora da máscara exclude (o animal)"""
+        self._step(gray, exclude)
+        self.updated = time.time()
+
+    def _step(self, gray, exclude):
+        """Passo da mediana aproximada: anda até MEDIAN_STEP em direção ao quadro"""
+        median = self.median.astype(np.int16)
+        delta = np.clip(gray.astype(np.int16) - median, -MEDIAN_STEP, MEDIAN_STEP)
+        if exclude is not None:
+            delta[exclude > 0] = 0
+        self.median = (median + delta).astype(np.uint8)
+
+    def foreground(self, gray, threshold, box=None):
+        """
+        Contorno principal do que mudou em relação à referência
+
+        Blur, limiar e morfologia rodam só no retângulo que contém os
+        pixels alterados.
+
+        Args:
+            box: (x0, y0, x1, y1) na resolução reduzida para olhar só
+                 dentro da ROI da câmera (None = quadro inteiro)
+
+        Returns:
+            numpy array: contorno na resolução reduzida, ou None (nada
+            mudou ou a referência parece desatualizada)
+        """
+        offset = np.zeros(2, dtype=np.int32)
+        median = self.median
+        if box is not None:
+            bx0, by0, bx1, by1 = box
+            gray, median = gray[by0:by1, bx0:bx1], median[by0:by1, bx0:bx1]
+            offset[:] = (bx0, by0)
+
+        diff = cv2.absdiff(gray, median)
+        _, changed = cv2.threshold(diff, threshold, 255, cv2.THRESH_BINARY)
+
+        points = cv2.findNonZero(changed)
+        if points is None:
+            return None
+        if len(points) > MAX_CHANGED_FRACTION * changed.size:
+            return None
+
+        x, y, w, h = cv2.boundingRect(points)
+        margin = 4
+        x0, y0 = max(x - margin, 0), max(y - margin, 0)
+        x1, y1 = min(x + w + margin, gray.shape[1]), min(y + h + margin, gray.shape[0])
+
+        region = cv2.GaussianBlur(diff[y0:y1, x0:x1], (5, 5), 0)
+        _, region = cv2.threshold(region, threshold, 255, cv2.THRESH_BINARY)
+
+        kernel = np.ones((3, 3), np.uint8)
+        region = cv2.morphologyEx(region, cv2.MORPH_OPEN, kernel)
+        region = cv2.morphologyEx(region, cv2.MORPH_CLOSE, kernel, iterations=2)
+
+        contours, _ = cv2.findContours(region, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return None
+
+        contour = max(contours, key=cv2.contourArea)
+        return contour + (np.array([x0, y0], dtype=contour.dtype) + offset.astype(contour.dtype))
+
+
+class BackgroundStore:
+    """
+    Referências de todas as câmeras, persistidas em um diretório
+
+    Cada processo (workers do gunicorn e da estimativa) tem sua cópia
+    em memória; as cópias são salvas no máximo a cada save_interval
+    segundos e recarregadas quando outro processo salva uma mais nova.
+    """
+
+    def __init__(self, directory, threshold=25, min_frames=3, max_side=BACKGROUND_MAX_SIDE,
+                 save_interval=60):
+        """
+        Args:
+            directory: pasta dos arquivos .npz
+            threshold: diferença de cinza (0-255) que conta como mudança
+            min_frames: quadros vazios antes de usar a referência
+            max_side: maior lado da referência em px
+            save_interval: intervalo mínimo entre gravações de uma câmera
+        """
+        self.directory = directory
+        self.threshold = threshold
+        self.min_frames = min_frames
+        self.max_side = max_side
+        self.save_interval = save_interval
+
+        self._models = {}  # device_id -> (modelo, mtime do arquivo, último save)
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, device_id):
+        safe = re.sub(r'[^A-Za-z0-9_.-]', '_', device_id)
+        return os.path.join(self.directory, f'{safe}.npz')
+
+    def get(self, device_id):
+        """Referência da câmera (recarregada se outro processo salvou uma nova), ou None"""
+        path = self._path(device_id)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+
+        with self._lock:
+            entry = self._models.get(device_id)
+            if entry is not None and (mtime is None or mtime <= entry[1]):
+                return entry[0]
+
+        if mtime is None:
+            return None
+
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                model = BackgroundModel(
+                    data['median'], int(data['frames']), tuple(int(v) for v in data['source_shape'])
+                )
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[Background] Erro ao carregar {path}: {e}")
+            return None
+
+        with self._lock:
+            self._models[device_id] = (model, mtime, time.time())
+        return model
+
+    def _save(self, device_id, model, force=False):
+        """Grava a referência (atômico) se passou save_interval desde a última gravação"""
+        with self._lock:
+            entry = self._models.get(device_id)
+            last_save = entry[2] if entry is not None else 0
+            if not force and time.time() - last_save < self.save_interval:
+                self._models[device_id] = (model, entry[1] if entry else 0, last_save)
+                return
+            median, frames = model.median.copy(), model.frames
+
+        path = self._path(device_id)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f, median=median, frames=np.int64(frames),
+                source_shape=np.array(model.source_shape, dtype=np.int64)
+            )
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._models[device_id] = (model, os.path.getmtime(path), time.time())
+
+    def generation(self, device_id, image):
+        """
+        Versão da referência usada para segmentar este quadro (None se não é usada)
+
+        É o mtime da última gravação ou carga do arquivo, igual em todos
+        os processos. Os passos da mediana a cada captura não a mudam:
+        ela anda no máximo a cada save_interval segundos.
+        """
+        if self.ready(device_id, image) is None:
+            return None
+        with self._lock:
+            entry = self._models.get(device_id)
+            return entry[1] if entry is not None else None
+
+    def ready(self, device_id, image):
+        """Referência pronta para um quadro deste tamanho, ou None"""
+        model = self.get(device_id)
+        if model is None or model.frames < self.min_frames or model.source_shape != image.shape:
+            return None
+        return model
+
+    def learn_empty(self, device_id, image):
+        """
+        Incorpora um quadro do corredor vazio (DecodedImage)
+
+        Um quadro de outro tamanho (câmera reconfigurada) recomeça a referência.
+
+        Returns:
+            BackgroundModel: referência atualizada
+        """
+        size = _model_size(*image.shape, self.max_side)
+        gray = reduced_gray(image, size)
+
+        model = self.get(device_id)
+        if model is None or model.source_shape != image.shape:
+            model = BackgroundModel(gray, 1, image.shape)
+        else:
+            with self._lock:
+                model.learn_empty(gray)
+
+        self._save(device_id, model, force=model.frames <= self.min_frames)
+        return model
+
+    def segment(self, device_id, image, roi=None):
+        """
+        Segmenta pela diferença para a referência
+
+        Args:
+            roi: (x0, y0, x1, y1) em pixels do quadro original (None = inteiro)
+
+        Returns:
+            numpy array: contorno em coordenadas da imagem original, ou
+            None se a câmera não tem referência pronta ou nada mudou
+        """
+        model = self.ready(device_id, image)
+        if model is None:
+            return None
+
+        gray = reduced_gray(image, model.size)
+        factors = np.array([image.shape[1] / gray.shape[1], image.shape[0] / gray.shape[0]],
+                           dtype=np.float32)
+
+        box = None
+        if roi is not None:
+            x0, y0, x1, y1 = roi
+            box = (int(x0 / factors[0]), int(y0 / factors[1]),
+                   int(np.ceil(x1 / factors[0])), int(np.ceil(y1 / factors[1])))
+
+        contour = model.foreground(gray, self.threshold, box)
+        if contour is None:
+            return None
+
+        return np.round(contour.astype(np.float32) * factors).astype(np.int32)
+
+    def learn_capture(self, device_id, image, contour):
+        """Atualiza a referência com os pixels de uma captura fora do animal"""
+        model = self.ready(device_id, image)
+        if model is None:
+            return
+
+        gray = reduced_gray(image, model.size)
+
+        factors = np.array([gray.shape[1] / image.shape[1], gray.shape[0] / image.shape[0]],
+                           dtype=np.float32)
+        scaled = np.round(contour.astype(np.float32) * factors).astype(np.int32)
+        exclude = np.zeros(gray.shape, dtype=np.uint8)
+        cv2.drawContours(exclude, [scaled], -1, 255, -1)
+        exclude = cv2.dilate(exclude, np.ones((3, 3), np.uint8), iterations=EXCLUDE_MARGIN)
+
+        with self._lock:
+            model.learn_around(gray, exclude)
+        self._save(device_id, model)
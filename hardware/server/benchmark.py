@@ -0,0 +1,252 @@
+"""
+FaceBoi - Benchmark do estimador de peso
+Mede o pipeline de WeightEstimator sobre as imagens de assets/
+
+Para cada variante (imagens originais e cópias redimensionadas para os
+FRAME_SIZES da ESP32, de QVGA a UXGA) roda process_image várias vezes
+com o cache desligado e reporta p50/p95 de cada etapa (as mesmas de
+faceboi_stage_seconds em /metrics), vazão por núcleo e pico de memória.
+
+Cada variante roda em um processo novo (spawn) com o OpenCV limitado a
+uma thread, então o pico de RSS é o da variante e os números não
+dependem do que rodou antes.
+
+Uso:
+    python benchmark.py --output bench.json
+    python benchmark.py --output novo.json --compare bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import multiprocessing
+from datetime import datetime
+
+import numpy as np
+import cv2
+
+
+DEFAULT_ASSETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'assets')
+
+# Resoluções da OV2640 (ver FRAME_SIZES em esp32/camera_module.py)
+FRAME_SIZES = {
+    'QVGA': (320, 240),
+    'CIF': (400, 296),
+    'VGA': (640, 480),
+    'SVGA': (800, 600),
+    'XGA': (1024, 768),
+    'SXGA': (1280, 1024),
+    'UXGA': (1600, 1200),
+}
+
+# Qualidade JPEG próxima da usada na ESP32 (quality=12 no sensor)
+JPEG_QUALITY = 85
+
+STAGES = ('decode', 'segment', 'features', 'estimate', 'total')
+
+
+def load_assets(directory):
+    """Lê as imagens JPEG de assets/ (subpastas boi1, boi2...) em ordem estável"""
+    images = []
+    for root, _, files in sorted(os.walk(directory)):
+        for name in sorted(files):
+            if name.lower().endswith(('.jpg', '.jpeg')):
+                with open(os.path.join(root, name), 'rb') as f:
+                    images.append((os.path.relpath(os.path.join(root, name), directory), f.read()))
+    return images
+
+
+def resize_variant(images, size):
+    """Reescala as imagens para o tamanho de quadro da câmera e recodifica em JPEG"""
+    width, height = size
+    variant = []
+    for name, image_bytes in images:
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        interpolation = cv2.INTER_AREA if image.shape[1] > width else cv2.INTER_CUBIC
+        resized = cv2.resize(image, (width, height), interpolation=interpolation)
+        ok, encoded = cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        variant.append((name, encoded.tobytes()))
+    return variant
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+def run_variant(images, repeat, warmup, estimator_options, model_path):
+    """
+    Executado no processo filho: mede uma variante
+
+    Returns:
+        dict: estatísticas por etapa, vazão e pico de RSS
+    """
+    import resource
+
+    cv2.setNumThreads(1)
+
+    from weight_model import WeightEstimator
+    estimator = WeightEstimator(model_path, cache_bytes=0, **estimator_options)
+
+    for _ in range(warmup):
+        for _, image_bytes in images:
+            estimator.process_image(image_bytes)
+
+    samples = {stage: [] for stage in STAGES}
+    failures = 0
+    cpu_start = time.process_time()
+
+    for _ in range(repeat):
+        for _, image_bytes in images:
+            start = time.perf_counter()
+            result = estimator.process_image(image_bytes)
+            elapsed = time.perf_counter() - start
+
+            if not result['success']:
+                failures += 1
+            for stage, seconds in result.get('timings', {}).items():
+                if stage in samples:
+                    samples[stage].append(seconds)
+            samples['total'].append(elapsed)
+
+    cpu_seconds = time.process_time() - cpu_start
+    count = len(samples['total'])
+
+    # ru_maxrss é em KiB no Linux e em bytes no macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+    return {
+        'runs': count,
+        'failures': failures,
+        'stages': {
+            stage: {
+                'p50_ms': round(percentile(values, 50) * 1000, 3),
+                'p95_ms': round(percentile(values, 95) * 1000, 3),
+                'mean_ms': round(float(np.mean(values)) * 1000, 3)
+            }
+            for stage, values in samples.items() if values
+        },
+        # Imagens por segundo de CPU: com uma thread, a vazão de um núcleo
+        'throughput_per_core': round(count / cpu_seconds, 2) if cpu_seconds else None,
+        'peak_rss_mb': round(peak_rss_mb, 1)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    """Imprime a variação de p50/p95 por etapa em relação a um resultado anterior"""
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+
+    previous = {v['variant']: v for v in baseline['variants']}
+
+    print(f"\nComparação com {baseline_path} (commit {baseline.get('commit')})")
+    for variant in current['variants']:
+        old = previous.get(variant['variant'])
+        if old is None:
+            continue
+        print(f"  {variant['variant']}")
+        for stage, stats in variant['stages'].items():
+            old_stats = old['stages'].get(stage)
+            if not old_stats:
+                continue
+            deltas = []
+            for key in ('p50_ms', 'p95_ms'):
+                change = (stats[key] - old_stats[key]) / old_stats[key] * 100 if old_stats[key] else 0
+                deltas.append(f"{key[:3]} {old_stats[key]:.2f} -> {stats[key]:.2f} ms ({change:+.1f}%)")
+            print(f"    {stage:<9} " + ' | '.join(deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do estimador de peso')
+    parser.add_argument('--assets', default=DEFAULT_ASSETS, help='Diretório das imagens')
+    parser.add_argument('--sizes', default=','.join(FRAME_SIZES),
+                        help='FRAME_SIZES a gerar (vazio = só as originais)')
+    parser.add_argument('--repeat', type=int, default=5, help='Passadas medidas por variante')
+    parser.add_argument('--warmup', type=int, default=1, help='Passadas de aquecimento')
+    parser.add_argument('--model', default=None, help='Modelo treinado (padrão: empírico)')
+    parser.add_argument('--segment-max-side', type=int, default=0)
+    parser.add_argument('--segment-refine', action='store_true')
+    parser.add_argument('--output', default=None, help='Arquivo JSON de resultados')
+    parser.add_argument('--compare', default=None, help='JSON de uma execução anterior')
+    args = parser.parse_args()
+
+    originals = load_assets(args.assets)
+    if not originals:
+        parser.error(f'Nenhuma imagem em {args.assets}')
+
+    sizes = [s.strip().upper() for s in args.sizes.split(',') if s.strip()]
+    unknown = [s for s in sizes if s not in FRAME_SIZES]
+    if unknown:
+        parser.error(f"Tamanhos desconhecidos: {', '.join(unknown)}")
+
+    variants = [('original', None, originals)]
+    variants += [(name, FRAME_SIZES[name], resize_variant(originals, FRAME_SIZES[name])) for name in sizes]
+
+    estimator_options = {
+        'segment_max_side': args.segment_max_side,
+        'segment_refine': args.segment_refine
+    }
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'images': [name for name, _ in originals],
+        'repeat': args.repeat,
+        'warmup': args.warmup,
+        'model': args.model,
+        'estimator_options': estimator_options,
+        'variants': []
+    }
+
+    # spawn: processo limpo por variante (pico de RSS isolado)
+    context = multiprocessing.get_context('spawn')
+
+    print(f"{'variante':<9} {'tamanho':>10} {'total p50':>10} {'p95':>8} {'img/s/núcleo':>13} {'RSS MB':>7}")
+
+    for name, size, images in variants:
+        with context.Pool(1) as pool:
+            stats = pool.apply(run_variant, (images, args.repeat, args.warmup, estimator_options, args.model))
+
+        stats.update({
+            'variant': name,
+            'size': list(size) if size else None,
+            'mean_jpeg_bytes': int(np.mean([len(b) for _, b in images]))
+        })
+        report['variants'].append(stats)
+
+        total = stats['stages']['total']
+        size_label = f'{size[0]}x{size[1]}' if size else '-'
+        print(f"{name:<9} {size_label:>10} {total['p50_ms']:>8.1f}ms {total['p95_ms']:>6.1f}ms "
+              f"{stats['throughput_per_core']:>13} {stats['peak_rss_mb']:>7}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResultados salvos em {args.output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+FaceBoi - Cache de resultados
+LRU de resultados do estimador indexado pelo hash do conteúdo da imagem
+
+Reenvios da ESP32 e reprocessamentos pelo dashboard mandam JPEGs
+idênticos byte a byte; com o cache eles não passam de novo pelo
+pipeline do OpenCV. A versão do modelo/calibração separa as entradas,
+então trocar o modelo ou a calibração invalida as antigas; a chave
+(WeightEstimator.cache_key) junta ao hash a câmera, o recorte da ROI e
+a versão gravada da referência de fundo usados na segmentação.
+"""
+
+import os
+import copy
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def content_hash(image_bytes):
+    """SHA-256 hexadecimal dos bytes da imagem"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache LRU limitado pelo tamanho (em bytes) dos resultados em memória,
+    com persistência opcional em disco (um JSON por entrada).
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, directory=None):
+        """
+        Args:
+            max_bytes: tamanho máximo aproximado das entradas em memória
+            directory: diretório para persistir resultados (None = só memória)
+        """
+        self.max_bytes = max_bytes
+        self.directory = directory
+
+        self._entries = OrderedDict()
+        self._size = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _check_version(self, version):
+        """Descarta a memória quando a versão do modelo muda"""
+        if version != self._version:
+            self._entries.clear()
+            self._size = 0
+            self._version = version
+
+    def _path(self, key, version):
+        return os.path.join(self.directory, version, key[:2], f"{key}.json")
+
+    def get(self, key, version):
+        """Retorna uma cópia do resultado em cache, ou None"""
+        with self._lock:
+            self._check_version(version)
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[0])
+
+        if self.directory:
+            try:
+                with open(self._path(key, version), 'r') as f:
+                    result = json.load(f)
+            except (OSError, ValueError):
+                result = None
+
+            if result is not None:
+                self._remember(key, version, copy.deepcopy(result), json.dumps(result))
+                with self._lock:
+                    self.hits += 1
+                return result
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, version, result):
+        """Guarda um resultado (apenas estimativas bem-sucedidas)"""
+        if not result.get('success'):
+            return
+
+        encoded = json.dumps(result)
+        self._remember(key, version, copy.deepcopy(result), encoded)
+
+        if self.directory:
+            path = self._path(key, version)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Escrita atômica: outro processo nunca lê um arquivo pela metade
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(encoded)
+            os.replace(tmp_path, path)
+
+    def _remember(self, key, version, result, encoded):
+        size = len(key) + len(encoded)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._check_version(version)
+
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+
+            self._entries[key] = (result, size)
+            self._size += size
+
+            # Remove as entradas menos usadas
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        """Esvazia o cache em memória"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
@@ -7,15 +7,109 @@ load_dotenv()
 # Servidor
 HOST = os.getenv('HOST', '0.0.0.0')
 PORT = int(os.getenv('PORT', 5000))
-DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
+DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
 
-# Armazenamento de imagens
+# Produção (gunicorn -c gunicorn.conf.py): processos e threads por processo.
+# Cada dashboard conectado em /api/events ocupa uma thread (ver EVENT_MAX_CLIENTS).
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', os.cpu_count() or 1))
+WEB_THREADS = int(os.getenv('WEB_THREADS', 8))
+WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', 60))
+
+# Armazenamento de imagens: segmentos append-only em UPLOAD_FOLDER
+# (ver imagestore.py). JPEGs soltos de versões anteriores continuam legíveis.
+# IMAGE_SEGMENT_MB: tamanho a partir do qual um novo segmento é aberto
+# IMAGE_RETENTION_DAYS: dias que as imagens são mantidas (0 = para sempre)
+# IMAGE_COMPACT_RATIO: segmentos com menos que esta fração de bytes vivos
+# são reescritos na compactação (roda junto com a dos pesos)
+# MAX_IMAGE_MB: maior imagem aceita num upload (413 acima disso); também
+# limita a memória de um corpo chunked, que é juntado antes de gravar
 UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+IMAGE_SEGMENT_MB = int(os.getenv('IMAGE_SEGMENT_MB', 256))
+IMAGE_RETENTION_DAYS = int(os.getenv('IMAGE_RETENTION_DAYS', 0))
+IMAGE_COMPACT_RATIO = float(os.getenv('IMAGE_COMPACT_RATIO', 0.5))
+MAX_IMAGE_MB = int(os.getenv('MAX_IMAGE_MB', 8))
 
-# Modelo de peso
+# Modelo de peso (.npz convertido por weight_model.convert_model, ou .pkl)
 MODEL_PATH = os.getenv('MODEL_PATH', 'models/weight_model.pkl')
+
+# Registro de versões do modelo (ver model_registry.py); a versão ativa
+# do registro tem precedência sobre MODEL_PATH
+# MODEL_REGISTRY_DIR: diretório do registro (vazio = só MODEL_PATH)
+# MODEL_CHECK_SECONDS: intervalo com que cada processo confere a versão ativa
+MODEL_REGISTRY_DIR = os.getenv('MODEL_REGISTRY_DIR', 'models/registry') or None
+MODEL_CHECK_SECONDS = float(os.getenv('MODEL_CHECK_SECONDS', 5))
 MIN_IMAGES_FOR_ESTIMATION = 1  # Mínimo de imagens para estimar peso
 
-# Banco de dados (para MVP, usamos JSON simples)
-DATABASE_FILE = os.getenv('DATABASE_FILE', 'data/cattle_db.json')
+# Passagem pelo corredor: capturas do mesmo animal (de qualquer câmera)
+# dentro desta janela viram um único peso fundido (0 = um peso por imagem)
+PASS_WINDOW_SECONDS = int(os.getenv('PASS_WINDOW_SECONDS', 10))
+
+# Cache de resultados por hash da imagem (reenvios e reprocessamentos)
+# RESULT_CACHE_MB: limite em memória por processo (0 = desligado)
+# RESULT_CACHE_DIR: diretório para persistir o cache em disco (vazio = não persiste)
+RESULT_CACHE_MB = int(os.getenv('RESULT_CACHE_MB', 16))
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', '') or None
+
+# Segmentação em resolução reduzida (pirâmide gaussiana)
+# SEGMENT_MAX_SIDE: maior lado da cópia reduzida em px (0 = resolução total)
+# SEGMENT_REFINE: refina o contorno em resolução total dentro da ROI
+SEGMENT_MAX_SIDE = int(os.getenv('SEGMENT_MAX_SIDE', 0))
+SEGMENT_REFINE = os.getenv('SEGMENT_REFINE', 'False').lower() == 'true'
+
+# Segmentação por referência do corredor vazio, por câmera (ver background.py)
+# BACKGROUND_DIR: onde as referências são guardadas (vazio = desligado)
+# BACKGROUND_THRESHOLD: diferença de cinza (0-255) que conta como animal
+# BACKGROUND_MIN_FRAMES: quadros vazios antes de a referência ser usada
+BACKGROUND_DIR = os.getenv('BACKGROUND_DIR', 'data/backgrounds') or None
+BACKGROUND_THRESHOLD = int(os.getenv('BACKGROUND_THRESHOLD', 25))
+BACKGROUND_MIN_FRAMES = int(os.getenv('BACKGROUND_MIN_FRAMES', 3))
+
+# Região de interesse por câmera, aprendida das capturas (ver roi.py)
+# ROI_DIR: onde as ROIs são guardadas (vazio = quadro inteiro sempre)
+# ROI_MIN_SAMPLES: capturas segmentadas antes de a ROI aprendida ser usada
+ROI_DIR = os.getenv('ROI_DIR', 'data/roi') or None
+ROI_MIN_SAMPLES = int(os.getenv('ROI_MIN_SAMPLES', 20))
+
+# Extratores de características (ver features.py)
+# FEATURE_PLUGINS: módulos que registram extratores, separados por vírgula
+# FEATURE_EXTRA: características extras devolvidas/gravadas em cada captura
+FEATURE_PLUGINS = [m.strip() for m in os.getenv('FEATURE_PLUGINS', '').split(',') if m.strip()]
+FEATURE_EXTRA = [f.strip() for f in os.getenv('FEATURE_EXTRA', '').split(',') if f.strip()]
+
+# Estimativa assíncrona: a captura responde 202 e o peso é calculado
+# em um pool de processos (pode ser pedida por requisição com ?async=1)
+# ESTIMATION_WORKERS: processos de estimativa no servidor todo; sob o
+# gunicorn cada worker web tem ESTIMATION_WORKERS // WEB_WORKERS (mínimo 1)
+ASYNC_ESTIMATION = os.getenv('ASYNC_ESTIMATION', 'False').lower() == 'true'
+ESTIMATION_WORKERS = int(os.getenv('ESTIMATION_WORKERS', os.cpu_count() or 1))
+
+# Feed ao vivo (SSE) em /api/events, repassado entre os workers pela
+# tabela events do banco
+# EVENT_BUFFER_SIZE: eventos guardados para clientes lentos/reconectando
+# EVENT_MAX_CLIENTS: dashboards conectados ao mesmo tempo por worker
+# (padrão WEB_THREADS // 4). Cada um prende uma thread, então o valor é
+# limitado a WEB_THREADS // 2: metade das threads fica para a ingestão.
+# Com WEB_THREADS=1 (worker sync) o limite é 1 e um dashboard ocupa o
+# worker inteiro: as capturas seguem pelos outros workers
+# EVENT_POLL_SECONDS: intervalo de leitura dos eventos dos outros workers
+# EVENT_HEARTBEAT_SECONDS: intervalo do keep-alive
+EVENT_BUFFER_SIZE = int(os.getenv('EVENT_BUFFER_SIZE', 256))
+EVENT_MAX_CLIENTS = min(int(os.getenv('EVENT_MAX_CLIENTS', max(1, WEB_THREADS // 4))),
+                        max(1, WEB_THREADS // 2))
+EVENT_POLL_SECONDS = float(os.getenv('EVENT_POLL_SECONDS', 0.5))
+EVENT_HEARTBEAT_SECONDS = int(os.getenv('EVENT_HEARTBEAT_SECONDS', 15))
+
+# Banco de dados (SQLite em modo WAL)
+DATABASE_FILE = os.getenv('DATABASE_FILE', 'data/faceboi.db')
+
+# Retenção do histórico de pesos: pesos brutos viram médias diárias
+# (min/max/média/contagem) depois de WEIGHT_RAW_DAYS e as diárias viram
+# semanais depois de WEIGHT_DAILY_DAYS (0 = mantém o tier para sempre).
+# A compactação roda a cada WEIGHT_COMPACT_INTERVAL segundos (0 = nunca)
+WEIGHT_RAW_DAYS = int(os.getenv('WEIGHT_RAW_DAYS', 56))
+WEIGHT_DAILY_DAYS = int(os.getenv('WEIGHT_DAILY_DAYS', 730))
+WEIGHT_COMPACT_INTERVAL = int(os.getenv('WEIGHT_COMPACT_INTERVAL', 3600))
+
+# Banco JSON antigo - importado automaticamente se o SQLite estiver vazio
+LEGACY_DATABASE_FILE = os.getenv('LEGACY_DATABASE_FILE', 'data/cattle_db.json')
@@ -0,0 +1,246 @@
+"""
+FaceBoi - Eventos ao vivo
+Difusão das capturas concluídas para os dashboards conectados (SSE)
+
+Os eventos ficam num buffer circular de tamanho fixo compartilhado por
+todos os clientes; cada cliente guarda apenas a posição (número de
+sequência) do último evento que recebeu. Publicar é O(1) e nunca
+bloqueia a captura: um cliente lento só fica para trás e, se o buffer
+der a volta nele, recebe um evento 'lagged' e continua do mais antigo
+ainda disponível. A memória usada não depende do número de clientes.
+
+Sob o gunicorn cada worker é um processo: a captura que termina num
+worker precisa chegar aos dashboards conectados nos outros. Com um
+repositório, publicar só põe o evento numa fila em memória; uma thread
+de cada processo grava a fila na tabela events do SQLite a cada
+poll_interval segundos, numa única transação (fora do caminho da
+captura), e, se o processo tem clientes, lê a tabela e alimenta o
+buffer local. Os números de sequência são os ids da tabela, então
+Last-Event-ID vale em qualquer worker.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+
+
+class TooManySubscribers(Exception):
+    """Limite de clientes conectados atingido"""
+
+
+class EventBroker:
+    """Buffer circular de eventos com leitura por número de sequência"""
+
+    def __init__(self, buffer_size=256, max_subscribers=50, repository=None, poll_interval=0.5):
+        """
+        Args:
+            buffer_size: eventos mantidos para clientes atrasados/reconectando
+            max_subscribers: máximo de clientes conectados ao mesmo tempo
+            repository: CattleRepository que guarda os eventos para todos os
+                        processos (None = eventos só deste processo)
+            poll_interval: segundos entre leituras da tabela de eventos
+        """
+        self.max_subscribers = max_subscribers
+        self.repository = repository
+        self.poll_interval = poll_interval
+
+        self._events = deque(maxlen=buffer_size)
+        self._seq = 0
+        self._subscribers = 0
+        self._cond = threading.Condition()
+
+        self._outbox = []
+        self._tailing = False
+        self._thread = None
+        self._thread_pid = None
+        self._thread_lock = threading.Lock()
+
+    def publish(self, event_type, data):
+        """
+        Publica um evento para todos os clientes
+
+        O evento é serializado uma única vez, aqui; os clientes só
+        repassam o texto pronto. Com repositório, o evento vai para a
+        fila gravada na tabela pela thread de sincronização e chega aos
+        clientes (deste e dos outros processos) pela leitura da tabela.
+
+        Returns:
+            int: Número de sequência do evento (None com repositório:
+                 definido só quando a fila é gravada)
+        """
+        payload = json.dumps(data, default=str)
+
+        if self.repository is not None:
+            with self._thread_lock:
+                self._outbox.append((event_type, payload))
+            self._start_thread()
+            return None
+
+        with self._cond:
+            self._seq += 1
+            self._append(self._seq, event_type, payload)
+            return self._seq
+
+    def _append(self, seq, event_type, payload):
+        """Acrescenta um evento ao buffer e acorda os clientes (com _cond adquirido)"""
+        frame = f"id: {seq}\nevent: {event_type}\ndata: {payload}\n\n"
+        self._events.append((seq, frame))
+        self._seq = seq
+        self._cond.notify_all()
+
+    def _start_thread(self):
+        """Inicia a thread de sincronização com a tabela (uma por processo, depois do fork)"""
+        with self._thread_lock:
+            if self._thread is not None and self._thread_pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._sync, name='event-sync', daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _start_tail(self):
+        """
+        Carrega os eventos recentes da tabela e passa a acompanhá-la
+
+        Só acontece no primeiro cliente do processo.
+        """
+        with self._thread_lock:
+            if self._tailing:
+                return
+
+            last = self.repository.last_event_id()
+            recent = self.repository.events_after(max(0, last - self._events.maxlen),
+                                                  self._events.maxlen)
+            with self._cond:
+                for seq, event_type, payload in recent:
+                    self._append(seq, event_type, payload)
+                self._seq = max(self._seq, last)
+            self._tailing = True
+
+        self._start_thread()
+
+    def _sync(self):
+        """Grava os eventos publicados aqui e lê os publicados por qualquer processo"""
+        while True:
+            time.sleep(self.poll_interval)
+
+            with self._thread_lock:
+                pending, self._outbox = self._outbox, []
+            if pending:
+                try:
+                    self.repository.add_events(pending, keep=self._events.maxlen)
+                except Exception as e:
+                    print(f"[Events] Erro ao gravar eventos: {e}")
+                    # Tenta de novo na próxima volta, sem crescer além do buffer
+                    with self._thread_lock:
+                        self._outbox[:0] = pending
+                        del self._outbox[:-self._events.maxlen]
+
+            if not self._tailing:
+                continue
+
+            try:
+                rows = self.repository.events_after(self._seq, self._events.maxlen)
+            except Exception as e:
+                print(f"[Events] Erro ao ler eventos: {e}")
+                continue
+
+            if rows:
+                with self._cond:
+                    for seq, event_type, payload in rows:
+                        self._append(seq, event_type, payload)
+
+    def subscribers(self):
+        """Número de clientes conectados"""
+        with self._cond:
+            return self._subscribers
+
+    def read(self, after, timeout):
+        """
+        Aguarda eventos posteriores a after
+
+        Args:
+            after: número de sequência do último evento recebido
+            timeout: segundos de espera se não há nada novo
+
+        Returns:
+            tuple: (frames SSE novos, eventos perdidos por atraso,
+                    sequência do último frame)
+        """
+        with self._cond:
+            if self._seq <= after:
+                self._cond.wait_for(lambda: self._seq > after, timeout)
+
+            if not self._events or self._seq <= after:
+                return [], 0, after
+
+            # Eventos que já saíram do buffer
+            oldest = self._events[0][0]
+            missed = max(0, oldest - after - 1)
+
+            frames = [frame for seq, frame in self._events if seq > after]
+            return frames, missed, self._events[-1][0]
+
+    def stream(self, last_id=None, heartbeat=15):
+        """
+        Gerador de texto SSE para um cliente
+
+        Args:
+            last_id: Last-Event-ID enviado na reconexão (None = só eventos novos)
+            heartbeat: segundos entre comentários de keep-alive
+
+        Raises:
+            TooManySubscribers: limite de clientes atingido
+        """
+        with self._cond:
+            if self._subscribers >= self.max_subscribers:
+                raise TooManySubscribers()
+
+        if self.repository is not None:
+            self._start_tail()
+
+        with self._cond:
+            # Last-Event-ID à frente do atual (banco recriado): começa do atual
+            position = self._seq if last_id is None or last_id > self._seq else last_id
+
+        def generate():
+            nonlocal position
+
+            # Contado só quando o stream começa: um gerador fechado antes
+            # de iniciar não executa o finally
+            with self._cond:
+                self._subscribers += 1
+
+            try:
+                yield "retry: 2000\n\n"
+
+                while True:
+                    frames, missed, last = self.read(position, heartbeat)
+
+                    if missed:
+                        yield f"event: lagged\ndata: {json.dumps({'missed': missed})}\n\n"
+
+                    if not frames:
+                        # Keep-alive; também detecta cliente desconectado
+                        yield ": ping\n\n"
+                        continue
+
+                    position = last
+                    yield ''.join(frames)
+            finally:
+                with self._cond:
+                    self._subscribers -= 1
+
+        return generate()
+
+
+# Singleton para uso no servidor
+_broker = None
+
+def get_broker(**options):
+    """Retorna instância singleton do broker de eventos"""
+    global _broker
+    if _broker is None:
+        _broker = EventBroker(**options)
+    return _broker
@@ -0,0 +1,235 @@
+"""
+FaceBoi - Extratores de características
+Registro de características do contorno com dependências declaradas
+
+Cada característica é uma função registrada com @extractor, cujos
+parâmetros são as dependências (outras características ou as entradas
+'contour' e 'image'). Só o que o modelo ativo pede é calculado, na
+ordem das dependências, e resultados intermediários caros (casco
+convexo, retângulo rotacionado, elipse) são calculados uma única vez
+por imagem e compartilhados.
+
+Nomes iniciados por '_' são intermediários: podem ser dependência, mas
+não aparecem em extract(..., names=None).
+
+Para acrescentar uma característica (largura do quadril, profundidade
+pela câmera superior...), basta registrá-la em um módulo próprio e
+listá-lo em FEATURE_PLUGINS:
+
+    from features import extractor
+
+    @extractor('hip_width', requires=('contour', '_min_rect'))
+    def hip_width(contour, _min_rect):
+        ...
+"""
+
+import importlib
+import threading
+
+import numpy as np
+import cv2
+
+
+# Entradas fornecidas pelo chamador, disponíveis como dependência
+INPUTS = ('contour', 'image')
+
+
+class Extractor:
+    """Característica registrada: função e dependências (na ordem dos parâmetros)"""
+
+    def __init__(self, name, func, requires):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+
+
+_registry = {}
+_plans = {}  # tupla de nomes -> ordem de cálculo
+_lock = threading.Lock()
+
+
+def extractor(name, requires=()):
+    """
+    Decorador que registra uma característica
+
+    Args:
+        name: nome da característica (chave no dict de features)
+        requires: dependências, passadas à função nesta ordem
+
+    Raises:
+        ValueError: nome já registrado
+    """
+    def register(func):
+        with _lock:
+            if name in _registry or name in INPUTS:
+                raise ValueError(f'Característica já registrada: {name}')
+            _registry[name] = Extractor(name, func, requires)
+            _plans.clear()
+        return func
+    return register
+
+
+def available():
+    """Características públicas registradas (sem os intermediários)"""
+    return [name for name in _registry if not name.startswith('_')]
+
+
+def plan(names):
+    """
+    Ordem de cálculo (dependências primeiro) para obter names
+
+    Raises:
+        ValueError: característica desconhecida ou dependência circular
+    """
+    key = tuple(names)
+    order = _plans.get(key)
+    if order is not None:
+        return order
+
+    order = []
+    state = {}  # nome -> 'visiting' | 'done'
+
+    def visit(name, path):
+        if name in INPUTS or state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError(f"Dependência circular: {' -> '.join(path + [name])}")
+        if name not in _registry:
+            raise ValueError(f'Característica desconhecida: {name}')
+        state[name] = 'visiting'
+        for dependency in _registry[name].requires:
+            visit(dependency, path + [name])
+        state[name] = 'done'
+        order.append(_registry[name])
+
+    for name in key:
+        visit(name, [])
+
+    with _lock:
+        _plans[key] = order
+    return order
+
+
+def extract(image, contour, names=None):
+    """
+    Calcula as características pedidas de um contorno
+
+    Args:
+        image: DecodedImage ou numpy array (extratores que só usam o
+               tamanho não decodificam pixels)
+        contour: contorno do animal
+        names: características desejadas (None = todas as públicas)
+
+    Returns:
+        dict: nome -> valor, só com as características pedidas
+    """
+    if names is None:
+        names = available()
+
+    values = {'contour': contour, 'image': image}
+    for item in plan(names):
+        values[item.name] = item.func(*[values[dependency] for dependency in item.requires])
+
+    return {name: values[name] for name in names}
+
+
+def load_plugins(modules):
+    """Importa módulos que registram extratores (FEATURE_PLUGINS)"""
+    for module in modules:
+        importlib.import_module(module)
+        print(f"[Features] Plugin carregado: {module}")
+
+
+# ----------------------------------------------------------------------
+# Intermediários compartilhados
+# ----------------------------------------------------------------------
+
+@extractor('_bbox', requires=('contour',))
+def _bbox(contour):
+    return cv2.boundingRect(contour)
+
+
+@extractor('_min_rect', requires=('contour',))
+def _min_rect(contour):
+    """(largura, altura) do retângulo rotacionado, com largura >= altura"""
+    _, (width, height), _ = cv2.minAreaRect(contour)
+    if width < height:
+        width, height = height, width
+    return width, height
+
+
+@extractor('_hull', requires=('contour',))
+def _hull(contour):
+    return cv2.convexHull(contour)
+
+
+# ----------------------------------------------------------------------
+# Características
+# ----------------------------------------------------------------------
+
+@extractor('area', requires=('contour',))
+def area(contour):
+    return cv2.contourArea(contour)
+
+
+@extractor('perimeter', requires=('contour',))
+def perimeter(contour):
+    return cv2.arcLength(contour, True)
+
+
+@extractor('width', requires=('_min_rect',))
+def width(_min_rect):
+    return _min_rect[0]
+
+
+@extractor('height', requires=('_min_rect',))
+def height(_min_rect):
+    return _min_rect[1]
+
+
+@extractor('length', requires=('_min_rect',))
+def length(_min_rect):
+    """Comprimento do animal (maior lado do retângulo rotacionado)"""
+    return max(_min_rect)
+
+
+@extractor('bbox_width', requires=('_bbox',))
+def bbox_width(_bbox):
+    return _bbox[2]
+
+
+@extractor('bbox_height', requires=('_bbox',))
+def bbox_height(_bbox):
+    return _bbox[3]
+
+
+@extractor('aspect_ratio', requires=('_min_rect',))
+def aspect_ratio(_min_rect):
+    width, height = _min_rect
+    return width / height if height > 0 else 0
+
+
+@extractor('hull_area', requires=('_hull',))
+def hull_area(_hull):
+    return cv2.contourArea(_hull)
+
+
+@extractor('solidity', requires=('area', 'hull_area'))
+def solidity(area, hull_area):
+    """Convexidade: área do contorno / área do casco convexo"""
+    return area / hull_area if hull_area > 0 else 0
+
+
+@extractor('fill_ratio', requires=('area', 'image'))
+def fill_ratio(area, image):
+    """Proporção da imagem ocupada pelo animal"""
+    return area / (image.shape[0] * image.shape[1])
+
+
+@extractor('ellipse_area', requires=('contour',))
+def ellipse_area(contour):
+    """Área da elipse ajustada (0 se o contorno tem menos de 5 pontos)"""
+    if len(contour) < 5:
+        return 0
+    _, axes, _ = cv2.fitEllipse(contour)
+    return np.pi * (axes[0] / 2) * (axes[1] / 2)
@@ -0,0 +1,71 @@
+"""
+FaceBoi - Fusão de múltiplas vistas
+Combina as capturas de uma passagem do animal pelo corredor
+
+Cada passagem dispara até 4 câmeras (frontal, lateral_esq, lateral_dir,
+superior). Em vez de um peso por imagem, as estimativas de todas as
+vistas da mesma passagem viram um único peso, com confiança calculada
+a partir da concordância entre as vistas e da cobertura de posições.
+"""
+
+import numpy as np
+
+
+# Posições de câmera do corredor (ver CAMERA_POSITION na ESP32)
+CAMERA_POSITIONS = ('frontal', 'lateral_esq', 'lateral_dir', 'superior')
+
+# Dispersão relativa entre vistas a partir da qual a confiança vai a zero
+MAX_RELATIVE_SPREAD = 0.25
+
+
+def fuse_views(views):
+    """
+    Funde as estimativas de peso das vistas de uma passagem
+
+    Se uma mesma posição aparece mais de uma vez (reenvio), vale a última.
+
+    Args:
+        views: lista de dicts com 'camera_position', 'estimated_weight'
+               e 'confidence', em ordem de chegada
+
+    Returns:
+        dict: 'estimated_weight', 'confidence', 'views' e 'positions',
+              ou None se nenhuma vista tem peso
+    """
+    latest = {}
+    for view in views:
+        if view.get('estimated_weight') is None:
+            continue
+        latest[view.get('camera_position') or 'unknown'] = view
+
+    if not latest:
+        return None
+
+    weights = np.array([v['estimated_weight'] for v in latest.values()], dtype=np.float64)
+    confidences = np.array([v.get('confidence') or 0 for v in latest.values()], dtype=np.float64)
+
+    # Média ponderada pela confiança de cada vista
+    if confidences.sum() > 0:
+        fused = float(np.average(weights, weights=confidences))
+        spread = float(np.sqrt(np.average((weights - fused) ** 2, weights=confidences)))
+        base_confidence = float(np.average(confidences, weights=confidences))
+    else:
+        fused = float(weights.mean())
+        spread = float(weights.std())
+        base_confidence = 0.0
+
+    # Concordância: 1 quando as vistas coincidem, 0 com dispersão >= MAX_RELATIVE_SPREAD
+    relative_spread = spread / fused if fused > 0 else 1.0
+    agreement = max(0.0, 1.0 - relative_spread / MAX_RELATIVE_SPREAD)
+
+    # Cobertura: cada posição adicional reduz pela metade a incerteza restante
+    coverage = 1.0 - 0.5 ** len(latest)
+
+    confidence = base_confidence * (0.5 + 0.5 * coverage) * agreement
+
+    return {
+        'estimated_weight': round(fused, 1),
+        'confidence': round(confidence, 2),
+        'views': len(latest),
+        'positions': sorted(latest)
+    }
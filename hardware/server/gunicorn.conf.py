@@ -0,0 +1,63 @@
+# FaceBoi Server - Configuração do gunicorn (produção)
+#
+# Uso (a partir de hardware/server):
+#     gunicorn -c gunicorn.conf.py
+#
+# A aplicação é carregada uma vez no processo mestre (preload_app): o
+# estimador, o modelo e os módulos OpenCV/NumPy são importados antes do
+# fork e compartilhados pelos workers via copy-on-write.
+
+import os
+import gc
+import sys
+
+# Permite rodar de outro diretório (-c caminho/gunicorn.conf.py)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import (
+    HOST, PORT, WEB_WORKERS, WEB_THREADS, WEB_TIMEOUT, ASYNC_ESTIMATION, ESTIMATION_WORKERS
+)
+
+wsgi_app = 'app:app'
+bind = f'{HOST}:{PORT}'
+
+workers = WEB_WORKERS
+threads = WEB_THREADS
+worker_class = 'gthread' if WEB_THREADS > 1 else 'sync'
+timeout = WEB_TIMEOUT
+keepalive = 5
+
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+
+
+def pre_fork(server, worker):
+    """Executado no mestre antes de cada fork"""
+    import app
+
+    # O mestre abriu o SQLite ao carregar a aplicação (esquema, migração
+    # do JSON antigo); cada worker abre sua própria conexão
+    app.repository.close()
+
+    # Objetos já carregados não são mais visitados pelo GC nos workers,
+    # então suas páginas de memória continuam compartilhadas
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Executado no worker logo após o fork, antes de suas threads"""
+    import app
+
+    # ESTIMATION_WORKERS é o total do servidor, dividido entre os workers
+    # (senão seriam WEB_WORKERS x núcleos processos de estimativa)
+    share = max(1, ESTIMATION_WORKERS // WEB_WORKERS)
+
+    # Com a estimativa síncrona por padrão o pool só atende ?async=1 e é
+    # criado na primeira submissão, em vez de ficar parado em cada worker
+    if ASYNC_ESTIMATION:
+        app.estimation_queue.start(share)
+    else:
+        app.estimation_queue.max_workers = share
@@ -0,0 +1,385 @@
+"""
+FaceBoi - Arquivo de imagens
+Armazena as imagens das capturas em arquivos de segmento append-only
+
+Em vez de um JPEG por captura em uma pasta plana (um inode por imagem,
+listagens lentas com centenas de milhares de arquivos), as imagens são
+anexadas a segmentos grandes (seg-000001.pack, seg-000002.pack...). A
+posição de cada imagem vira um localizador gravado em
+captures.image_path, que funciona como índice por id de captura:
+
+    pack:seg-000001.pack:<offset do registro>:<tamanho da imagem>
+
+A leitura usa mmap e devolve um memoryview sobre o segmento, sem
+copiar os bytes; numpy/OpenCV decodificam direto dele. Caminhos que
+não começam com 'pack:' são arquivos soltos de versões anteriores e
+continuam legíveis pela mesma API.
+
+Formato de um registro no segmento:
+    MAGIC (4 bytes) | tamanho da chave (uint32) | tamanho dos dados (uint64)
+    | chave (nome original da imagem, utf-8) | dados (JPEG)
+"""
+
+import os
+import re
+import mmap
+import time
+import fcntl
+import struct
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+MAGIC = b'FBI1'
+HEADER = struct.Struct('<4sIQ')
+
+LOCATOR_PREFIX = 'pack:'
+SEGMENT_PATTERN = re.compile(r'^seg-(\d{6})\.pack$')
+
+# Segmentos mais novos que isto não são compactados: uma estimativa
+# assíncrona pode ainda estar lendo por um localizador antigo
+COMPACT_MIN_AGE = 24 * 3600
+
+# Segmentos mapeados ao mesmo tempo por processo (os menos usados são
+# desmapeados; um mapeamento aberto segura o espaço de um segmento apagado)
+MAX_MAPPED_SEGMENTS = 16
+
+
+def is_packed(locator):
+    """Indica se o localizador aponta para um segmento (e não um arquivo solto)"""
+    return bool(locator) and locator.startswith(LOCATOR_PREFIX)
+
+
+def parse_locator(locator):
+    """
+    Returns:
+        tuple: (segmento, offset, tamanho)
+
+    Raises:
+        ValueError: localizador inválido
+    """
+    try:
+        segment, offset, length = locator[len(LOCATOR_PREFIX):].split(':')
+        offset, length = int(offset), int(length)
+    except ValueError:
+        raise ValueError(f'Localizador inválido: {locator}')
+    if not SEGMENT_PATTERN.match(segment) or offset < 0 or length < 0:
+        raise ValueError(f'Localizador inválido: {locator}')
+    return segment, offset, length
+
+
+class ImageStore:
+    """
+    Segmentos append-only com leitura por mmap.
+
+    Seguro com várias threads e vários processos: cada escrita segura um
+    flock exclusivo do segmento ativo apenas durante o append (ou, em
+    put_stream, durante a reserva do espaço).
+    """
+
+    def __init__(self, directory, segment_max_bytes=256 * 1024 * 1024):
+        """
+        Args:
+            directory: pasta dos segmentos
+            segment_max_bytes: tamanho a partir do qual um novo segmento é aberto
+        """
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+
+        self._active = None
+        self._maps = OrderedDict()  # segmento -> (mmap, tamanho mapeado), LRU
+        self._write_lock = threading.Lock()
+        self._map_lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, segment):
+        return os.path.join(self.directory, segment)
+
+    def segments(self):
+        """Segmentos existentes, do mais antigo para o mais novo"""
+        return sorted(name for name in os.listdir(self.directory) if SEGMENT_PATTERN.match(name))
+
+    # ------------------------------------------------------------------
+    # Escrita
+    # ------------------------------------------------------------------
+
+    def _active_segment(self):
+        if self._active is None:
+            segments = self.segments()
+            self._active = segments[-1] if segments else 'seg-000001.pack'
+        return self._active
+
+    def _roll(self, full_segment):
+        """Abre o segmento seguinte (outro processo pode já tê-lo criado)"""
+        number = int(SEGMENT_PATTERN.match(full_segment).group(1)) + 1
+        try:
+            os.close(os.open(self._path(f'seg-{number:06d}.pack'), os.O_CREAT | os.O_EXCL, 0o644))
+        except FileExistsError:
+            pass
+        self._active = self.segments()[-1]
+
+    def put(self, key, data):
+        """
+        Anexa uma imagem ao segmento ativo
+
+        Args:
+            key: nome da imagem (guardado no registro para diagnóstico)
+            data: bytes (ou qualquer buffer) do JPEG
+
+        Returns:
+            str: Localizador da imagem
+        """
+        key_bytes = key.encode()
+        header = HEADER.pack(MAGIC, len(key_bytes), len(data))
+
+        with self._write_lock:
+            while True:
+                segment = self._active_segment()
+                fd = os.open(self._path(segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                    start = os.fstat(fd).st_size
+
+                    if start >= self.segment_max_bytes:
+                        self._roll(segment)
+                        continue
+
+                    _write_all(fd, [header, key_bytes, data])
+                finally:
+                    os.close(fd)  # Libera o flock
+
+                return f'{LOCATOR_PREFIX}{segment}:{start}:{len(data)}'
+
+    def put_stream(self, key, stream, length, chunk_size=64 * 1024):
+        """
+        Anexa uma imagem lida de um stream, sem juntá-la em memória
+
+        Sob o flock só se reserva o espaço do registro (o segmento cresce
+        até o fim dele); os blocos são gravados na reserva com pwrite
+        depois de liberá-lo, então um cliente lento não segura os outros
+        escritores. O cabeçalho é gravado por último: se o stream acabar
+        antes de length bytes, a reserva fica sem registro válido, nenhum
+        localizador aponta para ela e a compactação a descarta.
+
+        Args:
+            key: nome da imagem
+            stream: objeto com read(n)
+            length: tamanho da imagem em bytes (> 0)
+
+        Returns:
+            tuple: (localizador, ou None se o stream terminou antes; bytes lidos)
+        """
+        key_bytes = key.encode()
+        record_size = HEADER.size + len(key_bytes) + length
+
+        with self._write_lock:
+            while True:
+                segment = self._active_segment()
+                fd = os.open(self._path(segment), os.O_WRONLY | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                    start = os.fstat(fd).st_size
+
+                    if start < self.segment_max_bytes:
+                        os.ftruncate(fd, start + record_size)
+                        fcntl.flock(fd, fcntl.LOCK_UN)
+                        break
+
+                    self._roll(segment)
+                except BaseException:
+                    os.close(fd)
+                    raise
+                os.close(fd)
+
+        try:
+            position = start + HEADER.size + len(key_bytes)
+            received = 0
+            while received < length:
+                chunk = stream.read(min(chunk_size, length - received))
+                if not chunk:
+                    return None, received
+                _pwrite_all(fd, chunk, position + received)
+                received += len(chunk)
+
+            _pwrite_all(fd, HEADER.pack(MAGIC, len(key_bytes), length) + key_bytes, start)
+        finally:
+            os.close(fd)
+
+        return f'{LOCATOR_PREFIX}{segment}:{start}:{length}', length
+
+    def discard(self, locator):
+        """
+        Descarta uma imagem que não chegou a ser registrada
+
+        Em segmentos o espaço só é recuperado na compactação; arquivos
+        soltos são removidos.
+        """
+        if locator and not is_packed(locator):
+            try:
+                os.remove(locator)
+            except OSError:
+                pass
+
+    # ------------------------------------------------------------------
+    # Leitura
+    # ------------------------------------------------------------------
+
+    def _map(self, segment, end):
+        """mmap do segmento cobrindo pelo menos até end (remapeia se cresceu)"""
+        with self._map_lock:
+            entry = self._maps.get(segment)
+            if entry is None or entry[1] < end:
+                with open(self._path(segment), 'rb') as f:
+                    size = os.fstat(f.fileno()).st_size
+                    if size < end:
+                        raise ValueError(f'Imagem fora do segmento {segment}')
+                    # Views já entregues mantêm o mapeamento antigo vivo
+                    entry = (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), size)
+                self._maps[segment] = entry
+                while len(self._maps) > MAX_MAPPED_SEGMENTS:
+                    self._maps.popitem(last=False)
+            self._maps.move_to_end(segment)
+            return entry[0]
+
+    def read(self, locator):
+        """
+        Lê uma imagem sem copiar
+
+        Returns:
+            memoryview: bytes do JPEG (válido enquanto houver referência)
+
+        Raises:
+            FileNotFoundError, ValueError: imagem inexistente
+        """
+        if not is_packed(locator):
+            with open(locator, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return memoryview(b'')
+                return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+        key, data = self._read_record(locator)
+        return data
+
+    def _read_record(self, locator):
+        """Valida o cabeçalho do registro e retorna (chave, dados)"""
+        segment, offset, length = parse_locator(locator)
+        mapped = self._map(segment, offset + HEADER.size)
+
+        magic, key_length, data_length = HEADER.unpack_from(mapped, offset)
+        if magic != MAGIC or data_length != length:
+            raise ValueError(f'Registro inválido: {locator}')
+
+        start = offset + HEADER.size + key_length
+        mapped = self._map(segment, start + length)
+        key = bytes(mapped[offset + HEADER.size:start]).decode(errors='replace')
+        return key, memoryview(mapped)[start:start + length]
+
+    def _forget(self, segment):
+        with self._map_lock:
+            self._maps.pop(segment, None)
+
+    def prune(self):
+        """Desmapeia segmentos apagados pela compactação de outro processo"""
+        existing = set(self.segments())
+        with self._map_lock:
+            for segment in [s for s in self._maps if s not in existing]:
+                del self._maps[segment]
+
+    # ------------------------------------------------------------------
+    # Compactação
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def compaction_lock(self):
+        """
+        Lock exclusivo e não bloqueante da compactação entre processos
+
+        Yields:
+            bool: True se este processo deve compactar
+        """
+        fd = os.open(os.path.join(self.directory, 'compact.lock'), os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+            else:
+                yield True
+        finally:
+            os.close(fd)
+
+    def compaction_candidates(self, min_age=COMPACT_MIN_AGE):
+        """Segmentos selados (não ativos) com mais de min_age segundos"""
+        segments = self.segments()
+        now = time.time()
+        return [
+            segment for segment in segments[:-1]
+            if now - os.path.getmtime(self._path(segment)) >= min_age
+        ]
+
+    def segment_size(self, segment):
+        return os.path.getsize(self._path(segment))
+
+    def relocate(self, locators):
+        """
+        Copia imagens vivas de um segmento antigo para o segmento ativo
+
+        Um localizador que não aponta para um registro válido (importado
+        de outro servidor por uma versão anterior) não impede a
+        compactação: a imagem é dada como perdida.
+
+        Returns:
+            dict: localizador antigo -> localizador novo (None se inválido)
+        """
+        moved = {}
+        for locator in locators:
+            try:
+                key, data = self._read_record(locator)
+            except ValueError as e:
+                print(f"[Images] {e}")
+                moved[locator] = None
+                continue
+            moved[locator] = self.put(key, data)
+            del data
+        return moved
+
+    def remove_segment(self, segment):
+        """Apaga um segmento cujas imagens vivas já foram realocadas"""
+        if segment == self._active_segment():
+            raise ValueError('O segmento ativo não pode ser removido')
+        self._forget(segment)
+        os.remove(self._path(segment))
+
+
+def _write_all(fd, buffers):
+    """os.writev até gravar tudo (escritas parciais continuam no fim do arquivo)"""
+    views = [memoryview(b).cast('B') for b in buffers if len(b)]
+    while views:
+        written = os.writev(fd, views)
+        while views and written >= len(views[0]):
+            written -= len(views[0])
+            views.pop(0)
+        if views and written:
+            views[0] = views[0][written:]
+
+
+def _pwrite_all(fd, data, offset):
+    """os.pwrite até gravar tudo"""
+    view = memoryview(data).cast('B')
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+# Singleton para uso no servidor (e em cada worker de estimativa)
+_store = None
+
+def get_image_store(directory=None, **options):
+    """Retorna instância singleton do arquivo de imagens (directory na primeira chamada)"""
+    global _store
+    if _store is None:
+        _store = ImageStore(directory, **options)
+    return _store
@@ -0,0 +1,307 @@
+"""
+FaceBoi - Teste de carga
+Simula uma frota de corredores com ESP32-CAM enviando capturas
+
+Cada corredor tem uma câmera (ESP32) por posição; a cada passagem de
+um animal sorteado do rebanho, todas as câmeras do corredor enviam ao
+mesmo tempo o payload de send_to_server (esp32/main.py) para
+/api/capture. As passagens chegam como um processo de Poisson com a
+taxa pedida, independentemente de o servidor estar atrasado (a latência
+conta a partir do horário agendado do envio).
+
+Por padrão roda inteiramente offline, com a aplicação Flask carregada
+no próprio processo (banco e uploads em um diretório temporário); com
+--url, envia para um servidor já em execução.
+
+Uso:
+    python loadtest.py --chutes 4 --rate 0.5 --duration 30 --herd 200
+    python loadtest.py --url http://localhost:5000 --chutes 8 --frame-size VGA,SVGA
+"""
+
+import os
+import json
+import time
+import random
+import base64
+import tempfile
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmark import DEFAULT_ASSETS, FRAME_SIZES, load_assets, resize_variant
+
+
+# Posições das câmeras de um corredor (ver CAMERA_POSITION na ESP32)
+CAMERA_POSITIONS = ('frontal', 'lateral_esq', 'lateral_dir', 'superior')
+
+
+class LocalTarget:
+    """Aplicação Flask no próprio processo (sem rede)"""
+
+    def __init__(self, workdir, run_async):
+        # A configuração é lida do ambiente na importação de app.py
+        os.environ['DATABASE_FILE'] = os.path.join(workdir, 'faceboi.db')
+        os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+        os.environ['LEGACY_DATABASE_FILE'] = os.path.join(workdir, 'cattle_db.json')
+        os.environ.setdefault('WEIGHT_COMPACT_INTERVAL', '0')
+        os.chdir(workdir)
+
+        import app
+        self.app = app
+        self.query = '?async=1' if run_async else '?async=0'
+        self._local = threading.local()
+
+    def post(self, payload):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.app.test_client()
+        response = client.post('/api/capture' + self.query, json=payload)
+        return response.status_code, response.get_json()
+
+    def stats(self):
+        return self.app.repository.stats()
+
+    def cattle_capture_sum(self):
+        total = 0
+        cursor = None
+        while True:
+            page, cursor = self.app.repository.list_cattle(limit=1000, cursor=cursor)
+            total += sum(c['total_captures'] for c in page)
+            if cursor is None:
+                return total
+
+    def database_bytes(self):
+        return self.app.repository.size_bytes()
+
+    def pending(self):
+        return self.app.estimation_queue.pending()
+
+    def close(self):
+        self.app.estimation_queue.shutdown()
+
+
+class HttpTarget:
+    """Servidor em execução (urllib, uma conexão por requisição como a ESP32)"""
+
+    def __init__(self, url, run_async):
+        self.url = url.rstrip('/')
+        self.query = '?async=1' if run_async else '?async=0'
+
+    def _get(self, path):
+        with urllib.request.urlopen(self.url + path, timeout=30) as response:
+            return response.read()
+
+    def post(self, payload):
+        request = urllib.request.Request(
+            self.url + '/api/capture' + self.query,
+            data=json.dumps(payload).encode(),
+            headers={'Content-Type': 'application/json'}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+    def stats(self):
+        return json.loads(self._get('/api/stats'))['stats']
+
+    def cattle_capture_sum(self):
+        total = 0
+        cursor = ''
+        while True:
+            page = json.loads(self._get(f'/api/cattle?limit=1000&fields=total_captures{cursor}'))
+            total += sum(c['total_captures'] for c in page['cattle'])
+            if not page['next_cursor']:
+                return total
+            cursor = '&cursor=' + page['next_cursor']
+
+    def _gauge(self, name):
+        for line in self._get('/metrics').decode().splitlines():
+            if line.startswith(name + ' '):
+                return float(line.split()[1])
+        return None
+
+    def database_bytes(self):
+        return self._gauge('faceboi_database_bytes')
+
+    def pending(self):
+        return self._gauge('faceboi_queue_depth') or 0
+
+    def close(self):
+        pass
+
+
+class Fleet:
+    """Corredores enviando passagens de Poisson para o alvo"""
+
+    def __init__(self, target, images, chutes, cameras, herd, rate, duration, seed):
+        self.target = target
+        self.images = images
+        self.chutes = chutes
+        self.cameras = cameras
+        self.herd = [f'LOAD{i:05d}' for i in range(herd)]
+        self.rate = rate
+        self.duration = duration
+        self.random = random.Random(seed)
+
+        self.latencies = []
+        self.statuses = {}
+        self.accepted = 0
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    def _send(self, scheduled, payload):
+        try:
+            status, body = self.target.post(payload)
+        except Exception as e:
+            status, body = type(e).__name__, None
+
+        latency = time.perf_counter() - scheduled
+
+        with self._lock:
+            self.latencies.append(latency)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status in (200, 202) and body:
+                if body.get('duplicate'):
+                    self.duplicates += 1
+                else:
+                    self.accepted += 1
+
+    def _schedule(self):
+        """Agenda de envios: (instante relativo, corredor, rfid) por passagem"""
+        schedule = []
+        for chute in range(self.chutes):
+            t = self.random.expovariate(self.rate)
+            while t < self.duration:
+                schedule.append((t, chute, self.random.choice(self.herd)))
+                t += self.random.expovariate(self.rate)
+        return sorted(schedule)
+
+    def run(self):
+        schedule = self._schedule()
+        workers = self.chutes * self.cameras
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for offset, chute, rfid_tag in schedule:
+                delay = start + offset - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+                scheduled = start + offset
+                for camera in range(self.cameras):
+                    device_id = f'ESP32-CAM-{chute:03d}-{camera}'
+                    image_b64 = self.random.choice(self.images)
+                    payload = {
+                        'device_id': device_id,
+                        'camera_position': CAMERA_POSITIONS[camera % len(CAMERA_POSITIONS)],
+                        'rfid_tag': rfid_tag,
+                        'image_base64': image_b64,
+                        'timestamp': time.time(),
+                        'capture_id': f'{device_id}-{int(time.time())}-{self.random.getrandbits(32):08x}'
+                    }
+                    pool.submit(self._send, scheduled, payload)
+
+        return time.perf_counter() - start, len(schedule)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga com uma frota de ESP32 simulada')
+    parser.add_argument('--url', default=None, help='Servidor em execução (padrão: app no processo)')
+    parser.add_argument('--chutes', type=int, default=4, help='Corredores simulados')
+    parser.add_argument('--cameras', type=int, default=4, help='ESP32 por corredor')
+    parser.add_argument('--herd', type=int, default=100, help='Animais no rebanho')
+    parser.add_argument('--rate', type=float, default=0.5, help='Passagens por segundo por corredor')
+    parser.add_argument('--duration', type=float, default=30, help='Duração em segundos')
+    parser.add_argument('--frame-size', default='SVGA',
+                        help='FRAME_SIZES das imagens, separados por vírgula (ou "original")')
+    parser.add_argument('--assets', default=DEFAULT_ASSETS)
+    parser.add_argument('--async', dest='run_async', action='store_true',
+                        help='Estimativa assíncrona (?async=1)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None, help='Arquivo JSON de resultados')
+    args = parser.parse_args()
+
+    # Imagens em base64, como a ESP32 envia
+    originals = load_assets(args.assets)
+    images = []
+    for size in [s.strip().upper() for s in args.frame_size.split(',') if s.strip()]:
+        if size == 'ORIGINAL':
+            variant = originals
+        elif size in FRAME_SIZES:
+            variant = resize_variant(originals, FRAME_SIZES[size])
+        else:
+            parser.error(f'Tamanho desconhecido: {size}')
+        images += [base64.b64encode(image_bytes).decode() for _, image_bytes in variant]
+
+    if args.url:
+        target = HttpTarget(args.url, args.run_async)
+    else:
+        workdir = tempfile.mkdtemp(prefix='faceboi-load-')
+        print(f"[Load] Servidor local em {workdir}")
+        target = LocalTarget(workdir, args.run_async)
+
+    stats_before = target.stats()
+    db_before = target.database_bytes() or 0
+
+    fleet = Fleet(target, images, args.chutes, args.cameras, args.herd,
+                  args.rate, args.duration, args.seed)
+
+    print(f"[Load] {args.chutes} corredores x {args.cameras} câmeras, "
+          f"{args.rate} passagens/s por corredor, {args.duration:.0f}s")
+
+    elapsed, passes = fleet.run()
+
+    # Aguarda as estimativas assíncronas terminarem
+    while target.pending():
+        time.sleep(0.2)
+
+    stats_after = target.stats()
+    db_after = target.database_bytes() or 0
+    target.close()
+
+    sent = len(fleet.latencies)
+    stored = stats_after['total_captures'] - stats_before['total_captures']
+    errors = sum(count for status, count in fleet.statuses.items() if status not in (200, 202))
+    latencies = np.array(fleet.latencies) * 1000
+
+    report = {
+        'config': vars(args),
+        'passes': passes,
+        'requests': sent,
+        'elapsed_s': round(elapsed, 2),
+        'throughput_rps': round(sent / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'p50': round(float(np.percentile(latencies, 50)), 1),
+            'p95': round(float(np.percentile(latencies, 95)), 1),
+            'p99': round(float(np.percentile(latencies, 99)), 1),
+            'max': round(float(latencies.max()), 1)
+        } if sent else None,
+        'status_counts': {str(k): v for k, v in sorted(fleet.statuses.items(), key=str)},
+        'error_rate': round(errors / sent, 4) if sent else None,
+        'accepted': fleet.accepted,
+        'duplicates': fleet.duplicates,
+        'stored': stored,
+        # Capturas aceitas (200/202) que não aparecem no banco
+        'lost_updates': fleet.accepted - stored,
+        # Agregados por animal que divergem do total de capturas
+        'aggregate_mismatch': stats_after['total_captures'] - target.cattle_capture_sum(),
+        'db_growth_bytes': int(db_after - db_before),
+        'db_bytes_per_capture': round((db_after - db_before) / stored) if stored else None
+    }
+
+    print(json.dumps({k: v for k, v in report.items() if k != 'config'}, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"[Load] Resultados salvos em {args.output}")
+
+
+if __name__ == '__main__':
+    main()
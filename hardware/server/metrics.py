@@ -0,0 +1,224 @@
+"""
+FaceBoi - Métricas
+Histogramas de latência por etapa, contadores e gauges no formato texto
+do Prometheus (GET /metrics)
+
+Implementação mínima e sem dependências: cada processo do gunicorn tem
+seus próprios valores (o Prometheus distingue os workers pelo label
+instance/pid do alvo de coleta).
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+
+# Limites dos buckets de latência, em segundos
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contador monotônico com labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, _labels(self.label_names, key), value
+
+
+class Histogram:
+    """Histograma com buckets fixos e labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}  # labels -> [contagem por bucket..., soma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(entry)) for key, entry in self._values.items())
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                yield (
+                    f'{self.name}_bucket',
+                    _labels(self.label_names, key, ('le', _number(bound))),
+                    cumulative
+                )
+            yield f'{self.name}_sum', _labels(self.label_names, key), entry[-2]
+            yield f'{self.name}_count', _labels(self.label_names, key), entry[-1]
+
+
+class Gauge:
+    """Valor instantâneo lido de uma função no momento da coleta"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, function):
+        self.name = name
+        self.help = help
+        self.function = function
+
+    def samples(self):
+        try:
+            value = self.function()
+        except Exception:
+            return
+        if value is not None:
+            yield self.name, '', value
+
+
+class Registry:
+    """Conjunto de métricas expostas em /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, function):
+        return self.register(Gauge(name, help, function))
+
+    def render(self):
+        """Texto no formato de exposição do Prometheus (versão 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# Métricas do servidor
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    'faceboi_stage_seconds', 'Duração de cada etapa do processamento de uma captura', ('stage',)
+)
+REQUEST_SECONDS = registry.histogram(
+    'faceboi_request_seconds', 'Duração das requisições HTTP', ('endpoint', 'status')
+)
+CAPTURES = registry.counter(
+    'faceboi_captures_total', 'Capturas recebidas por resultado', ('status',)
+)
+FAILURES = registry.counter(
+    'faceboi_capture_failures_total', 'Estimativas que falharam por motivo', ('reason',)
+)
+CACHE_HITS = registry.counter(
+    'faceboi_cache_hits_total', 'Estimativas servidas pelo cache de resultados'
+)
+
+
+def observe_stages(timings):
+    """Registra nos histogramas as durações (segundos) de um dict etapa -> duração"""
+    for stage, seconds in (timings or {}).items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def count_result(result):
+    """Conta o resultado de uma estimativa (sucesso, falha por motivo, cache)"""
+    if result.get('success'):
+        CAPTURES.inc(status='done')
+    else:
+        CAPTURES.inc(status='failed')
+        FAILURES.inc(reason=result.get('reason', 'error'))
+
+    if 'cache' in (result.get('timings') or {}):
+        CACHE_HITS.inc()
+
+
+class Timings:
+    """
+    Tempo gasto em cada etapa de uma requisição
+
+    Cada etapa medida também vai para o histograma faceboi_stage_seconds.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, stage=name)
+
+    def merge(self, timings):
+        """Soma as etapas medidas pelo estimador (result['timings'])"""
+        for name, seconds in (timings or {}).items():
+            self.add(name, seconds)
+
+    def breakdown(self):
+        """Etapas e total em milissegundos (resposta com ?timings=1)"""
+        result = {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()}
+        result['total'] = round((time.perf_counter() - self.started) * 1000, 2)
+        return result
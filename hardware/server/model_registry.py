@@ -0,0 +1,407 @@
+"""
+FaceBoi - Registro de modelos
+Versões do modelo de peso com metadados, trocadas sem reiniciar o servidor
+
+Cada versão é um diretório com o artefato e um meta.json; o arquivo
+ACTIVE guarda o nome da versão em uso:
+
+    models/registry/
+        ACTIVE              v0002
+        v0001/
+            meta.json       {"features": [...], "calibration": {...},
+                             "trained_at": "...", "created_at": "...",
+                             "artifact": "model.npz", ...}
+            model.npz
+        v0002/
+            ...
+
+Uma versão sem artefato usa a fórmula empírica com a calibração do
+meta.json. Versões publicadas não são alteradas; trocar de modelo (ou
+voltar atrás) é só ativar outra versão.
+
+A troca é feita por processo: cada estimador (workers do gunicorn e do
+pool de estimativa) confere o ACTIVE no máximo a cada check_interval
+segundos, carrega e aquece a nova versão em segundo plano e só então a
+coloca em uso. Lotes em andamento terminam com a versão com que
+começaram e o peso gravado leva a versão que o calculou.
+
+Uso:
+    python model_registry.py publish modelo.pkl --npz --features area,perimeter,length,height,aspect_ratio,solidity,fill_ratio --trained-at 2026-10-01
+    python model_registry.py publish modelo.npz
+    python model_registry.py list
+    python model_registry.py activate v0002
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import pickle
+import shutil
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+
+import numpy as np
+
+import features as feature_extractors
+
+
+VERSION_PATTERN = re.compile(r'^v(\d{4,})$')
+ACTIVE_FILE = 'ACTIVE'
+META_FILE = 'meta.json'
+
+# Linhas da predição de aquecimento
+WARMUP_ROWS = 8
+
+
+def load_artifact(path):
+    """
+    Carrega o preditor de um artefato (objeto com predict(matriz))
+
+    .npz é o formato seguro (só arrays, predição sem sklearn; ver
+    weight_model.load_npz_model); .pkl é aceito por compatibilidade.
+
+    Raises:
+        ValueError: formato desconhecido
+    """
+    if path.endswith('.npz'):
+        # Importação tardia: weight_model importa este módulo
+        from weight_model import load_npz_model
+        return load_npz_model(path)
+    if path.endswith('.pkl'):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    raise ValueError(f'Formato de modelo desconhecido: {os.path.basename(path)}')
+
+
+class LoadedModel:
+    """
+    Versão carregada e pronta para predição
+
+    Não é alterada depois de criada; a troca de modelo substitui a
+    instância inteira, então um lote que guardou a referência continua
+    consistente (preditor, colunas e calibração da mesma versão).
+    """
+
+    def __init__(self, version, predictor, features, calibration=None, meta=None):
+        """
+        Args:
+            version: identificador gravado junto de cada peso
+            predictor: objeto com predict(matriz), ou None (fórmula empírica)
+            features: colunas da matriz de entrada, na ordem
+            calibration: ajustes da fórmula empírica
+            meta: metadados da versão (meta.json)
+        """
+        self.version = version
+        self.predictor = predictor
+        self.features = list(features)
+        self.calibration = dict(calibration or {})
+        self.meta = dict(meta or {})
+
+    def warm(self):
+        """
+        Valida o esquema de características e faz uma predição de teste
+
+        Também deixa pronto o plano de cálculo das características e faz
+        o preditor alocar o que precisar antes da primeira captura.
+
+        Raises:
+            ValueError: característica desconhecida ou predição inválida
+        """
+        feature_extractors.plan(self.features)
+
+        if self.predictor is None:
+            return
+
+        matrix = np.ones((WARMUP_ROWS, len(self.features)), dtype=np.float32)
+        weights = np.asarray(self.predictor.predict(matrix), dtype=np.float64)
+        if weights.shape != (WARMUP_ROWS,) or not np.all(np.isfinite(weights)):
+            raise ValueError(
+                f'Predição de teste inválida para {self.version}: formato {weights.shape}'
+            )
+
+    def info(self):
+        """Resumo para a API"""
+        return {
+            'version': self.version,
+            'features': self.features,
+            'empirical': self.predictor is None,
+            'trained_at': self.meta.get('trained_at')
+        }
+
+
+class ModelRegistry:
+    """Diretório de versões do modelo e versão ativa"""
+
+    def __init__(self, directory, check_interval=5):
+        """
+        Args:
+            directory: pasta do registro
+            check_interval: intervalo mínimo (s) entre consultas ao ACTIVE em poll()
+        """
+        self.directory = directory
+        self.check_interval = check_interval
+
+        self._next_check = 0
+        self._seen = None  # (inode, mtime) do ACTIVE na última consulta
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def _stamp(self):
+        """(inode, mtime) do ACTIVE: os.replace troca o inode mesmo no mesmo instante"""
+        try:
+            stat = os.stat(self._path(ACTIVE_FILE))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def versions(self):
+        """
+        Returns:
+            list: meta.json de cada versão (com 'version'), da mais antiga para a mais nova
+        """
+        names = sorted(
+            (name for name in os.listdir(self.directory) if VERSION_PATTERN.match(name)),
+            key=lambda name: int(VERSION_PATTERN.match(name).group(1))
+        )
+        versions = []
+        for name in names:
+            try:
+                versions.append(self.meta(name))
+            except (OSError, ValueError) as e:
+                print(f"[Models] Versão {name} ignorada: {e}")
+        return versions
+
+    def meta(self, version):
+        """
+        Raises:
+            FileNotFoundError: versão inexistente
+            ValueError: nome ou meta.json inválido
+        """
+        if not VERSION_PATTERN.match(version or ''):
+            raise ValueError(f'Versão inválida: {version}')
+        with open(self._path(version, META_FILE), 'r') as f:
+            meta = json.load(f)
+        if not isinstance(meta, dict):
+            raise ValueError(f'meta.json inválido em {version}')
+        meta['version'] = version
+        return meta
+
+    def active_version(self):
+        """Versão marcada como ativa, ou None"""
+        try:
+            with open(self._path(ACTIVE_FILE), 'r') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def poll(self):
+        """
+        Confere se o ACTIVE mudou (no máximo a cada check_interval segundos)
+
+        Returns:
+            str: versão ativa, se mudou desde a última consulta; senão None
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_check:
+                return None
+            self._next_check = now + self.check_interval
+
+            stamp = self._stamp()
+            if stamp == self._seen:
+                return None
+            self._seen = stamp
+
+        return self.active_version()
+
+    def load(self, version, empirical_features):
+        """
+        Carrega e aquece uma versão
+
+        Args:
+            empirical_features: colunas de uma versão sem artefato (fórmula empírica)
+
+        Returns:
+            LoadedModel
+
+        Raises:
+            FileNotFoundError: versão ou artefato inexistente
+            ValueError: metadados, esquema ou artefato inválido
+        """
+        meta = self.meta(version)
+
+        artifact = meta.get('artifact')
+        if artifact:
+            predictor = load_artifact(self._path(version, os.path.basename(artifact)))
+            columns = meta.get('features') or getattr(predictor, 'features', None)
+            if not columns:
+                raise ValueError(f'{version}: meta.json sem "features"')
+            if list(columns) != list(getattr(predictor, 'features', columns)):
+                raise ValueError(f'{version}: "features" do meta.json difere do artefato')
+        else:
+            predictor = None
+            columns = empirical_features
+
+        model = LoadedModel(version, predictor, columns, meta.get('calibration'), meta)
+        model.warm()
+        return model
+
+    def activate(self, version):
+        """Marca a versão como ativa (troca atômica do ACTIVE)"""
+        self.meta(version)
+
+        path = self._path(ACTIVE_FILE)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(version + '\n')
+        os.replace(tmp_path, path)
+
+        # Este processo já sabe da troca; poll() não deve recarregar
+        with self._lock:
+            self._seen = self._stamp()
+
+    def publish(self, artifact_path=None, features=None, calibration=None, trained_at=None,
+                notes=None):
+        """
+        Cria uma nova versão (não a ativa)
+
+        Args:
+            artifact_path: arquivo do modelo treinado (None = fórmula empírica)
+            features: colunas que o modelo espera, na ordem
+            calibration: ajustes da fórmula empírica
+            trained_at: data do treino (ISO 8601)
+            notes: texto livre (dados de treino, métricas...)
+
+        Returns:
+            str: nome da versão criada
+        """
+        if artifact_path and artifact_path.endswith('.npz'):
+            # O .npz guarda as próprias colunas
+            stored = load_artifact(artifact_path).features
+            if features and list(features) != stored:
+                raise ValueError(f'O artefato espera as características {stored}')
+            features = stored
+        if artifact_path and not features:
+            raise ValueError('Informe as características (features) que o modelo espera')
+        if features:
+            feature_extractors.plan(features)
+
+        existing = [int(VERSION_PATTERN.match(name).group(1))
+                    for name in os.listdir(self.directory) if VERSION_PATTERN.match(name)]
+        number = max(existing, default=0) + 1
+
+        # Outro processo pode publicar ao mesmo tempo: o mkdir decide
+        while True:
+            version = f'v{number:04d}'
+            try:
+                os.mkdir(self._path(version))
+                break
+            except FileExistsError:
+                number += 1
+
+        meta = {
+            'features': list(features) if features else None,
+            'calibration': calibration or {},
+            'trained_at': trained_at,
+            'created_at': datetime.now().isoformat(),
+            'artifact': None,
+            'notes': notes
+        }
+        if artifact_path:
+            meta['artifact'] = os.path.basename(artifact_path)
+            shutil.copyfile(artifact_path, self._path(version, meta['artifact']))
+
+        # meta.json por último: sem ele a versão não aparece em versions()
+        tmp_path = self._path(version, META_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, self._path(version, META_FILE))
+
+        return version
+
+
+def _publish(registry, args):
+    """Publica o artefato da linha de comando (convertendo .pkl para .npz com --npz)"""
+    features = [name.strip() for name in args.features.split(',') if name.strip()]
+    calibration = json.loads(args.calibration) if args.calibration else None
+
+    if not (args.npz and args.artifact and args.artifact.endswith('.pkl')):
+        return registry.publish(args.artifact, features, calibration, args.trained_at, args.notes)
+
+    from weight_model import FEATURE_NAMES, convert_model, save_npz_model
+
+    features = features or FEATURE_NAMES
+    with tempfile.TemporaryDirectory(prefix='faceboi-model-') as workdir:
+        artifact = os.path.join(workdir, 'model.npz')
+        save_npz_model(convert_model(load_artifact(args.artifact), features), artifact)
+        print(f"[Models] {args.artifact} convertido para .npz")
+        return registry.publish(artifact, features, calibration, args.trained_at, args.notes)
+
+
+def main():
+    from config import MODEL_REGISTRY_DIR, MODEL_CHECK_SECONDS
+
+    parser = argparse.ArgumentParser(description='Registro de versões do modelo de peso')
+    parser.add_argument('--registry', default=MODEL_REGISTRY_DIR, help='Diretório do registro')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    publish = commands.add_parser('publish', help='Publica uma nova versão')
+    publish.add_argument('artifact', nargs='?', default=None,
+                         help='Arquivo do modelo (omitido = fórmula empírica)')
+    publish.add_argument('--features', default='', help='Colunas do modelo, separadas por vírgula')
+    publish.add_argument('--calibration', default=None, help='JSON com ajustes da fórmula empírica')
+    publish.add_argument('--trained-at', default=None)
+    publish.add_argument('--notes', default=None)
+    publish.add_argument('--npz', action='store_true',
+                         help='Converte um .pkl do sklearn para .npz antes de publicar')
+    publish.add_argument('--activate', action='store_true', help='Ativa a versão publicada')
+
+    commands.add_parser('list', help='Lista as versões')
+
+    activate = commands.add_parser('activate', help='Ativa uma versão')
+    activate.add_argument('version')
+
+    args = parser.parse_args()
+    if not args.registry:
+        parser.error('MODEL_REGISTRY_DIR vazio: informe --registry')
+
+    registry = ModelRegistry(args.registry, check_interval=MODEL_CHECK_SECONDS)
+
+    if args.command == 'publish':
+        try:
+            version = _publish(registry, args)
+        except (OSError, ValueError) as e:
+            sys.exit(f"[Models] {e}")
+        print(f"[Models] Versão publicada: {version}")
+        if args.activate:
+            registry.activate(version)
+            print(f"[Models] Versão ativa: {version}")
+
+    elif args.command == 'list':
+        active = registry.active_version()
+        for meta in registry.versions():
+            marker = '*' if meta['version'] == active else ' '
+            print(f"{marker} {meta['version']}  {meta.get('artifact') or '(empírica)'}  "
+                  f"treino: {meta.get('trained_at') or '-'}  criada: {meta.get('created_at')}")
+
+    elif args.command == 'activate':
+        try:
+            # Falha aqui, e não nos servidores (que manteriam a versão anterior)
+            registry.load(args.version, empirical_features=[])
+            registry.activate(args.version)
+        except (OSError, ValueError) as e:
+            sys.exit(f"[Models] {e}")
+        print(f"[Models] Versão ativa: {args.version} (os servidores trocam em até "
+              f"{registry.check_interval}s)")
+
+
+if __name__ == '__main__':
+    main()
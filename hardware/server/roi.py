@@ -0,0 +1,188 @@
+"""
+FaceBoi - Região de interesse por câmera
+Retângulo do quadro onde o animal aparece, aprendido para cada device_id
+
+Cada câmera é fixa e só vê o animal numa parte conhecida do corredor
+(as laterais, por exemplo, nunca o veem no terço de cima). Com a ROI,
+blur, threshold, morfologia e busca de contornos rodam só no recorte;
+os contornos voltam para as coordenadas do quadro inteiro, então as
+features não mudam de referencial.
+
+A ROI aprendida é a união das bounding boxes dos contornos encontrados,
+com uma margem: cresce na hora quando um animal sai dela e encolhe
+devagar (ROI_SHRINK_RATE por captura), então um contorno espúrio não a
+deixa grande para sempre. Só é usada depois de min_samples capturas.
+Uma ROI manual (PUT /api/devices/<id>/roi) substitui a aprendida.
+
+Tudo em frações do quadro (0-1), então continua válido se a câmera
+mudar de resolução. Um JSON por câmera no diretório configurado.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+
+
+# Quanto cada lado da ROI aprendida anda em direção à bbox de uma
+# captura que cabe nela (encolhimento lento)
+ROI_SHRINK_RATE = 0.01
+
+# Grade (px) a que o recorte é alinhado, sempre para fora: a ROI
+# aprendida anda um pouco a cada captura, o recorte só muda ao cruzar
+# uma linha da grade (e com ele a chave do cache de resultados)
+ROI_GRID = 32
+
+
+class RoiStore:
+    """
+    ROIs de todas as câmeras, persistidas em um diretório
+
+    Como em BackgroundStore, cada processo tem sua cópia; as aprendidas
+    são gravadas no máximo a cada save_interval segundos e as manuais
+    na hora.
+    """
+
+    def __init__(self, directory, min_samples=20, margin=0.1, save_interval=60):
+        """
+        Args:
+            directory: pasta dos arquivos .json
+            min_samples: capturas antes de usar a ROI aprendida
+            margin: margem em torno da ROI aprendida (fração do lado)
+            save_interval: intervalo mínimo entre gravações de uma câmera
+        """
+        self.directory = directory
+        self.min_samples = min_samples
+        self.margin = margin
+        self.save_interval = save_interval
+
+        self._states = {}  # device_id -> (estado, mtime do arquivo, último save)
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, device_id):
+        safe = re.sub(r'[^A-Za-z0-9_.-]', '_', device_id)
+        return os.path.join(self.directory, f'{safe}.json')
+
+    def state(self, device_id):
+        """
+        Estado da câmera (recarregado se outro processo gravou um mais novo)
+
+        Returns:
+            dict: 'learned' [x0, y0, x1, y1] ou None, 'samples',
+                  'manual' [x0, y0, x1, y1] ou None
+        """
+        path = self._path(device_id)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+
+        with self._lock:
+            entry = self._states.get(device_id)
+            if entry is not None and (mtime is None or mtime <= entry[1]):
+                return entry[0]
+
+        state = {'learned': None, 'samples': 0, 'manual': None}
+        if mtime is not None:
+            try:
+                with open(path, 'r') as f:
+                    state.update(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"[ROI] Erro ao carregar {path}: {e}")
+
+        with self._lock:
+            self._states[device_id] = (state, mtime or 0, time.time())
+        return state
+
+    def _save(self, device_id, state, force=False):
+        with self._lock:
+            entry = self._states.get(device_id)
+            last_save = entry[2] if entry is not None else 0
+            if not force and time.time() - last_save < self.save_interval:
+                self._states[device_id] = (state, entry[1] if entry else 0, last_save)
+                return
+            data = json.dumps(state)
+
+        path = self._path(device_id)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._states[device_id] = (state, os.path.getmtime(path), time.time())
+
+    def box(self, device_id, shape):
+        """
+        ROI em pixels para um quadro (altura, largura), alinhada a ROI_GRID
+
+        Returns:
+            tuple: (x0, y0, x1, y1), ou None se não há ROI (quadro inteiro)
+        """
+        state = self.state(device_id)
+
+        fractions = state['manual']
+        if fractions is None:
+            if state['learned'] is None or state['samples'] < self.min_samples:
+                return None
+            x0, y0, x1, y1 = state['learned']
+            dx, dy = (x1 - x0) * self.margin, (y1 - y0) * self.margin
+            fractions = (x0 - dx, y0 - dy, x1 + dx, y1 + dy)
+
+        height, width = shape
+        x0, y0, x1, y1 = fractions
+        box = (
+            max(0, int(x0 * width) // ROI_GRID * ROI_GRID),
+            max(0, int(y0 * height) // ROI_GRID * ROI_GRID),
+            min(width, -(-int(round(x1 * width)) // ROI_GRID) * ROI_GRID),
+            min(height, -(-int(round(y1 * height)) // ROI_GRID) * ROI_GRID)
+        )
+        if box[2] - box[0] < 8 or box[3] - box[1] < 8 or box == (0, 0, width, height):
+            return None
+        return box
+
+    def learn(self, device_id, bbox, shape):
+        """
+        Incorpora a bounding box (x, y, w, h) do contorno de uma captura
+
+        Lados que a bbox ultrapassa crescem na hora; os demais encolhem
+        ROI_SHRINK_RATE em direção a ela.
+        """
+        height, width = shape
+        x, y, w, h = bbox
+        new = (x / width, y / height, (x + w) / width, (y + h) / height)
+
+        state = self.state(device_id)
+        with self._lock:
+            learned = state['learned']
+            if learned is None:
+                state['learned'] = list(new)
+            else:
+                grown = []
+                for i, (old, value) in enumerate(zip(learned, new)):
+                    outside = value < old if i < 2 else value > old
+                    grown.append(value if outside else old + (value - old) * ROI_SHRINK_RATE)
+                state['learned'] = grown
+            state['samples'] += 1
+
+        self._save(device_id, state, force=state['samples'] == self.min_samples)
+
+    def set_manual(self, device_id, fractions):
+        """
+        Define (ou remove, com None) a ROI manual da câmera
+
+        Raises:
+            ValueError: retângulo fora de [0, 1] ou vazio
+        """
+        if fractions is not None:
+            x0, y0, x1, y1 = (float(v) for v in fractions)
+            if not (0 <= x0 < x1 <= 1 and 0 <= y0 < y1 <= 1):
+                raise ValueError('ROI deve ser [x0, y0, x1, y1] com 0 <= x0 < x1 <= 1 e 0 <= y0 < y1 <= 1')
+            fractions = [x0, y0, x1, y1]
+
+        state = dict(self.state(device_id), manual=fractions)
+        self._save(device_id, state, force=True)
+        return state
@@ -0,0 +1,1401 @@
+"""
+FaceBoi - Armazenamento
+Repositório SQLite (modo WAL) para animais, pesos e capturas
+
+Substitui o antigo banco JSON, que era lido e reescrito por inteiro a
+cada captura. Cada inserção agora é O(1) e as consultas usam índices
+por rfid_tag e timestamp.
+
+Os agregados lidos pelo dashboard (último peso e variação de cada
+animal, contagem de capturas, média do rebanho) são mantidos na mesma
+transação que grava a captura, em colunas de cattle e na linha única de
+herd_stats, então /api/stats e /api/cattle não varrem o histórico.
+
+O histórico de pesos não tem limite de tamanho: pesos brutos ficam por
+algumas semanas e depois viram agregados diários (min/max/média/contagem)
+em weight_rollups, que por sua vez viram agregados semanais (ver
+compact_weights). Cada animal ocupa um trecho contíguo da chave primária
+de weight_rollups, então consultas de anos de histórico leem poucas
+páginas.
+"""
+
+import os
+import json
+import base64
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from fusion import fuse_views
+from imagestore import is_packed
+from transfer import legacy_records
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cattle (
+    rfid        TEXT PRIMARY KEY,
+    first_seen  TEXT NOT NULL,
+    last_seen   TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS weights (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    rfid_tag    TEXT NOT NULL REFERENCES cattle(rfid),
+    date        TEXT NOT NULL,
+    weight      REAL NOT NULL,
+    confidence  REAL,
+    pass_id     INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS captures (
+    id               INTEGER PRIMARY KEY AUTOINCREMENT,
+    rfid_tag         TEXT NOT NULL REFERENCES cattle(rfid),
+    timestamp        TEXT NOT NULL,
+    device_id        TEXT,
+    camera_position  TEXT,
+    image_path       TEXT,
+    estimated_weight REAL,
+    confidence       REAL,
+    features         TEXT,
+    status           TEXT NOT NULL DEFAULT 'done',
+    error            TEXT,
+    pass_id          INTEGER,
+    client_id        TEXT
+);
+
+CREATE TABLE IF NOT EXISTS passes (
+    id               INTEGER PRIMARY KEY AUTOINCREMENT,
+    rfid_tag         TEXT NOT NULL REFERENCES cattle(rfid),
+    started_at       TEXT NOT NULL,
+    updated_at       TEXT NOT NULL,
+    weight_id        INTEGER,
+    estimated_weight REAL,
+    confidence       REAL,
+    views            INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS herd_stats (
+    id              INTEGER PRIMARY KEY CHECK (id = 1),
+    total_cattle    INTEGER NOT NULL DEFAULT 0,
+    total_captures  INTEGER NOT NULL DEFAULT 0,
+    weights_count   INTEGER NOT NULL DEFAULT 0,
+    weight_sum      REAL NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS weight_rollups (
+    rfid_tag    TEXT NOT NULL,
+    period      TEXT NOT NULL,
+    bucket      TEXT NOT NULL,
+    count       INTEGER NOT NULL,
+    weight_sum  REAL NOT NULL,
+    min_weight  REAL NOT NULL,
+    max_weight  REAL NOT NULL,
+    PRIMARY KEY (rfid_tag, period, bucket)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS events (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    type        TEXT NOT NULL,
+    payload     TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_cattle_first_seen ON cattle(first_seen, rfid);
+CREATE INDEX IF NOT EXISTS idx_cattle_last_seen ON cattle(last_seen);
+CREATE INDEX IF NOT EXISTS idx_weights_rfid_date ON weights(rfid_tag, date);
+CREATE INDEX IF NOT EXISTS idx_captures_rfid_ts ON captures(rfid_tag, timestamp);
+CREATE INDEX IF NOT EXISTS idx_captures_ts ON captures(timestamp);
+CREATE INDEX IF NOT EXISTS idx_captures_image ON captures(image_path);
+CREATE INDEX IF NOT EXISTS idx_passes_rfid_started ON passes(rfid_tag, started_at);
+"""
+
+# Colunas adicionadas depois da criação do esquema: (tabela, coluna, definição)
+MIGRATIONS = [
+    ('captures', 'status', "TEXT NOT NULL DEFAULT 'done'"),
+    ('captures', 'error', 'TEXT'),
+    ('captures', 'pass_id', 'INTEGER'),
+    ('weights', 'pass_id', 'INTEGER'),
+    ('captures', 'client_id', 'TEXT'),
+    ('cattle', 'total_captures', 'INTEGER NOT NULL DEFAULT 0'),
+    ('cattle', 'last_weight_id', 'INTEGER'),
+    ('cattle', 'last_weight', 'REAL'),
+    ('cattle', 'last_weight_date', 'TEXT'),
+    ('cattle', 'prev_weight_id', 'INTEGER'),
+    ('cattle', 'prev_weight', 'REAL'),
+    ('weights', 'model_version', 'TEXT'),
+    ('captures', 'model_version', 'TEXT'),
+]
+
+# Índices sobre colunas de MIGRATIONS (criados depois da migração)
+MIGRATED_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_captures_pass ON captures(pass_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_captures_client
+    ON captures(client_id) WHERE client_id IS NOT NULL;
+"""
+
+# Estados de uma captura
+STATUS_PENDING = 'pending'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+# Limites de histórico retornados em /api/cattle/<rfid_tag>
+# (o banco guarda tudo; os limites valem apenas para a resposta)
+MAX_WEIGHTS_RETURNED = 100
+MAX_CAPTURES_RETURNED = 50
+
+# Retenção do histórico de pesos (ver compact_weights)
+# Pesos brutos viram agregados diários depois de RAW_WEIGHT_DAYS e os
+# diários viram semanais depois de DAILY_ROLLUP_DAYS
+RAW_WEIGHT_DAYS = 56
+DAILY_ROLLUP_DAYS = 730
+
+# Períodos de agregação: expressões SQL que levam uma data ao início do
+# período e ao início do período seguinte (semanas começam na segunda)
+ROLLUP_PERIODS = {
+    'day': ("date({})", "date({}, '+1 day')"),
+    'week': ("date({}, 'weekday 0', '-6 days')", "date({}, 'weekday 0', '+1 day')")
+}
+
+# Paginação das listagens (limit/cursor)
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Exportação/importação em massa (ver iter_records e import_records):
+# tipo de registro -> (tabela, chave da paginação, coluna de data, colunas)
+EXPORT_KINDS = {
+    'cattle': ('cattle', ('rfid',), 'last_seen', ('rfid', 'first_seen', 'last_seen')),
+    'weights': (
+        'weights', ('id',), 'date',
+        ('rfid_tag', 'date', 'weight', 'confidence', 'model_version')
+    ),
+    'rollups': (
+        'weight_rollups', ('rfid_tag', 'period', 'bucket'), 'bucket',
+        ('rfid_tag', 'period', 'bucket', 'count', 'weight_sum', 'min_weight', 'max_weight')
+    ),
+    'captures': (
+        'captures', ('id',), 'timestamp',
+        ('rfid_tag', 'timestamp', 'device_id', 'camera_position', 'image_path', 'status',
+         'estimated_weight', 'confidence', 'features', 'error', 'client_id', 'model_version')
+    ),
+}
+
+# Registros por transação na importação em massa
+IMPORT_BATCH_SIZE = 500
+
+
+class DuplicateCapture(Exception):
+    """Captura com client_id já registrado"""
+
+    def __init__(self, record):
+        super().__init__(f"Captura duplicada: {record.get('client_id')}")
+        self.record = record
+
+
+class CattleRepository:
+    """
+    Repositório de dados do rebanho sobre SQLite.
+
+    Cada thread (e cada processo, após fork) usa sua própria conexão.
+    Escritas usam BEGIN IMMEDIATE, então escritores concorrentes são
+    serializados pelo SQLite em vez de sobrescreverem uns aos outros.
+    """
+
+    def __init__(self, path, pass_window=None):
+        """
+        Args:
+            path: arquivo SQLite
+            pass_window: segundos em que capturas do mesmo animal (de
+                         qualquer câmera) formam uma única passagem com um
+                         peso fundido; None grava um peso por imagem
+        """
+        self.path = path
+        self.pass_window = pass_window
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        self._migrate(conn)
+        conn.executescript(MIGRATED_INDEXES)
+
+        # Bancos anteriores aos agregados: calcula uma vez a partir do histórico
+        with self._write() as conn:
+            if conn.execute('SELECT 1 FROM herd_stats').fetchone() is None:
+                self._rebuild_aggregates(conn)
+
+    def _connect(self):
+        """Retorna a conexão da thread/processo atual"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """
+        Fecha a conexão da thread atual
+
+        Chamado no processo mestre antes do fork (gunicorn.conf.py): uma
+        conexão SQLite não pode ser herdada por um processo filho.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _migrate(self, conn):
+        """Adiciona colunas novas em bancos criados por versões anteriores"""
+        for table, column, definition in MIGRATIONS:
+            columns = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+            if column not in columns:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+    def _write(self):
+        """Abre uma transação de escrita"""
+        return _WriteTransaction(self._connect())
+
+    # ------------------------------------------------------------------
+    # Escrita
+    # ------------------------------------------------------------------
+
+    def add_capture(self, rfid_tag, device_id, camera_position, image_path, result=None,
+                    status=STATUS_DONE, client_id=None):
+        """
+        Registra uma captura (e o peso estimado, se houver)
+
+        Args:
+            rfid_tag: ID do animal
+            device_id: ID da ESP32
+            camera_position: posição da câmera
+            image_path: caminho da imagem salva
+            result: resultado de WeightEstimator.process_image
+            status: STATUS_PENDING quando a estimativa é assíncrona
+            client_id: chave de idempotência enviada pelo cliente
+
+        Returns:
+            dict: Registro da captura
+
+        Raises:
+            DuplicateCapture: se client_id já foi registrado (corrida entre
+                              dois envios da mesma captura)
+        """
+        with self._write() as conn:
+            return self._insert_capture(
+                conn, rfid_tag, device_id, camera_position, image_path, result, status, client_id
+            )
+
+    def add_captures(self, captures):
+        """
+        Registra várias capturas numa única transação (upload em lote)
+
+        Args:
+            captures: lista de dicts com os argumentos de add_capture
+
+        Returns:
+            list: Registro de cada captura, ou a exceção DuplicateCapture
+                  para as que já existiam (as demais são gravadas)
+        """
+        records = []
+
+        with self._write() as conn:
+            for item in captures:
+                conn.execute('SAVEPOINT capture')
+                try:
+                    records.append(self._insert_capture(conn, **item))
+                except DuplicateCapture as e:
+                    conn.execute('ROLLBACK TO capture')
+                    records.append(e)
+                conn.execute('RELEASE capture')
+
+        return records
+
+    def _insert_capture(self, conn, rfid_tag, device_id, camera_position, image_path,
+                        result=None, status=STATUS_DONE, client_id=None):
+        """Insere uma captura dentro de uma transação já aberta"""
+        now = datetime.now().isoformat()
+
+        record = {
+            'timestamp': now,
+            'device_id': device_id,
+            'camera_position': camera_position,
+            'image_path': image_path
+        }
+
+        new_animal = conn.execute(
+            'INSERT OR IGNORE INTO cattle (rfid, first_seen, last_seen) VALUES (?, ?, ?)',
+            (rfid_tag, now, now)
+        ).rowcount == 1
+
+        pass_id = self._current_pass(conn, rfid_tag, now) if self.pass_window else None
+
+        try:
+            cursor = conn.execute(
+                'INSERT INTO captures (rfid_tag, timestamp, device_id, camera_position, '
+                'image_path, status, pass_id, client_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (rfid_tag, now, device_id, camera_position, image_path, status, pass_id, client_id)
+            )
+        except sqlite3.IntegrityError:
+            duplicate = self.find_capture(client_id) if client_id else None
+            if duplicate is None:
+                raise
+            raise DuplicateCapture(duplicate)
+
+        record['id'] = cursor.lastrowid
+
+        conn.execute(
+            'UPDATE cattle SET last_seen = ?, total_captures = total_captures + 1 WHERE rfid = ?',
+            (now, rfid_tag)
+        )
+        conn.execute(
+            'UPDATE herd_stats SET total_cattle = total_cattle + ?, '
+            'total_captures = total_captures + 1',
+            (int(new_animal),)
+        )
+
+        if result is not None:
+            record.update(self._apply_result(conn, record['id'], rfid_tag, result))
+
+        return record
+
+    def complete_capture(self, capture_id, result):
+        """
+        Grava o resultado da estimativa de uma captura pendente
+
+        Returns:
+            dict: Campos atualizados, ou None se a captura não existe
+        """
+        with self._write() as conn:
+            row = conn.execute(
+                'SELECT rfid_tag FROM captures WHERE id = ?', (capture_id,)
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            return self._apply_result(conn, capture_id, row['rfid_tag'], result)
+
+    def _current_pass(self, conn, rfid_tag, now):
+        """Retorna a passagem aberta do animal, criando uma nova se preciso"""
+        cutoff = (datetime.fromisoformat(now) - timedelta(seconds=self.pass_window)).isoformat()
+
+        row = conn.execute(
+            'SELECT id FROM passes WHERE rfid_tag = ? AND started_at >= ? '
+            'ORDER BY started_at DESC LIMIT 1',
+            (rfid_tag, cutoff)
+        ).fetchone()
+
+        if row is not None:
+            conn.execute('UPDATE passes SET updated_at = ? WHERE id = ?', (now, row['id']))
+            return row['id']
+
+        cursor = conn.execute(
+            'INSERT INTO passes (rfid_tag, started_at, updated_at) VALUES (?, ?, ?)',
+            (rfid_tag, now, now)
+        )
+        return cursor.lastrowid
+
+    def _fuse_pass(self, conn, pass_id, rfid_tag, model_version=None):
+        """
+        Recalcula o peso fundido da passagem e atualiza seu registro de peso
+
+        O peso leva a versão do modelo da vista mais recente.
+        """
+        views = conn.execute(
+            'SELECT camera_position, estimated_weight, confidence FROM captures '
+            'WHERE pass_id = ? AND estimated_weight IS NOT NULL ORDER BY id',
+            (pass_id,)
+        ).fetchall()
+
+        fused = fuse_views([dict(v) for v in views])
+        if fused is None:
+            return None
+
+        row = conn.execute(
+            'SELECT started_at, weight_id FROM passes WHERE id = ?', (pass_id,)
+        ).fetchone()
+
+        weight_id = row['weight_id']
+        if weight_id is None:
+            cursor = conn.execute(
+                'INSERT INTO weights (rfid_tag, date, weight, confidence, pass_id, model_version) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (rfid_tag, row['started_at'], fused['estimated_weight'], fused['confidence'],
+                 pass_id, model_version)
+            )
+            weight_id = cursor.lastrowid
+            self._push_weight(conn, rfid_tag, weight_id, row['started_at'], fused['estimated_weight'])
+        else:
+            conn.execute(
+                'UPDATE weights SET weight = ?, confidence = ?, model_version = ? WHERE id = ?',
+                (fused['estimated_weight'], fused['confidence'], model_version, weight_id)
+            )
+            self._amend_weight(conn, rfid_tag, weight_id, fused['estimated_weight'])
+
+        conn.execute(
+            'UPDATE passes SET weight_id = ?, estimated_weight = ?, confidence = ?, views = ? '
+            'WHERE id = ?',
+            (weight_id, fused['estimated_weight'], fused['confidence'], fused['views'], pass_id)
+        )
+
+        fused['id'] = pass_id
+        return fused
+
+    def _apply_result(self, conn, capture_id, rfid_tag, result):
+        """Atualiza a captura e o histórico de pesos dentro de uma transação"""
+        now = datetime.now().isoformat()
+
+        if not result.get('success'):
+            error = result.get('error', 'Erro desconhecido')
+            conn.execute(
+                'UPDATE captures SET status = ?, error = ? WHERE id = ?',
+                (STATUS_FAILED, error, capture_id)
+            )
+            return {'status': STATUS_FAILED}
+
+        fields = {
+            'estimated_weight': result['estimated_weight'],
+            'confidence': result.get('confidence', 0),
+            'features': result.get('features', {}),
+            'model_version': result.get('model_version')
+        }
+
+        conn.execute(
+            'UPDATE captures SET estimated_weight = ?, confidence = ?, features = ?, status = ?, '
+            'model_version = ? WHERE id = ?',
+            (
+                fields['estimated_weight'], fields['confidence'],
+                json.dumps(fields['features']), STATUS_DONE, fields['model_version'], capture_id
+            )
+        )
+
+        pass_id = conn.execute(
+            'SELECT pass_id FROM captures WHERE id = ?', (capture_id,)
+        ).fetchone()['pass_id']
+
+        if pass_id is not None:
+            # Um único peso por passagem, refeito a cada vista que chega
+            fields['pass'] = self._fuse_pass(conn, pass_id, rfid_tag, fields['model_version'])
+        else:
+            cursor = conn.execute(
+                'INSERT INTO weights (rfid_tag, date, weight, confidence, model_version) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (rfid_tag, now, fields['estimated_weight'], fields['confidence'],
+                 fields['model_version'])
+            )
+            self._push_weight(conn, rfid_tag, cursor.lastrowid, now, fields['estimated_weight'])
+
+        fields['status'] = STATUS_DONE
+        return fields
+
+    # ------------------------------------------------------------------
+    # Agregados
+    # ------------------------------------------------------------------
+
+    def _push_weight(self, conn, rfid_tag, weight_id, date, weight):
+        """Novo peso vira o último do animal; o anterior vira prev_weight"""
+        previous = conn.execute(
+            'SELECT last_weight FROM cattle WHERE rfid = ?', (rfid_tag,)
+        ).fetchone()['last_weight']
+
+        conn.execute(
+            'UPDATE cattle SET prev_weight_id = last_weight_id, prev_weight = last_weight, '
+            'last_weight_id = ?, last_weight = ?, last_weight_date = ? WHERE rfid = ?',
+            (weight_id, weight, date, rfid_tag)
+        )
+
+        if previous is None:
+            conn.execute(
+                'UPDATE herd_stats SET weights_count = weights_count + 1, weight_sum = weight_sum + ?',
+                (weight,)
+            )
+        else:
+            conn.execute(
+                'UPDATE herd_stats SET weight_sum = weight_sum + ?', (weight - previous,)
+            )
+
+    def _amend_weight(self, conn, rfid_tag, weight_id, weight):
+        """Peso já registrado foi refeito (nova vista da passagem)"""
+        row = conn.execute(
+            'SELECT last_weight_id, last_weight, prev_weight_id FROM cattle WHERE rfid = ?',
+            (rfid_tag,)
+        ).fetchone()
+
+        if weight_id == row['last_weight_id']:
+            conn.execute(
+                'UPDATE cattle SET last_weight = ? WHERE rfid = ?', (weight, rfid_tag)
+            )
+            conn.execute(
+                'UPDATE herd_stats SET weight_sum = weight_sum + ?', (weight - row['last_weight'],)
+            )
+        elif weight_id == row['prev_weight_id']:
+            conn.execute(
+                'UPDATE cattle SET prev_weight = ? WHERE rfid = ?', (weight, rfid_tag)
+            )
+
+    def _rebuild_aggregates(self, conn):
+        """
+        Recalcula os agregados a partir do histórico (migração/importação)
+
+        O último peso só é substituído por um peso bruto de data igual ou
+        mais recente: animais cujos pesos já foram compactados mantêm os
+        valores guardados (ver compact_weights).
+        """
+        def newest(column, offset=0):
+            return (f'(SELECT {column} FROM weights WHERE rfid_tag = cattle.rfid '
+                    f'ORDER BY date DESC, id DESC LIMIT 1 OFFSET {offset})')
+
+        replaced = f"last_weight_id IS NOT {newest('id')}"
+
+        conn.execute("""
+            UPDATE cattle SET
+                total_captures = (SELECT COUNT(*) FROM captures WHERE rfid_tag = cattle.rfid)
+        """)
+        # As expressões do SET leem os valores anteriores da linha
+        conn.execute(f"""
+            UPDATE cattle SET
+                last_weight_id = {newest('id')},
+                last_weight = {newest('weight')},
+                last_weight_date = {newest('date')},
+                prev_weight_id = COALESCE({newest('id', 1)},
+                    CASE WHEN {replaced} THEN last_weight_id ELSE prev_weight_id END),
+                prev_weight = COALESCE({newest('weight', 1)},
+                    CASE WHEN {replaced} THEN last_weight ELSE prev_weight END)
+            WHERE EXISTS (
+                SELECT 1 FROM weights WHERE rfid_tag = cattle.rfid
+                AND (cattle.last_weight_date IS NULL OR date >= cattle.last_weight_date)
+            )
+        """)
+        conn.execute("""
+            INSERT OR REPLACE INTO herd_stats
+                (id, total_cattle, total_captures, weights_count, weight_sum)
+            SELECT 1, COUNT(*), (SELECT COUNT(*) FROM captures),
+                   COUNT(last_weight), COALESCE(SUM(last_weight), 0)
+            FROM cattle
+        """)
+
+    # ------------------------------------------------------------------
+    # Leitura
+    # ------------------------------------------------------------------
+
+    def recent_weights(self, rfid_tag, limit=5):
+        """Retorna os últimos pesos de um animal (mais antigo primeiro)"""
+        rows = self._connect().execute(
+            'SELECT weight FROM weights WHERE rfid_tag = ? ORDER BY id DESC LIMIT ?',
+            (rfid_tag, limit)
+        ).fetchall()
+        return [row['weight'] for row in reversed(rows)]
+
+    def list_cattle(self, limit=DEFAULT_PAGE_SIZE, cursor=None, since=None, until=None,
+                    fields=None):
+        """
+        Lista os animais com último peso e variação, em ordem de cadastro
+
+        Args:
+            limit: tamanho da página (até MAX_PAGE_SIZE)
+            cursor: cursor retornado pela página anterior
+            since, until: filtra por last_seen (ISO 8601, inclusivo)
+            fields: conjunto de campos a retornar (None = todos)
+
+        Returns:
+            tuple: (animais, cursor da próxima página ou None)
+
+        Raises:
+            ValueError: cursor inválido
+        """
+        where, params = _time_range('last_seen', since, until)
+
+        if cursor is not None:
+            first_seen, rfid = _decode_cursor(cursor, 2)
+            where.append('(first_seen, rfid) > (?, ?)')
+            params += [first_seen, rfid]
+
+        rows = self._connect().execute(f"""
+            SELECT rfid, first_seen, last_seen, total_captures,
+                   last_weight, last_weight_date, prev_weight
+            FROM cattle
+            {_where(where)}
+            ORDER BY first_seen, rfid
+            LIMIT ?
+        """, params + [_page_size(limit) + 1]).fetchall()
+
+        rows, last = _split_page(rows, limit)
+        next_cursor = _encode_cursor(last['first_seen'], last['rfid']) if last else None
+
+        return [_project(_cattle_from_row(row), fields) for row in rows], next_cursor
+
+    def get_cattle(self, rfid_tag):
+        """Retorna um animal com histórico de pesos e capturas, ou None"""
+        conn = self._connect()
+
+        row = conn.execute(
+            'SELECT rfid, first_seen, last_seen FROM cattle WHERE rfid = ?',
+            (rfid_tag,)
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        weights = conn.execute(
+            'SELECT date, weight, confidence, model_version FROM weights WHERE rfid_tag = ? '
+            'ORDER BY id DESC LIMIT ?',
+            (rfid_tag, MAX_WEIGHTS_RETURNED)
+        ).fetchall()
+
+        captures = conn.execute(
+            'SELECT * FROM captures WHERE rfid_tag = ? ORDER BY id DESC LIMIT ?',
+            (rfid_tag, MAX_CAPTURES_RETURNED)
+        ).fetchall()
+
+        return {
+            'rfid': row['rfid'],
+            'first_seen': row['first_seen'],
+            'last_seen': row['last_seen'],
+            'weights': [dict(w) for w in reversed(weights)],
+            'captures': [_capture_from_row(c, include_tag=False) for c in reversed(captures)]
+        }
+
+    def weight_history(self, rfid_tag, limit=DEFAULT_PAGE_SIZE, cursor=None, since=None,
+                       until=None, fields=None):
+        """
+        Histórico de pesos de um animal, mais recente primeiro
+
+        Usa idx_weights_rfid_date tanto para o filtro por data quanto
+        para o cursor, então o custo de uma página não depende do
+        tamanho do histórico.
+
+        Returns:
+            tuple: (pesos, cursor da próxima página ou None), ou None se o
+                   animal não existe
+
+        Raises:
+            ValueError: cursor inválido
+        """
+        conn = self._connect()
+
+        if conn.execute('SELECT 1 FROM cattle WHERE rfid = ?', (rfid_tag,)).fetchone() is None:
+            return None
+
+        where, params = _time_range('date', since, until)
+        where.insert(0, 'rfid_tag = ?')
+        params.insert(0, rfid_tag)
+
+        if cursor is not None:
+            date, weight_id = _decode_cursor(cursor, 2)
+            where.append('(date, id) < (?, ?)')
+            params += [date, weight_id]
+
+        rows = conn.execute(f"""
+            SELECT id, date, weight, confidence, pass_id, model_version
+            FROM weights
+            {_where(where)}
+            ORDER BY date DESC, id DESC
+            LIMIT ?
+        """, params + [_page_size(limit) + 1]).fetchall()
+
+        rows, last = _split_page(rows, limit)
+        next_cursor = _encode_cursor(last['date'], last['id']) if last else None
+
+        return [_project(_weight_from_row(row), fields) for row in rows], next_cursor
+
+    def weight_series(self, rfid_tag, period, since=None, until=None):
+        """
+        Série de pesos de um animal agregada por dia ou semana
+
+        Junta os pesos brutos ainda não compactados com os agregados de
+        weight_rollups, então a série cobre todo o histórico
+        independentemente da retenção.
+
+        Args:
+            period: 'day' ou 'week'
+            since, until: intervalo de datas ISO 8601 (inclusivo, por período)
+
+        Returns:
+            list: dicts com date (início do período), count, mean, min e max,
+                  em ordem cronológica; None se o animal não existe
+        """
+        conn = self._connect()
+
+        if conn.execute('SELECT 1 FROM cattle WHERE rfid = ?', (rfid_tag,)).fetchone() is None:
+            return None
+
+        start, end = ROLLUP_PERIODS[period]
+
+        # Filtra por períodos inteiros: do início do período de since até
+        # o fim do período de until
+        def period_range(column):
+            where, params = [], []
+            if since is not None:
+                where.append(f'{column} >= {start.format("?")}')
+                params.append(since)
+            if until is not None:
+                where.append(f'{column} < {end.format("?")}')
+                params.append(until)
+            return where, params
+
+        # Pesos brutos ainda não compactados
+        where, params = period_range('date')
+        sources = [
+            f'SELECT {start.format("date")} AS bucket, COUNT(*) AS count, '
+            'SUM(weight) AS weight_sum, MIN(weight) AS min_weight, MAX(weight) AS max_weight '
+            f'FROM weights {_where(["rfid_tag = ?"] + where)} GROUP BY 1'
+        ]
+        params = [rfid_tag] + params
+
+        # Agregados já compactados (os diários entram também na série semanal)
+        for stored in ('day', 'week') if period == 'week' else ('day',):
+            where, range_params = period_range('bucket')
+            sources.append(
+                f'SELECT {start.format("bucket")} AS bucket, count, weight_sum, '
+                'min_weight, max_weight '
+                f'FROM weight_rollups {_where(["rfid_tag = ?", "period = ?"] + where)}'
+            )
+            params += [rfid_tag, stored] + range_params
+
+        rows = conn.execute(f"""
+            SELECT bucket, SUM(count) AS count, SUM(weight_sum) AS weight_sum,
+                   MIN(min_weight) AS min_weight, MAX(max_weight) AS max_weight
+            FROM ({' UNION ALL '.join(sources)})
+            GROUP BY bucket
+            ORDER BY bucket
+        """, params).fetchall()
+
+        return [
+            {
+                'date': row['bucket'],
+                'count': row['count'],
+                'mean': round(row['weight_sum'] / row['count'], 1),
+                'min': row['min_weight'],
+                'max': row['max_weight']
+            }
+            for row in rows
+        ]
+
+    def get_capture(self, capture_id):
+        """Retorna uma captura pelo id, ou None"""
+        row = self._connect().execute(
+            'SELECT * FROM captures WHERE id = ?', (capture_id,)
+        ).fetchone()
+        return _capture_from_row(row) if row else None
+
+    def find_capture(self, client_id):
+        """Retorna a captura com a chave de idempotência dada, ou None"""
+        row = self._connect().execute(
+            'SELECT * FROM captures WHERE client_id = ?', (client_id,)
+        ).fetchone()
+        return _capture_from_row(row) if row else None
+
+    def get_pass(self, pass_id):
+        """Retorna uma passagem com suas vistas, ou None"""
+        conn = self._connect()
+
+        row = conn.execute('SELECT * FROM passes WHERE id = ?', (pass_id,)).fetchone()
+        if row is None:
+            return None
+
+        captures = conn.execute(
+            'SELECT * FROM captures WHERE pass_id = ? ORDER BY id', (pass_id,)
+        ).fetchall()
+
+        return {
+            'id': row['id'],
+            'rfid_tag': row['rfid_tag'],
+            'started_at': row['started_at'],
+            'updated_at': row['updated_at'],
+            'estimated_weight': row['estimated_weight'],
+            'confidence': row['confidence'],
+            'views': row['views'],
+            'captures': [_capture_from_row(c, include_tag=False) for c in captures]
+        }
+
+    def recent_captures(self, limit=20, cursor=None, since=None, until=None, fields=None):
+        """
+        Retorna as capturas mais recentes (mais recente primeiro)
+
+        Args:
+            limit: tamanho da página (até MAX_PAGE_SIZE)
+            cursor: cursor retornado pela página anterior
+            since, until: filtra por timestamp (ISO 8601, inclusivo)
+            fields: conjunto de campos a retornar (None = todos)
+
+        Returns:
+            tuple: (capturas, cursor da próxima página ou None)
+
+        Raises:
+            ValueError: cursor inválido
+        """
+        where, params = _time_range('timestamp', since, until)
+
+        if cursor is not None:
+            (capture_id,) = _decode_cursor(cursor, 1)
+            where.append('id < ?')
+            params.append(capture_id)
+
+        rows = self._connect().execute(
+            f'SELECT * FROM captures {_where(where)} ORDER BY id DESC LIMIT ?',
+            params + [_page_size(limit) + 1]
+        ).fetchall()
+
+        rows, last = _split_page(rows, limit)
+        next_cursor = _encode_cursor(last['id']) if last else None
+
+        return [_project(_capture_from_row(row, fields=fields), fields) for row in rows], next_cursor
+
+    def stats(self):
+        """Estatísticas gerais do rebanho"""
+        row = self._connect().execute('SELECT * FROM herd_stats').fetchone()
+
+        # Média do último peso de cada animal
+        count = row['weights_count']
+        avg_weight = round(row['weight_sum'] / count, 1) if count else 0
+
+        return {
+            'total_cattle': row['total_cattle'],
+            'total_captures': row['total_captures'],
+            'average_weight': avg_weight,
+            'weights_count': count
+        }
+
+    def size_bytes(self):
+        """Tamanho do banco em disco, incluindo o WAL"""
+        total = 0
+        for path in (self.path, self.path + '-wal'):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    # ------------------------------------------------------------------
+    # Feed ao vivo
+    # ------------------------------------------------------------------
+
+    def add_events(self, events, keep=None):
+        """
+        Grava um lote de eventos do feed ao vivo numa única transação
+        (ver events.EventBroker)
+
+        A tabela só é aparada quando os ids cruzam um múltiplo de keep,
+        então guarda entre keep e 2 x keep eventos.
+
+        Args:
+            events: lista de (tipo do evento SSE, dados já serializados em JSON)
+            keep: eventos mais recentes mantidos na tabela (None = todos)
+
+        Returns:
+            int: Número de sequência do último evento
+        """
+        with self._write() as conn:
+            first = last = None
+            for event_type, payload in events:
+                last = conn.execute(
+                    'INSERT INTO events (type, payload) VALUES (?, ?)', (event_type, payload)
+                ).lastrowid
+                if first is None:
+                    first = last
+            if keep and last is not None and (first - 1) // keep != last // keep:
+                conn.execute('DELETE FROM events WHERE id <= ?', (last - keep,))
+        return last
+
+    def events_after(self, after, limit):
+        """
+        Eventos posteriores a after, em ordem
+
+        Returns:
+            list: tuplas (sequência, tipo, payload)
+        """
+        rows = self._connect().execute(
+            'SELECT id, type, payload FROM events WHERE id > ? ORDER BY id LIMIT ?',
+            (after, limit)
+        ).fetchall()
+        return [(row['id'], row['type'], row['payload']) for row in rows]
+
+    def last_event_id(self):
+        """Sequência do evento mais recente (0 se não há eventos)"""
+        return self._connect().execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+
+    # ------------------------------------------------------------------
+    # Retenção
+    # ------------------------------------------------------------------
+
+    def compact_weights(self, raw_days=RAW_WEIGHT_DAYS, daily_days=DAILY_ROLLUP_DAYS, now=None):
+        """
+        Move pesos antigos para os agregados de weight_rollups
+
+        Pesos brutos de dias anteriores a raw_days viram agregados diários;
+        agregados diários de semanas anteriores a daily_days viram
+        semanais. Os cortes caem sempre no início de um dia/semana, então
+        um período nunca fica dividido entre tiers. Idempotente e seguro
+        com vários processos (uma transação de escrita).
+
+        Os agregados por animal (último peso e variação) e herd_stats não
+        mudam: eles guardam os valores, não referências aos pesos.
+
+        Args:
+            raw_days: dias de pesos brutos mantidos (0 = mantém todos)
+            daily_days: dias de agregados diários mantidos (0 = mantém todos)
+
+        Returns:
+            tuple: (pesos brutos compactados, agregados diários compactados)
+        """
+        today = (now or datetime.now()).date()
+        compacted = [0, 0]
+
+        with self._write() as conn:
+            if raw_days:
+                cutoff = (today - timedelta(days=raw_days)).isoformat()
+                self._merge_rollups(conn, 'day', f"""
+                    SELECT rfid_tag, {ROLLUP_PERIODS['day'][0].format('date')}, COUNT(*),
+                           SUM(weight), MIN(weight), MAX(weight)
+                    FROM weights WHERE date < ? GROUP BY 1, 2
+                """, cutoff)
+                compacted[0] = conn.execute(
+                    'DELETE FROM weights WHERE date < ?', (cutoff,)
+                ).rowcount
+
+            if daily_days:
+                cutoff_day = today - timedelta(days=daily_days)
+                cutoff = (cutoff_day - timedelta(days=cutoff_day.weekday())).isoformat()
+                self._merge_rollups(conn, 'week', f"""
+                    SELECT rfid_tag, {ROLLUP_PERIODS['week'][0].format('bucket')}, SUM(count),
+                           SUM(weight_sum), MIN(min_weight), MAX(max_weight)
+                    FROM weight_rollups WHERE period = 'day' AND bucket < ? GROUP BY 1, 2
+                """, cutoff)
+                compacted[1] = conn.execute(
+                    "DELETE FROM weight_rollups WHERE period = 'day' AND bucket < ?", (cutoff,)
+                ).rowcount
+
+        return tuple(compacted)
+
+    def _merge_rollups(self, conn, period, select, cutoff):
+        """Soma o resultado de select (rfid_tag, bucket, count, sum, min, max) aos agregados"""
+        conn.execute(f"""
+            INSERT INTO weight_rollups
+                (rfid_tag, bucket, count, weight_sum, min_weight, max_weight, period)
+            SELECT *, ? FROM ({select})
+            WHERE true
+            ON CONFLICT (rfid_tag, period, bucket) DO UPDATE SET
+                count = count + excluded.count,
+                weight_sum = weight_sum + excluded.weight_sum,
+                min_weight = MIN(min_weight, excluded.min_weight),
+                max_weight = MAX(max_weight, excluded.max_weight)
+        """, (period, cutoff))
+
+    def segment_images(self, segment):
+        """
+        Localizadores das imagens vivas de um segmento do arquivo de imagens
+
+        Args:
+            segment: nome do segmento (ex.: 'seg-000001.pack')
+        """
+        # Intervalo de prefixo 'pack:<segmento>:' (usa idx_captures_image;
+        # ';' é o caractere seguinte a ':')
+        rows = self._connect().execute(
+            'SELECT DISTINCT image_path FROM captures WHERE image_path >= ? AND image_path < ?',
+            (f'pack:{segment}:', f'pack:{segment};')
+        ).fetchall()
+        return [row['image_path'] for row in rows]
+
+    def relocate_images(self, moved):
+        """
+        Aponta as capturas para as novas posições das imagens realocadas
+
+        Args:
+            moved: dict localizador antigo -> localizador novo (None = imagem perdida)
+        """
+        with self._write() as conn:
+            conn.executemany(
+                'UPDATE captures SET image_path = ? WHERE image_path = ?',
+                [(new, old) for old, new in moved.items()]
+            )
+
+    def expire_images(self, days, now=None):
+        """
+        Esquece as imagens de capturas com mais de days dias
+
+        Só as imagens em segmentos: o espaço volta na compactação do
+        arquivo de imagens. Peso e features da captura são mantidos.
+
+        Returns:
+            int: Capturas cuja imagem foi esquecida
+        """
+        cutoff = ((now or datetime.now()) - timedelta(days=days)).isoformat()
+        with self._write() as conn:
+            return conn.execute(
+                "UPDATE captures SET image_path = NULL WHERE timestamp < ? "
+                "AND image_path >= 'pack:' AND image_path < 'pack;'",
+                (cutoff,)
+            ).rowcount
+
+    # ------------------------------------------------------------------
+    # Exportação e importação em massa
+    # ------------------------------------------------------------------
+
+    def iter_records(self, kind, since=None, batch_size=MAX_PAGE_SIZE):
+        """
+        Percorre todos os registros de um tipo (ver EXPORT_KINDS)
+
+        Lê em lotes paginados pela chave primária, cada um em uma consulta
+        curta: memória constante e nenhuma transação de leitura longa
+        segurando o checkpoint do WAL.
+
+        Args:
+            kind: 'cattle', 'weights', 'rollups' ou 'captures'
+            since: só registros com data >= since (sincronização incremental)
+
+        Yields:
+            dict: colunas de EXPORT_KINDS[kind] (features já decodificadas)
+        """
+        table, key, date_column, columns = EXPORT_KINDS[kind]
+        selected = ', '.join(dict.fromkeys(key + columns))
+        conn = self._connect()
+        last = None
+
+        while True:
+            where, params = _time_range(date_column, since, None)
+            if last is not None:
+                where.append(f"({', '.join(key)}) > ({', '.join('?' * len(key))})")
+                params.extend(last)
+
+            rows = conn.execute(
+                f"SELECT {selected} FROM {table} {_where(where)} "
+                f"ORDER BY {', '.join(key)} LIMIT ?",
+                params + [batch_size]
+            ).fetchall()
+
+            for row in rows:
+                record = {column: row[column] for column in columns}
+                if kind == 'captures' and record['features']:
+                    record['features'] = json.loads(record['features'])
+                yield record
+
+            if len(rows) < batch_size:
+                return
+            last = tuple(rows[-1][column] for column in key)
+
+    def import_records(self, records, batch_size=IMPORT_BATCH_SIZE):
+        """
+        Importa registros exportados por iter_records (de outro servidor ou do ERP)
+
+        Consome o iterável aos poucos e grava um lote por transação, então
+        arquivos maiores que a memória podem ser importados. Idempotente:
+        pesos e capturas já existentes (mesmo animal e data, ou mesmo
+        client_id) são ignorados, assim como agregados já presentes.
+        Animais citados por pesos/capturas são criados se não existirem.
+        Os agregados são recalculados no fim. Localizadores de imagem em
+        segmento (pack:...) só valem no servidor que os gravou e são
+        importados como NULL.
+
+        Args:
+            records: iterável de (tipo, dict)
+
+        Returns:
+            dict: registros gravados por tipo, 'skipped' (já existentes)
+                  e 'invalid' (tipo desconhecido ou campo obrigatório ausente)
+        """
+        counts = dict.fromkeys(EXPORT_KINDS, 0)
+        counts.update(skipped=0, invalid=0)
+
+        batch = []
+        for kind, record in records:
+            batch.append((kind, record))
+            if len(batch) >= batch_size:
+                self._import_batch(batch, counts)
+                batch = []
+        if batch:
+            self._import_batch(batch, counts)
+
+        with self._write() as conn:
+            self._rebuild_aggregates(conn)
+
+        return counts
+
+    def _import_batch(self, batch, counts):
+        with self._write() as conn:
+            for kind, record in batch:
+                try:
+                    inserted = self._import_record(conn, kind, record)
+                except (KeyError, TypeError, ValueError, sqlite3.IntegrityError):
+                    counts['invalid'] += 1
+                    continue
+                counts[kind if inserted else 'skipped'] += 1
+
+    def _import_record(self, conn, kind, record):
+        """Grava um registro importado; retorna False se já existia"""
+        if kind == 'cattle':
+            first_seen = record['first_seen']
+            return conn.execute("""
+                INSERT INTO cattle (rfid, first_seen, last_seen) VALUES (?, ?, ?)
+                ON CONFLICT (rfid) DO UPDATE SET
+                    first_seen = MIN(first_seen, excluded.first_seen),
+                    last_seen = MAX(last_seen, excluded.last_seen)
+                WHERE excluded.first_seen < first_seen OR excluded.last_seen > last_seen
+            """, (record['rfid'], first_seen, record.get('last_seen') or first_seen)).rowcount > 0
+
+        if kind == 'rollups':
+            return conn.execute(
+                'INSERT OR IGNORE INTO weight_rollups (rfid_tag, period, bucket, count, '
+                'weight_sum, min_weight, max_weight) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (record['rfid_tag'], record['period'], record['bucket'], int(record['count']),
+                 float(record['weight_sum']), float(record['min_weight']),
+                 float(record['max_weight']))
+            ).rowcount > 0
+
+        if kind == 'weights':
+            rfid, date = record['rfid_tag'], record['date']
+            weight = float(record['weight'])
+            confidence = _optional_float(record.get('confidence'))
+            self._ensure_cattle(conn, rfid, date)
+            # Pesos de um dia/semana já compactado também contam como existentes
+            return conn.execute(f"""
+                INSERT INTO weights (rfid_tag, date, weight, confidence, model_version)
+                SELECT ?, ?, ?, ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM weights WHERE rfid_tag = ? AND date = ?)
+                AND NOT EXISTS (SELECT 1 FROM weight_rollups WHERE rfid_tag = ? AND (
+                    (period = 'day' AND bucket = {ROLLUP_PERIODS['day'][0].format('?')}) OR
+                    (period = 'week' AND bucket = {ROLLUP_PERIODS['week'][0].format('?')})
+                ))
+            """, (rfid, date, weight, confidence, record.get('model_version') or None,
+                  rfid, date, rfid, date, date)).rowcount > 0
+
+        if kind == 'captures':
+            rfid, timestamp = record['rfid_tag'], record['timestamp']
+            features = record.get('features')
+            if isinstance(features, dict):
+                features = json.dumps(features)
+            # Posição num segmento do servidor de origem: aqui apontaria
+            # para outra imagem (ou para nada)
+            image_path = record.get('image_path') or None
+            if is_packed(image_path):
+                image_path = None
+            values = (
+                rfid, timestamp, record.get('device_id'), record.get('camera_position'),
+                image_path, record.get('status') or STATUS_DONE,
+                _optional_float(record.get('estimated_weight')),
+                _optional_float(record.get('confidence')), features or None,
+                record.get('error') or None, record.get('client_id') or None,
+                record.get('model_version') or None
+            )
+            self._ensure_cattle(conn, rfid, timestamp)
+            return conn.execute("""
+                INSERT OR IGNORE INTO captures (rfid_tag, timestamp, device_id, camera_position,
+                    image_path, status, estimated_weight, confidence, features, error, client_id,
+                    model_version)
+                SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM captures WHERE rfid_tag = ? AND timestamp = ?
+                    AND device_id IS ? AND camera_position IS ?
+                )
+            """, values + (rfid, timestamp, values[2], values[3])).rowcount > 0
+
+        raise ValueError(f'Tipo de registro desconhecido: {kind}')
+
+    def _ensure_cattle(self, conn, rfid, seen):
+        """Cria o animal de um peso/captura importado, ou amplia first_seen/last_seen"""
+        conn.execute("""
+            INSERT INTO cattle (rfid, first_seen, last_seen) VALUES (?, ?, ?)
+            ON CONFLICT (rfid) DO UPDATE SET
+                first_seen = MIN(first_seen, excluded.first_seen),
+                last_seen = MAX(last_seen, excluded.last_seen)
+            WHERE excluded.first_seen < first_seen OR excluded.last_seen > last_seen
+        """, (rfid, seen, seen))
+
+    # ------------------------------------------------------------------
+    # Migração
+    # ------------------------------------------------------------------
+
+    def is_empty(self):
+        """Indica se o banco ainda não tem nenhum animal"""
+        return self._connect().execute('SELECT 1 FROM cattle LIMIT 1').fetchone() is None
+
+    def import_legacy_json(self, json_path):
+        """
+        Importa o banco JSON antigo (data/cattle_db.json)
+
+        O arquivo é lido em fluxo, um animal por vez (ver
+        transfer.legacy_records), e gravado em lotes.
+
+        Returns:
+            int: Número de animais importados
+        """
+        with open(json_path, 'r') as f:
+            counts = self.import_records(legacy_records(f))
+
+        return counts['cattle']
+
+
+class _WriteTransaction:
+    """Context manager para BEGIN IMMEDIATE / COMMIT / ROLLBACK"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute('COMMIT')
+        else:
+            self.conn.execute('ROLLBACK')
+        return False
+
+
+def _page_size(limit):
+    """Limita o tamanho da página a [1, MAX_PAGE_SIZE]"""
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def _split_page(rows, limit):
+    """
+    Separa a linha extra buscada para saber se há próxima página
+
+    Returns:
+        tuple: (linhas da página, última linha se há próxima página, senão None)
+    """
+    size = _page_size(limit)
+    if len(rows) > size:
+        rows = rows[:size]
+        return rows, rows[-1]
+    return rows, None
+
+
+def _encode_cursor(*values):
+    """Cursor opaco com a chave de ordenação do último item da página"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor, size):
+    """Decodifica um cursor de _encode_cursor com size valores"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Cursor inválido')
+
+    if not isinstance(values, list) or len(values) != size or \
+            not all(isinstance(v, (str, int, float)) for v in values):
+        raise ValueError('Cursor inválido')
+    return values
+
+
+def _time_range(column, since, until):
+    """Condições WHERE para um intervalo de datas ISO (inclusivo)"""
+    where, params = [], []
+    if since is not None:
+        where.append(f'{column} >= ?')
+        params.append(since)
+    if until is not None:
+        where.append(f'{column} <= ?')
+        params.append(until)
+    return where, params
+
+
+def _optional_float(value):
+    """Número opcional vindo de NDJSON/CSV (None e '' viram None)"""
+    return None if value is None or value == '' else float(value)
+
+
+def _where(conditions):
+    return 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+
+def _project(record, fields):
+    """Mantém apenas os campos pedidos (fields=None mantém todos)"""
+    if fields is None:
+        return record
+    return {key: value for key, value in record.items() if key in fields}
+
+
+def _weight_from_row(row):
+    """Converte uma linha da tabela weights no formato da API"""
+    record = {
+        'id': row['id'],
+        'date': row['date'],
+        'weight': row['weight'],
+        'confidence': row['confidence']
+    }
+    if row['pass_id'] is not None:
+        record['pass_id'] = row['pass_id']
+    if row['model_version'] is not None:
+        record['model_version'] = row['model_version']
+    return record
+
+
+def _cattle_from_row(row):
+    """Converte uma linha da tabela cattle (com agregados) no formato da API"""
+    cattle_info = {
+        'rfid': row['rfid'],
+        'first_seen': row['first_seen'],
+        'last_seen': row['last_seen'],
+        'total_captures': row['total_captures']
+    }
+
+    if row['last_weight'] is not None:
+        cattle_info['last_weight'] = row['last_weight']
+        cattle_info['last_weight_date'] = row['last_weight_date']
+
+        # Variação de peso
+        if row['prev_weight'] is not None:
+            cattle_info['weight_change'] = round(row['last_weight'] - row['prev_weight'], 1)
+
+    return cattle_info
+
+
+def _capture_from_row(row, include_tag=True, fields=None):
+    """
+    Converte uma linha da tabela captures no formato da API
+
+    Com fields, as features (JSON) só são decodificadas se pedidas.
+    """
+    record = {'id': row['id']}
+    if include_tag:
+        record['rfid_tag'] = row['rfid_tag']
+
+    record.update({
+        'timestamp': row['timestamp'],
+        'device_id': row['device_id'],
+        'camera_position': row['camera_position'],
+        'image_path': row['image_path']
+    })
+
+    if row['estimated_weight'] is not None:
+        record['estimated_weight'] = row['estimated_weight']
+        record['confidence'] = row['confidence']
+        if fields is None or 'features' in fields:
+            record['features'] = json.loads(row['features']) if row['features'] else {}
+        if row['model_version'] is not None:
+            record['model_version'] = row['model_version']
+
+    if row['pass_id'] is not None:
+        record['pass_id'] = row['pass_id']
+
+    if row['client_id'] is not None:
+        record['client_id'] = row['client_id']
+
+    if row['status'] != STATUS_DONE:
+        record['status'] = row['status']
+    if row['error']:
+        record['error'] = row['error']
+
+    return record
+
+
+# Singleton para uso no servidor
+_repository = None
+
+def get_repository(path, **options):
+    """Retorna instância singleton do repositório"""
+    global _repository
+    if _repository is None:
+        _repository = CattleRepository(path, **options)
+    return _repository
@@ -0,0 +1,291 @@
+"""
+FaceBoi - Exportação e importação em massa
+Formatos de arquivo do rebanho usados por /api/export e /api/import
+
+NDJSON: um registro JSON por linha, com o tipo em "type":
+
+    {"type":"cattle","rfid":"...","first_seen":"...","last_seen":"..."}
+    {"type":"weights","rfid_tag":"...","date":"...","weight":412.5,"confidence":0.8}
+
+CSV: um tipo de registro por arquivo, com cabeçalho (as colunas de
+storage.EXPORT_KINDS; features de capturas vão como texto JSON).
+
+Tudo é gerado e consumido em fluxo, com memória constante: a exportação
+é uma cadeia de geradores (registros -> linhas -> blocos -> gzip) e a
+importação lê o corpo da requisição em blocos, descompactando gzip se
+preciso. O banco JSON antigo também é lido em fluxo (legacy_records).
+"""
+
+import io
+import csv
+import json
+import zlib
+import codecs
+from datetime import datetime
+
+
+# Tamanho dos blocos enviados/lidos
+CHUNK_SIZE = 64 * 1024
+
+# Leitura do banco JSON antigo
+LEGACY_CHUNK_SIZE = 1024 * 1024
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+# ----------------------------------------------------------------------
+# Exportação
+# ----------------------------------------------------------------------
+
+def ndjson_lines(records):
+    """
+    Args:
+        records: iterável de (tipo, dict)
+
+    Yields:
+        str: uma linha NDJSON por registro
+    """
+    for kind, record in records:
+        yield json.dumps({'type': kind, **record}, separators=(',', ':')) + '\n'
+
+
+def csv_lines(records, columns):
+    """
+    Args:
+        records: iterável de dicts de um único tipo
+        columns: colunas do arquivo, na ordem
+
+    Yields:
+        str: cabeçalho e uma linha CSV por registro
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(columns)
+    for record in records:
+        writer.writerow([_csv_value(record.get(column)) for column in columns])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'))
+    return value
+
+
+def encode_chunks(lines, chunk_size=CHUNK_SIZE):
+    """Agrupa linhas de texto em blocos de bytes de ~chunk_size (poucas escritas no socket)"""
+    parts = []
+    pending = 0
+    for line in lines:
+        data = line.encode()
+        parts.append(data)
+        pending += len(data)
+        if pending >= chunk_size:
+            yield b''.join(parts)
+            parts, pending = [], 0
+    if parts:
+        yield b''.join(parts)
+
+
+def gzip_chunks(chunks, level=6):
+    """Compacta um fluxo de blocos em formato gzip, bloco a bloco"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# ----------------------------------------------------------------------
+# Importação
+# ----------------------------------------------------------------------
+
+def text_lines(stream, chunk_size=CHUNK_SIZE):
+    """
+    Linhas de texto (com o '\\n') de um stream binário
+
+    gzip é detectado pelos bytes iniciais e descompactado em fluxo.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    decompressor = None
+    pending = ''
+    first = True
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+
+        if first:
+            first = False
+            if chunk[:2] == GZIP_MAGIC:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+
+        pending += decoder.decode(chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+
+    if decompressor is not None:
+        pending += decoder.decode(decompressor.flush())
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def read_ndjson(lines):
+    """
+    Yields:
+        tuple: (tipo, dict) por linha; linhas inválidas viram (None, {})
+               e são contadas como inválidas na importação
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict):
+            yield None, {}
+            continue
+        yield record.pop('type', None), record
+
+
+def read_csv(lines, kind):
+    """
+    Yields:
+        tuple: (kind, dict) por linha do CSV (campos vazios viram None)
+    """
+    for row in csv.DictReader(lines):
+        yield kind, {key: (value if value != '' else None) for key, value in row.items()}
+
+
+# ----------------------------------------------------------------------
+# Banco JSON antigo
+# ----------------------------------------------------------------------
+
+class _JsonReader:
+    """
+    Leitor incremental de um documento JSON grande
+
+    Percorre objetos chave a chave e decodifica cada valor com
+    json.JSONDecoder.raw_decode sobre um buffer que só cresce o
+    necessário para conter o valor atual.
+    """
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Descarta o que já foi lido e acrescenta um bloco; False no fim do arquivo"""
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Próximo caractere que não é espaço ('' no fim do arquivo)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"JSON inválido: esperado '{char}', encontrado '{found}'")
+        self.pos += 1
+
+    def value(self):
+        """Decodifica o próximo valor completo"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # Um número no fim do buffer pode continuar no próximo bloco
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def keys(self):
+        """
+        Percorre as chaves do objeto atual
+
+        A cada chave, o chamador deve consumir o valor (value() ou keys())
+        antes de pedir a próxima.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+
+            separator = self.peek()
+            self.pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError(f"JSON inválido: esperado ',' ou '}}', encontrado '{separator}'")
+
+
+def legacy_records(f, chunk_size=LEGACY_CHUNK_SIZE):
+    """
+    Registros do banco JSON antigo ({"cattle": {rfid: {...}}}), um animal por vez
+
+    Args:
+        f: arquivo aberto em modo texto
+
+    Yields:
+        tuple: (tipo, dict) no formato de import_records
+    """
+    reader = _JsonReader(f, chunk_size)
+
+    for key in reader.keys():
+        if key != 'cattle':
+            reader.value()
+            continue
+
+        for rfid in reader.keys():
+            data = reader.value()
+            first_seen = data.get('first_seen') or datetime.now().isoformat()
+
+            yield 'cattle', {
+                'rfid': rfid,
+                'first_seen': first_seen,
+                'last_seen': data.get('last_seen') or first_seen
+            }
+            for weight in data.get('weights', []):
+                yield 'weights', {**weight, 'rfid_tag': rfid}
+            for capture in data.get('captures', []):
+                yield 'captures', {**capture, 'rfid_tag': rfid}
@@ -7,11 +7,496 @@ Em produção, seria treinado com milhares de imagens reais.
 """
 
 import os
+import json
 import pickle
+import hashlib
 import numpy as np
 from PIL import Image
 import cv2
 import io
+import time
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import features as feature_extractors
+from cache import ResultCache, content_hash
+from background import BackgroundStore
+from roi import RoiStore
+from model_registry import ModelRegistry, LoadedModel, load_artifact
+
+
+# Ordem das colunas do vetor de características usado pelo modelo treinado
+FEATURE_NAMES = [
+    'area',
+    'perimeter',
+    'length',
+    'height',
+    'aspect_ratio',
+    'solidity',
+    'fill_ratio'
+]
+
+# Colunas usadas pela fórmula empírica (sem modelo treinado)
+EMPIRICAL_FEATURES = ['area', 'length', 'height', 'solidity']
+
+# Características devolvidas no resultado (ver _build_result)
+RESULT_FEATURES = ['area', 'length', 'height', 'aspect_ratio']
+
+
+def features_matrix(features_list, names=FEATURE_NAMES):
+    """
+    Empilha dicts de características em uma matriz (N, len(names)) float32
+    
+    Args:
+        features_list: lista de dicts retornados por extract_features
+        names: colunas, na ordem
+    
+    Returns:
+        numpy array: Matriz com colunas na ordem de names
+    """
+    matrix = np.empty((len(features_list), len(names)), dtype=np.float32)
+    for i, features in enumerate(features_list):
+        matrix[i] = [features[name] for name in names]
+    return matrix
+
+
+# Flags de decodificação em escala de cinza por fator de redução
+# (o libjpeg reduz durante a IDCT, sem decodificar a resolução total)
+_GRAY_DECODE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+# Marcadores SOF (início de quadro) do JPEG; C4, C8 e CC são DHT/JPG/DAC
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def jpeg_size(buffer):
+    """
+    Lê largura e altura do cabeçalho de um JPEG sem copiar os bytes
+    
+    Percorre os segmentos até o SOF direto sobre o buffer (bytes ou
+    memoryview de um segmento do arquivo de imagens).
+    
+    Returns:
+        tuple: (largura, altura), ou None se não for um JPEG legível
+    """
+    view = memoryview(buffer)
+    if len(view) < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+    
+    i = 2
+    while i + 4 <= len(view):
+        if view[i] != 0xFF:
+            return None
+        marker = view[i + 1]
+        if marker == 0xFF:
+            # Byte de preenchimento
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            # Marcadores sem comprimento
+            i += 2
+            continue
+        
+        (length,) = struct.unpack_from('>H', view, i + 2)
+        if marker in _JPEG_SOF_MARKERS:
+            if i + 9 > len(view):
+                return None
+            height, width = struct.unpack_from('>HH', view, i + 5)
+            return width, height
+        if marker == 0xDA:
+            # Início dos dados comprimidos sem SOF antes
+            return None
+        i += 2 + length
+    
+    return None
+
+
+class DecodedImage:
+    """
+    Imagem decodificada sob demanda a partir dos bytes JPEG
+    
+    Guarda apenas uma view (sem cópia) dos bytes e o tamanho lido do
+    cabeçalho. Cada plano é decodificado na primeira vez que é pedido:
+    cinza reduzido para a segmentação, cinza em resolução total para
+    refinamento e a imagem colorida só se algum consumidor precisar.
+    """
+    
+    def __init__(self, image_bytes=None, array=None):
+        self._buffer = None
+        self._gray = {}
+        self._color = None
+        
+        if array is not None:
+            # Imagem já decodificada (BGR ou cinza)
+            if array.ndim == 3:
+                self._color = array
+                self._gray[1] = cv2.cvtColor(array, cv2.COLOR_BGR2GRAY)
+            else:
+                self._gray[1] = array
+            self.shape = array.shape[:2]
+            return
+        
+        self._buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+        
+        # Lê só o cabeçalho para obter o tamanho original
+        size = jpeg_size(image_bytes)
+        if size is None:
+            # Outros formatos (PNG...) pelo PIL
+            with Image.open(io.BytesIO(image_bytes)) as header:
+                size = header.size
+        width, height = size
+        self.shape = (height, width)
+    
+    @classmethod
+    def from_array(cls, array):
+        """Cria a partir de um numpy array BGR (ou cinza) já decodificado"""
+        return cls(array=array)
+    
+    def gray(self, reduction=1):
+        """
+        Plano em escala de cinza
+        
+        Args:
+            reduction: fator de redução (1, 2, 4 ou 8)
+        """
+        if reduction not in self._gray:
+            if self._buffer is not None:
+                image = cv2.imdecode(
+                    self._buffer, _GRAY_DECODE_FLAGS[reduction] | cv2.IMREAD_IGNORE_ORIENTATION
+                )
+                if image is None:
+                    raise ValueError('Não foi possível decodificar a imagem')
+            else:
+                image = cv2.pyrDown(self.gray(reduction // 2))
+            self._gray[reduction] = image
+        return self._gray[reduction]
+    
+    @property
+    def color(self):
+        """Imagem BGR em resolução total"""
+        if self._color is None:
+            image = cv2.imdecode(self._buffer, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+            if image is None:
+                raise ValueError('Não foi possível decodificar a imagem')
+            self._color = image
+        return self._color
+
+
+def _find_in_box(find, gray, roi, fx, fy):
+    """
+    Roda find (gray -> contorno) só no recorte da ROI
+    
+    Args:
+        roi: (x0, y0, x1, y1) em pixels do quadro original, ou None
+        fx, fy: pixels do quadro original por pixel de gray
+    
+    Returns:
+        numpy array: contorno nas coordenadas de gray, ou None
+    """
+    if roi is None:
+        return find(gray)
+    
+    x0, y0, x1, y1 = roi
+    bx0, by0 = int(x0 / fx), int(y0 / fy)
+    bx1, by1 = int(np.ceil(x1 / fx)), int(np.ceil(y1 / fy))
+    
+    contour = find(gray[by0:by1, bx0:bx1])
+    if contour is None:
+        return None
+    return contour + np.array([bx0, by0], dtype=contour.dtype)
+
+
+def _touches_roi(contour, roi, shape):
+    """Indica se o contorno encosta num lado da ROI que não é borda do quadro"""
+    x, y, w, h = cv2.boundingRect(contour)
+    x0, y0, x1, y1 = roi
+    height, width = shape
+    tolerance = max(2, int(0.01 * max(height, width)))
+    
+    return (
+        (x0 > 0 and x - x0 <= tolerance) or
+        (y0 > 0 and y - y0 <= tolerance) or
+        (x1 < width and x1 - (x + w) <= tolerance) or
+        (y1 < height and y1 - (y + h) <= tolerance)
+    )
+
+
+# ----------------------------------------------------------------------
+# Formato .npz do modelo treinado
+# ----------------------------------------------------------------------
+#
+# Só arrays NumPy (lidos com allow_pickle=False): carregar um artefato
+# não executa código e não depende da versão do sklearn que o treinou;
+# a predição é feita aqui, vetorizada, sem importar o sklearn.
+#
+#     format, format_version, kind ('linear' | 'trees'), features
+#     mean, scale              padronização opcional (StandardScaler)
+#     linear: coef, intercept
+#     trees:  feature, threshold, left, right, value (nós de todas as
+#             árvores concatenados), roots, max_depth, combine, base
+
+NPZ_FORMAT = 'faceboi-model'
+NPZ_FORMAT_VERSION = 1
+
+
+def _standardize(matrix, mean, scale):
+    """Aplica a padronização do pipeline de treino (se houver)"""
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if mean is not None:
+        matrix = matrix - mean
+    if scale is not None:
+        matrix = matrix / scale
+    return matrix
+
+
+class LinearModel:
+    """Regressão linear (LinearRegression, Ridge, Lasso...): X·coef + intercept"""
+    
+    kind = 'linear'
+    
+    def __init__(self, features, coef, intercept, mean=None, scale=None):
+        self.features = list(features)
+        self.coef = np.asarray(coef, dtype=np.float64).reshape(-1)
+        self.intercept = float(intercept)
+        self.mean, self.scale = mean, scale
+        
+        if len(self.coef) != len(self.features):
+            raise ValueError(f'{len(self.coef)} coeficientes para {len(self.features)} características')
+    
+    def predict(self, matrix):
+        return _standardize(matrix, self.mean, self.scale) @ self.coef + self.intercept
+    
+    def arrays(self):
+        return {'coef': self.coef, 'intercept': np.float64(self.intercept)}
+
+
+class TreeEnsemble:
+    """
+    Árvores de regressão (árvore única, random forest, gradient boosting)
+    
+    Os nós de todas as árvores ficam em arrays planos. Na predição,
+    todas as amostras descem todas as árvores ao mesmo tempo, um nível
+    por iteração (max_depth iterações de indexação NumPy), então o
+    custo em Python não cresce com o número de árvores nem de amostras.
+    """
+    
+    kind = 'trees'
+    
+    def __init__(self, features, feature, threshold, left, right, value, roots, max_depth,
+                 combine='mean', base=0.0, mean=None, scale=None):
+        """
+        Args:
+            feature: característica testada em cada nó (negativo = folha)
+            threshold: vai para left se x <= threshold
+            left, right: índices dos filhos (nos arrays concatenados)
+            value: valor de cada nó (usado nas folhas)
+            roots: nó raiz de cada árvore
+            max_depth: profundidade da árvore mais funda
+            combine: 'mean' (floresta) ou 'sum' (boosting; value já
+                     multiplicado pela taxa de aprendizado)
+            base: constante somada ao resultado (predição inicial do boosting)
+        """
+        self.features = list(features)
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.value = np.asarray(value, dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.max_depth = int(max_depth)
+        self.combine = combine
+        self.base = float(base)
+        self.mean, self.scale = mean, scale
+        
+        self._validate()
+    
+    def _validate(self):
+        """Artefatos vêm de outras fazendas: índices fora do lugar viram erro, não travamento"""
+        nodes = len(self.feature)
+        if not (len(self.threshold) == len(self.left) == len(self.right) == len(self.value) == nodes):
+            raise ValueError('Arrays de nós com tamanhos diferentes')
+        if self.combine not in ('mean', 'sum'):
+            raise ValueError(f'combine inválido: {self.combine}')
+        if not len(self.roots) or self.roots.min() < 0 or self.roots.max() >= nodes:
+            raise ValueError('Raízes fora dos nós')
+        if not 0 <= self.max_depth <= nodes:
+            raise ValueError(f'max_depth inválido: {self.max_depth}')
+        
+        internal = self.feature >= 0
+        if np.any(self.feature[internal] >= len(self.features)):
+            raise ValueError('Nó testa uma característica inexistente')
+        for children in (self.left[internal], self.right[internal]):
+            if len(children) and (children.min() < 0 or children.max() >= nodes):
+                raise ValueError('Filhos fora dos nós')
+    
+    def predict(self, matrix):
+        # Como no sklearn: comparações em float32
+        X = _standardize(matrix, self.mean, self.scale).astype(np.float32)
+        rows = np.arange(len(X))[:, None]
+        
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            feature = self.feature[node]
+            leaf = feature < 0
+            if leaf.all():
+                break
+            go_left = X[rows, np.where(leaf, 0, feature)] <= self.threshold[node]
+            node = np.where(leaf, node, np.where(go_left, self.left[node], self.right[node]))
+        
+        values = self.value[node]
+        combined = values.mean(axis=1) if self.combine == 'mean' else values.sum(axis=1)
+        return combined + self.base
+    
+    def arrays(self):
+        return {
+            'feature': self.feature, 'threshold': self.threshold,
+            'left': self.left, 'right': self.right, 'value': self.value,
+            'roots': self.roots, 'max_depth': np.int64(self.max_depth),
+            'combine': np.array(self.combine), 'base': np.float64(self.base)
+        }
+
+
+def save_npz_model(model, path):
+    """Grava um LinearModel/TreeEnsemble no formato .npz"""
+    arrays = {
+        'format': np.array(NPZ_FORMAT),
+        'format_version': np.int64(NPZ_FORMAT_VERSION),
+        'kind': np.array(model.kind),
+        'features': np.array(model.features)
+    }
+    if model.mean is not None:
+        arrays['mean'] = np.asarray(model.mean, dtype=np.float64)
+    if model.scale is not None:
+        arrays['scale'] = np.asarray(model.scale, dtype=np.float64)
+    arrays.update(model.arrays())
+    
+    # Sem compressão: o carregamento é só leitura dos arrays
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def load_npz_model(path):
+    """
+    Carrega um modelo .npz (sem pickle)
+    
+    Raises:
+        ValueError: arquivo que não é um modelo FaceBoi ou versão não suportada
+    """
+    with np.load(path, allow_pickle=False) as data:
+        if 'format' not in data.files or str(data['format']) != NPZ_FORMAT:
+            raise ValueError(f'{os.path.basename(path)} não é um modelo FaceBoi')
+        if int(data['format_version']) > NPZ_FORMAT_VERSION:
+            raise ValueError(f"Versão do formato não suportada: {int(data['format_version'])}")
+        
+        kind = str(data['kind'])
+        options = {
+            'features': [str(name) for name in data['features']],
+            'mean': data['mean'] if 'mean' in data.files else None,
+            'scale': data['scale'] if 'scale' in data.files else None
+        }
+        
+        if kind == 'linear':
+            return LinearModel(coef=data['coef'], intercept=data['intercept'], **options)
+        if kind == 'trees':
+            return TreeEnsemble(
+                feature=data['feature'], threshold=data['threshold'], left=data['left'],
+                right=data['right'], value=data['value'], roots=data['roots'],
+                max_depth=int(data['max_depth']), combine=str(data['combine']),
+                base=float(data['base']), **options
+            )
+    
+    raise ValueError(f'Tipo de modelo desconhecido: {kind}')
+
+
+def convert_model(model, features=FEATURE_NAMES):
+    """
+    Converte um modelo do sklearn já treinado para LinearModel/TreeEnsemble
+    
+    Lê apenas os atributos do modelo (coef_, tree_...), então roda onde
+    o modelo foi treinado; o servidor só precisa do .npz resultante.
+    Suporta Pipeline com StandardScaler antes do regressor.
+    
+    Raises:
+        ValueError: tipo de modelo não suportado
+    """
+    if isinstance(model, (LinearModel, TreeEnsemble)):
+        return model
+    
+    mean = scale = None
+    steps = getattr(model, 'steps', None)
+    if steps:
+        *preprocessing, (_, model) = steps
+        for _, step in preprocessing:
+            if step is None or step == 'passthrough':
+                continue
+            if type(step).__name__ != 'StandardScaler' or mean is not None or scale is not None:
+                raise ValueError(f'Etapa de pipeline não suportada: {type(step).__name__}')
+            mean = step.mean_ if step.with_mean else None
+            scale = step.scale_ if step.with_std else None
+    
+    n_features = getattr(model, 'n_features_in_', len(features))
+    if n_features != len(features):
+        raise ValueError(f'O modelo espera {n_features} características, não {len(features)}')
+    
+    name = type(model).__name__
+    
+    if hasattr(model, 'coef_') and hasattr(model, 'intercept_'):
+        coef = np.asarray(model.coef_, dtype=np.float64)
+        if coef.ndim > 1 and coef.shape[0] != 1:
+            raise ValueError(f'{name}: só modelos de uma saída')
+        intercept = np.ravel(model.intercept_)[0] if np.ndim(model.intercept_) else model.intercept_
+        return LinearModel(features, coef, intercept, mean, scale)
+    
+    # Árvore única, floresta (média) ou gradient boosting (soma)
+    combine, base, rate = 'mean', 0.0, 1.0
+    if hasattr(model, 'tree_'):
+        trees = [model.tree_]
+    elif hasattr(model, 'init_') and hasattr(model, 'learning_rate'):
+        trees = [estimator.tree_ for estimator in np.ravel(model.estimators_)]
+        combine, rate = 'sum', float(model.learning_rate)
+        if isinstance(model.init_, str):
+            if model.init_ != 'zero':
+                raise ValueError(f'{name}: init não suportado ({model.init_})')
+        elif hasattr(model.init_, 'constant_'):
+            base = float(np.ravel(model.init_.constant_)[0])
+        else:
+            raise ValueError(f'{name}: init não suportado ({type(model.init_).__name__})')
+    elif (hasattr(model, 'estimators_') and not hasattr(model, 'estimators_features_')
+          and not hasattr(model, 'estimator_weights_')
+          and all(hasattr(estimator, 'tree_') for estimator in model.estimators_)):
+        trees = [estimator.tree_ for estimator in model.estimators_]
+    else:
+        raise ValueError(f'Modelo não suportado: {name}')
+    
+    feature, threshold, left, right, value, roots = [], [], [], [], [], []
+    offset, max_depth = 0, 0
+    for tree in trees:
+        if tree.n_outputs != 1:
+            raise ValueError(f'{name}: só modelos de uma saída')
+        children_left = np.asarray(tree.children_left)
+        internal = children_left >= 0
+        
+        feature.append(np.where(internal, tree.feature, -1))
+        threshold.append(tree.threshold)
+        left.append(np.where(internal, children_left + offset, -1))
+        right.append(np.where(internal, np.asarray(tree.children_right) + offset, -1))
+        value.append(np.asarray(tree.value)[:, 0, 0] * rate)
+        roots.append(offset)
+        
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+    
+    return TreeEnsemble(
+        features, np.concatenate(feature), np.concatenate(threshold), np.concatenate(left),
+        np.concatenate(right), np.concatenate(value), roots, max_depth, combine, base, mean, scale
+    )
+
 
 class WeightEstimator:
     """
@@ -23,10 +508,18 @@ class WeightEstimator:
     3. Usa regressão para estimar peso
     """
     
-    def __init__(self, model_path=None):
-        self.model = None
+    def __init__(self, model_path=None, segment_max_side=0, segment_refine=False,
+                 cache_bytes=0, cache_dir=None, background_dir=None, background_threshold=25,
+                 background_min_frames=3, roi_dir=None, roi_min_samples=20, roi_margin=0.1,
+                 feature_plugins=(), extra_features=(), model_registry=None,
+                 model_check_interval=5):
         self.model_path = model_path
         
+        # Versão em uso (fórmula empírica até um modelo ser carregado);
+        # trocada por inteiro, nunca alterada no lugar
+        self.active = LoadedModel('empirical', None, EMPIRICAL_FEATURES)
+        self._loading = None
+        
         # Parâmetros de calibração (ajustados empiricamente)
         # Em produção, estes seriam aprendidos com dados reais
         self.calibration = {
@@ -37,10 +530,111 @@ class WeightEstimator:
             'max_weight': 800,           # Peso máximo (kg)
         }
         
+        # Segmentação em resolução reduzida
+        # max_side: maior lado (px) da cópia reduzida; 0 = resolução total
+        # refine: refaz a segmentação em resolução total só na ROI encontrada
+        self.segmentation = {
+            'max_side': segment_max_side,
+            'refine': segment_refine,
+        }
+        
+        # Cache de resultados por hash da imagem (0 e sem diretório = desligado)
+        self.cache = None
+        if cache_bytes or cache_dir:
+            self.cache = ResultCache(max_bytes=cache_bytes, directory=cache_dir)
+        
+        # Referência do corredor vazio por câmera (None = só threshold adaptativo)
+        self.background = None
+        if background_dir:
+            self.background = BackgroundStore(
+                background_dir, threshold=background_threshold, min_frames=background_min_frames
+            )
+        
+        # Região de interesse por câmera (None = quadro inteiro)
+        self.roi = None
+        if roi_dir:
+            self.roi = RoiStore(roi_dir, min_samples=roi_min_samples, margin=roi_margin)
+        
+        # Extratores de terceiros e características extras no resultado
+        # (além das que o modelo usa; ex.: para montar dados de treino)
+        feature_extractors.load_plugins(feature_plugins)
+        self.extra_features = list(extra_features)
+        feature_extractors.plan(self.extra_features)
+        
+        # Registro de versões (model_registry.py): a versão ativa tem
+        # precedência sobre model_path
+        self.registry = None
+        if model_registry:
+            self.registry = ModelRegistry(model_registry, check_interval=model_check_interval)
+            version = self.registry.poll()
+            if version:
+                try:
+                    self.active = self.registry.load(version, EMPIRICAL_FEATURES)
+                    print(f"[WeightModel] Versão ativa do registro: {version}")
+                except Exception as e:
+                    print(f"[WeightModel] Erro ao carregar versão {version}: {e}")
+        
         # Carrega modelo treinado se existir
-        if model_path and os.path.exists(model_path):
+        if self.active.version == 'empirical' and model_path and os.path.exists(model_path):
             self.load_model(model_path)
     
+    @property
+    def model(self):
+        """Preditor da versão ativa (None = fórmula empírica)"""
+        return self.active.predictor
+    
+    @model.setter
+    def model(self, predictor):
+        """Atribuição direta de um preditor (treino, testes): colunas em FEATURE_NAMES"""
+        if predictor is None:
+            self.active = LoadedModel('empirical', None, EMPIRICAL_FEATURES)
+        else:
+            self.active = LoadedModel('local', predictor, FEATURE_NAMES)
+    
+    def cache_version(self, active=None):
+        """
+        Identificador da versão do modelo, calibração e segmentação em uso
+        
+        Muda sempre que outra versão é ativada ou os dicts calibration /
+        segmentation são alterados; usado na chave do cache de resultados.
+        """
+        active = active or self.active
+        state = json.dumps({
+            'model': active.version,
+            'calibration': dict(self.calibration, **active.calibration),
+            'segmentation': self.segmentation,
+            'extra_features': self.extra_features
+        }, sort_keys=True, default=str)
+        return hashlib.sha1(state.encode()).hexdigest()[:16]
+    
+    def cache_key(self, image_bytes, device_id=None):
+        """
+        Chave do cache de resultados para uma imagem
+        
+        Junta ao hash da imagem só o que a segmentação desta câmera usa
+        neste quadro: o recorte da ROI (alinhado a ROI_GRID) e a versão
+        gravada da referência de fundo, se ela está pronta. Nenhum dos
+        dois muda a cada captura, então um reenvio do mesmo JPEG cai na
+        chave da captura original.
+        """
+        key = content_hash(image_bytes)
+        if not device_id or (self.background is None and self.roi is None):
+            return key
+        
+        try:
+            image = self.decode_image(image_bytes)
+        except Exception:
+            # Imagem ilegível: a análise falha e o resultado não vai ao cache
+            return key
+        
+        state = [device_id]
+        if self.roi is not None:
+            state.append(str(self.roi.box(device_id, image.shape)))
+        if self.background is not None:
+            state.append(str(self.background.generation(device_id, image)))
+        suffix = hashlib.sha1('\0'.join(state).encode()).hexdigest()[:16]
+        return f"{key}-{suffix}"
+    
     def preprocess_image(self, image_bytes):
         """
         Pré-processa a imagem para análise
@@ -49,31 +643,127 @@ class WeightEstimator:
             image_bytes: bytes da imagem JPEG
         
         Returns:
-            numpy array: Imagem processada
+            numpy array: Imagem BGR em resolução total
+        """
+        return DecodedImage(image_bytes).color
+    
+    def decode_image(self, image_bytes):
         """
-        # Converte bytes para imagem
-        image = Image.open(io.BytesIO(image_bytes))
-        image = np.array(image)
+        Decodifica a imagem sob demanda (caminho rápido do pipeline)
         
-        # Converte para BGR se necessário (OpenCV usa BGR)
-        if len(image.shape) == 3 and image.shape[2] == 3:
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        Args:
+            image_bytes: bytes da imagem JPEG
         
-        return image
+        Returns:
+            DecodedImage: planos decodificados apenas quando usados
+        """
+        return DecodedImage(image_bytes)
     
-    def segment_animal(self, image):
+    def segment_animal(self, image, device_id=None):
         """
         Segmenta o animal do fundo da imagem
         
+        Se a câmera tem referência do corredor vazio (background.py), o
+        contorno vem da diferença para ela; senão, do threshold
+        adaptativo. Se segmentation['max_side'] estiver definido, o
+        threshold adaptativo roda numa cópia reduzida e o contorno é
+        reescalado para a resolução original (opcionalmente refinado
+        numa ROI em resolução total).
+        
+        Com ROI da câmera (roi.py), as duas segmentações rodam só no
+        recorte; se nada for encontrado ou o contorno encostar na borda
+        do recorte (animal maior que a ROI), repete no quadro inteiro.
+        O contorno é sempre devolvido em coordenadas do quadro inteiro.
+        
         Args:
-            image: numpy array da imagem BGR
+            image: DecodedImage ou numpy array da imagem BGR
+            device_id: câmera que fez a captura
         
         Returns:
             tuple: (máscara binária, contorno principal)
         """
-        # Converte para escala de cinza
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if not isinstance(image, DecodedImage):
+            image = DecodedImage.from_array(image)
+        
+        roi = None
+        if self.roi is not None and device_id:
+            roi = self.roi.box(device_id, image.shape)
+        
+        main_contour = self._segment_in(image, device_id, roi)
+        
+        if roi is not None and (main_contour is None or _touches_roi(main_contour, roi, image.shape)):
+            main_contour = self._segment_in(image, device_id, None)
+        
+        if main_contour is None:
+            return None, None
+        
+        # Cria máscara
+        mask = np.zeros(image.shape, dtype=np.uint8)
+        cv2.drawContours(mask, [main_contour], -1, 255, -1)
+        
+        return mask, main_contour
+    
+    def _segment_in(self, image, device_id, roi):
+        """Referência de fundo da câmera, se pronta; senão threshold adaptativo"""
+        contour = None
+        if self.background is not None and device_id:
+            contour = self.background.segment(device_id, image, roi)
+        if contour is None:
+            contour = self._segment_reduced(image, roi)
+        return contour
+    
+    def _segment_reduced(self, image, roi=None):
+        """
+        Encontra o contorno principal, em resolução reduzida se configurado
         
+        Args:
+            roi: (x0, y0, x1, y1) em pixels do quadro; só o recorte é processado
+        """
+        height, width = image.shape
+        max_side = self.segmentation['max_side']
+        
+        if not max_side or max(height, width) <= max_side:
+            return _find_in_box(self._find_main_contour, image.gray(), roi, 1.0, 1.0)
+        
+        # Primeiros níveis (até 1/8) saem direto do decodificador JPEG
+        reduction = 1
+        while reduction < 8 and max(height, width) / reduction > max_side:
+            reduction *= 2
+        small = image.gray(reduction)
+        
+        # Demais níveis: pirâmide gaussiana, cada um reduz pela metade
+        while max(small.shape[:2]) > max_side:
+            small = cv2.pyrDown(small)
+        
+        # Reescala o contorno para coordenadas da imagem original
+        factors = np.array([width / small.shape[1], height / small.shape[0]], dtype=np.float32)
+        
+        contour = _find_in_box(self._find_main_contour, small, roi, *factors)
+        if contour is None:
+            return None
+        
+        contour = np.round(contour.astype(np.float32) * factors).astype(np.int32)
+        
+        if self.segmentation['refine']:
+            contour = self._refine_contour(image.gray(), contour, margin=int(np.ceil(factors.max())) * 2)
+        
+        return contour
+    
+    def _refine_contour(self, gray, contour, margin):
+        """Refaz a segmentação em resolução total dentro da bbox do contorno"""
+        x, y, w, h = cv2.boundingRect(contour)
+        x0, y0 = max(x - margin, 0), max(y - margin, 0)
+        x1 = min(x + w + margin, gray.shape[1])
+        y1 = min(y + h + margin, gray.shape[0])
+        
+        refined = self._find_main_contour(gray[y0:y1, x0:x1])
+        if refined is None:
+            return contour
+        
+        return refined + np.array([x0, y0], dtype=refined.dtype)
+    
+    def _find_main_contour(self, gray):
+        """Blur, threshold adaptativo, morfologia e maior contorno"""
         # Aplica blur para reduzir ruído
         blurred = cv2.GaussianBlur(gray, (5, 5), 0)
         
@@ -95,24 +785,33 @@ class WeightEstimator:
         )
         
         if not contours:
-            return None, None
+            return None
         
         # Pega o maior contorno (assumindo que é o animal)
-        main_contour = max(contours, key=cv2.contourArea)
-        
-        # Cria máscara
-        mask = np.zeros(gray.shape, dtype=np.uint8)
-        cv2.drawContours(mask, [main_contour], -1, 255, -1)
-        
-        return mask, main_contour
+        return max(contours, key=cv2.contourArea)
     
-    def extract_features(self, image, contour):
+    def model_features(self):
+        """Colunas da matriz de características da versão ativa"""
+        return self.active.features
+    
+    def required_features(self, active=None):
+        """Características calculadas por imagem: modelo, resultado e extras"""
+        active = active or self.active
+        names = []
+        for name in active.features + RESULT_FEATURES + self.extra_features:
+            if name not in names:
+                names.append(name)
+        return names
+    
+    def extract_features(self, image, contour, names=None):
         """
         Extrai características do animal para estimativa de peso
         
         Args:
-            image: numpy array da imagem
+            image: DecodedImage ou numpy array da imagem (usada pelo tamanho)
             contour: contorno do animal
+            names: características a calcular (None = todas as registradas
+                   em features.py; o pipeline passa required_features())
         
         Returns:
             dict: Características extraídas
@@ -120,53 +819,7 @@ class WeightEstimator:
         if contour is None:
             return None
         
-        # Área do contorno
-        area = cv2.contourArea(contour)
-        
-        # Perímetro
-        perimeter = cv2.arcLength(contour, True)
-        
-        # Bounding box
-        x, y, w, h = cv2.boundingRect(contour)
-        
-        # Retângulo rotacionado (melhor ajuste)
-        rect = cv2.minAreaRect(contour)
-        (cx, cy), (width, height), angle = rect
-        
-        # Garante que width > height (comprimento > largura)
-        if width < height:
-            width, height = height, width
-        
-        # Elipse ajustada (se contorno tem pontos suficientes)
-        ellipse_area = 0
-        if len(contour) >= 5:
-            ellipse = cv2.fitEllipse(contour)
-            ellipse_area = np.pi * (ellipse[1][0] / 2) * (ellipse[1][1] / 2)
-        
-        # Convexidade
-        hull = cv2.convexHull(contour)
-        hull_area = cv2.contourArea(hull)
-        solidity = area / hull_area if hull_area > 0 else 0
-        
-        # Proporção da imagem ocupada pelo animal
-        image_area = image.shape[0] * image.shape[1]
-        fill_ratio = area / image_area
-        
-        features = {
-            'area': area,
-            'perimeter': perimeter,
-            'width': width,
-            'height': height,
-            'length': max(width, height),  # Comprimento do animal
-            'bbox_width': w,
-            'bbox_height': h,
-            'aspect_ratio': width / height if height > 0 else 0,
-            'solidity': solidity,
-            'fill_ratio': fill_ratio,
-            'ellipse_area': ellipse_area
-        }
-        
-        return features
+        return feature_extractors.extract(image, contour, names)
     
     def estimate_weight(self, features):
         """
@@ -181,29 +834,49 @@ class WeightEstimator:
         if features is None:
             return None
         
+        active = self.active
+        return float(self.estimate_weights(features_matrix([features], active.features), active)[0])
+    
+    def estimate_weights(self, matrix, active=None):
+        """
+        Estima o peso de um lote de animais de uma vez
+        
+        Args:
+            matrix: numpy array (N, colunas) com colunas em active.features
+            active: versão do modelo (padrão: a ativa)
+        
+        Returns:
+            numpy array: Pesos estimados em kg, arredondados a 0.1
+        """
+        active = active or self.active
+        
         # Se temos modelo treinado, usa ele
-        if self.model is not None:
-            return self._predict_with_model(features)
+        if active.predictor is not None:
+            return self._predict_with_model(matrix, active.predictor)
         
         # Caso contrário, usa fórmula empírica (MVP)
-        return self._empirical_estimation(features)
+        return self._empirical_estimation(matrix, active.calibration)
     
-    def _empirical_estimation(self, features):
+    def _empirical_estimation(self, matrix, calibration=None):
         """
-        Estimativa empírica de peso (fórmula simplificada)
+        Estimativa empírica de peso (fórmula simplificada), vetorizada
         
         Baseada em correlações conhecidas entre dimensões e peso de bovinos.
         Esta é uma aproximação para MVP.
+        
+        Args:
+            calibration: ajustes da versão ativa sobre self.calibration
         """
-        cal = self.calibration
+        cal = dict(self.calibration, **(calibration or {}))
+        columns = {name: matrix[:, i].astype(np.float64) for i, name in enumerate(EMPIRICAL_FEATURES)}
         
         # Normaliza área para escala típica de imagem
         # Assume imagem de ~800x600 pixels
-        normalized_area = features['area'] / 10000
+        normalized_area = columns['area'] / 10000
         
         # Comprimento e largura normalizados
-        length = features['length'] / 100
-        width = features['height'] / 100
+        length = columns['length'] / 100
+        width = columns['height'] / 100
         
         # Fórmula empírica:
         # Peso = base + (área * fator_área) + (comprimento * fator_comp) + (largura * fator_larg)
@@ -215,98 +888,338 @@ class WeightEstimator:
         )
         
         # Ajuste por proporção (animais mais "preenchidos" são mais pesados)
-        weight *= (0.8 + features['solidity'] * 0.4)
+        weight *= (0.8 + columns['solidity'] * 0.4)
         
         # Limita ao range válido
-        weight = max(cal['base_weight'], min(cal['max_weight'], weight))
+        weight = np.clip(weight, cal['base_weight'], cal['max_weight'])
         
-        return round(weight, 1)
+        return np.round(weight, 1)
     
-    def _predict_with_model(self, features):
-        """Predição usando modelo ML treinado"""
-        feature_vector = np.array([
-            features['area'],
-            features['perimeter'],
-            features['length'],
-            features['height'],
-            features['aspect_ratio'],
-            features['solidity'],
-            features['fill_ratio']
-        ]).reshape(1, -1)
-        
-        weight = self.model.predict(feature_vector)[0]
-        return round(float(weight), 1)
+    def _predict_with_model(self, matrix, predictor=None):
+        """Predição em lote usando modelo ML treinado"""
+        predictor = predictor or self.model
+        weights = np.asarray(predictor.predict(matrix), dtype=np.float64)
+        return np.round(weights, 1)
     
-    def process_image(self, image_bytes):
+    def _analyze(self, image_bytes, device_id=None, names=None):
         """
-        Processa imagem completa e retorna estimativa de peso
+        Pré-processa, segmenta e extrai características de uma imagem
         
-        Args:
-            image_bytes: bytes da imagem JPEG
+        A decodificação dos pixels é preguiçosa (DecodedImage), então o
+        tempo de 'segment' inclui decodificar o plano cinza. Depois da
+        segmentação, a referência de fundo da câmera é atualizada com os
+        pixels fora do animal ('background'). Só as características em
+        names (padrão: required_features()) são calculadas.
         
         Returns:
-            dict: Resultado com peso estimado e features
+            tuple: (features, falha, tempos) - features ou falha é None;
+                   falha é um dict com 'error' e 'reason'; tempos em
+                   segundos por etapa
         """
+        timings = {}
+        start = time.perf_counter()
+        
         try:
-            # Pré-processa
-            image = self.preprocess_image(image_bytes)
+            # Decodifica (apenas o plano cinza necessário)
+            image = self.decode_image(image_bytes)
+            timings['decode'] = time.perf_counter() - start
             
             # Segmenta animal
-            mask, contour = self.segment_animal(image)
+            start = time.perf_counter()
+            mask, contour = self.segment_animal(image, device_id)
+            timings['segment'] = time.perf_counter() - start
             
             if contour is None:
-                return {
-                    'success': False,
-                    'error': 'Não foi possível detectar o animal na imagem'
-                }
+                return None, {
+                    'error': 'Não foi possível detectar o animal na imagem',
+                    'reason': 'no_animal'
+                }, timings
             
-            # Extrai características
-            features = self.extract_features(image, contour)
+            if self.background is not None and device_id:
+                start = time.perf_counter()
+                self.background.learn_capture(device_id, image, contour)
+                timings['background'] = time.perf_counter() - start
             
-            # Estima peso
-            weight = self.estimate_weight(features)
+            if self.roi is not None and device_id:
+                self.roi.learn(device_id, cv2.boundingRect(contour), image.shape)
             
-            return {
-                'success': True,
-                'estimated_weight': weight,
-                'confidence': 0.75,  # MVP: confiança fixa
-                'features': {
-                    'area': int(features['area']),
-                    'length': round(features['length'], 1),
-                    'width': round(features['height'], 1),
-                    'aspect_ratio': round(features['aspect_ratio'], 2)
-                }
-            }
+            # Extrai características
+            start = time.perf_counter()
+            features = self.extract_features(image, contour, names or self.required_features())
+            timings['features'] = time.perf_counter() - start
+            
+            return features, None, timings
             
         except Exception as e:
-            return {
-                'success': False,
-                'error': str(e)
+            return None, {'error': str(e), 'reason': 'analysis_error'}, timings
+    
+    def _build_result(self, features, weight, version):
+        """Monta o resultado público de uma estimativa"""
+        result = {
+            'success': True,
+            'estimated_weight': weight,
+            'confidence': 0.75,  # MVP: confiança fixa
+            'model_version': version,
+            'features': {
+                'area': int(features['area']),
+                'length': round(features['length'], 1),
+                'width': round(features['height'], 1),
+                'aspect_ratio': round(features['aspect_ratio'], 2)
             }
+        }
+        for name in self.extra_features:
+            result['features'].setdefault(name, round(float(features[name]), 4))
+        return result
+    
+    def process_image(self, image_bytes, device_id=None):
+        """
+        Processa imagem completa e retorna estimativa de peso
+        
+        Args:
+            image_bytes: bytes da imagem JPEG
+            device_id: câmera que fez a captura (referência de fundo)
+        
+        Returns:
+            dict: Resultado com peso estimado e features
+        """
+        return self.process_images([image_bytes], max_workers=1, device_ids=[device_id])[0]
+    
+    def learn_background(self, image_bytes, device_id):
+        """
+        Incorpora um quadro do corredor vazio à referência da câmera
+        
+        Returns:
+            dict: quadros incorporados e se a referência já é usada
+        
+        Raises:
+            RuntimeError: referência de fundo desligada
+            ValueError: imagem inválida
+        """
+        if self.background is None:
+            raise RuntimeError('Referência de fundo desligada (BACKGROUND_DIR vazio)')
+        
+        model = self.background.learn_empty(device_id, self.decode_image(image_bytes))
+        return {
+            'frames': model.frames,
+            'ready': model.frames >= self.background.min_frames,
+            'size': list(model.size)
+        }
+    
+    def set_roi(self, device_id, fractions):
+        """
+        Define (ou remove, com None) a ROI manual de uma câmera
+        
+        Returns:
+            dict: estado da ROI da câmera
+        
+        Raises:
+            RuntimeError: ROI desligada
+            ValueError: retângulo inválido
+        """
+        if self.roi is None:
+            raise RuntimeError('ROI por câmera desligada (ROI_DIR vazio)')
+        return self.roi.set_manual(device_id, fractions)
+    
+    def roi_state(self, device_id):
+        """Estado da ROI de uma câmera (None se a ROI está desligada)"""
+        if self.roi is None:
+            return None
+        return dict(self.roi.state(device_id), min_samples=self.roi.min_samples)
+    
+    def process_images(self, images, max_workers=None, device_ids=None):
+        """
+        Processa um lote de imagens (backfill e reprocessamento)
+        
+        Decodificação e segmentação rodam em paralelo (o OpenCV libera
+        o GIL); as características do estimador ativo são empilhadas em
+        uma matriz e o peso de todo o lote sai de uma única predição
+        vetorizada.
+        
+        Args:
+            images: lista de bytes de imagens JPEG (ou memoryviews do arquivo de imagens)
+            max_workers: threads para decodificar/segmentar (padrão: núcleos)
+            device_ids: câmera de cada imagem (None = sem referência de fundo)
+        
+        Returns:
+            list: Um dict de resultado por imagem, na mesma ordem, com
+                  'timings' (segundos por etapa; 'cache' quando veio do
+                  cache) - o chamador deve removê-lo antes de persistir
+        """
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        
+        # Versão fixada no início do lote (uma troca no meio não o afeta)
+        self._check_model()
+        active = self.active
+        
+        results = [None] * len(images)
+        
+        if device_ids is None:
+            device_ids = [None] * len(images)
+        
+        # Imagens idênticas já processadas (mesma câmera, mesmo recorte e
+        # referência de fundo) saem direto do cache
+        keys = None
+        if self.cache is not None:
+            version = self.cache_version(active)
+            keys = []
+            for i, image_bytes in enumerate(images):
+                start = time.perf_counter()
+                keys.append(self.cache_key(image_bytes, device_ids[i]))
+                results[i] = self.cache.get(keys[i], version)
+                if results[i] is not None:
+                    results[i]['timings'] = {'cache': time.perf_counter() - start}
+        
+        pending = [i for i, result in enumerate(results) if result is None]
+        
+        names = [self.required_features(active)] * len(pending)
+        
+        if max_workers > 1 and len(pending) > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                analyzed = dict(zip(pending, pool.map(
+                    self._analyze, [images[i] for i in pending], [device_ids[i] for i in pending], names
+                )))
+        else:
+            analyzed = {i: self._analyze(images[i], device_ids[i], names[0]) for i in pending}
+        
+        ok_indexes = []
+        
+        for i, (features, failure, timings) in analyzed.items():
+            if features is None:
+                results[i] = {'success': False, **failure, 'timings': timings}
+            else:
+                ok_indexes.append(i)
+        
+        if ok_indexes:
+            try:
+                start = time.perf_counter()
+                matrix = features_matrix([analyzed[i][0] for i in ok_indexes], active.features)
+                weights = self.estimate_weights(matrix, active)
+                
+                # Predição do lote inteiro, dividida entre as imagens
+                estimate_time = (time.perf_counter() - start) / len(ok_indexes)
+                
+                for i, weight in zip(ok_indexes, weights):
+                    results[i] = self._build_result(analyzed[i][0], float(weight), active.version)
+                    if keys is not None:
+                        self.cache.put(keys[i], version, results[i])
+                    results[i]['timings'] = dict(analyzed[i][2], estimate=estimate_time)
+                    
+            except Exception as e:
+                for i in ok_indexes:
+                    results[i] = {
+                        'success': False,
+                        'error': str(e),
+                        'reason': 'estimation_error',
+                        'timings': analyzed[i][2]
+                    }
+        
+        return results
+    
+    def _check_model(self):
+        """
+        Troca de versão se o ACTIVE do registro mudou
+        
+        A nova versão é carregada e aquecida em uma thread; até ela ficar
+        pronta, as capturas continuam com a versão atual.
+        """
+        if self.registry is None:
+            return
+        
+        version = self.registry.poll()
+        if version is None or version == self.active.version or version == self._loading:
+            return
+        
+        self._loading = version
+        threading.Thread(target=self._swap_model, args=(version,), daemon=True).start()
+    
+    def _swap_model(self, version):
+        start = time.perf_counter()
+        try:
+            loaded = self.registry.load(version, EMPIRICAL_FEATURES)
+        except Exception as e:
+            print(f"[WeightModel] Erro ao carregar versão {version}, mantendo "
+                  f"{self.active.version}: {e}")
+            return
+        finally:
+            if self._loading == version:
+                self._loading = None
+        
+        # Outra versão pode ter sido ativada durante o carregamento
+        if self.registry.active_version() != version:
+            return
+        
+        previous, self.active = self.active, loaded
+        print(f"[WeightModel] Versão {previous.version} -> {version} "
+              f"({(time.perf_counter() - start) * 1000:.0f} ms para carregar)")
+    
+    def activate_version(self, version):
+        """
+        Carrega e aquece uma versão do registro, marca-a como ativa para
+        todos os processos e passa a usá-la neste
+        
+        Returns:
+            dict: resumo da versão ativada
+        
+        Raises:
+            RuntimeError: registro desligado
+            FileNotFoundError: versão inexistente
+            ValueError: versão inválida (não é ativada)
+        """
+        if self.registry is None:
+            raise RuntimeError('Registro de modelos desligado (MODEL_REGISTRY_DIR vazio)')
+        
+        loaded = self.registry.load(version, EMPIRICAL_FEATURES)
+        self.registry.activate(version)
+        self.active = loaded
+        return loaded.info()
+    
+    def models_info(self):
+        """Versão em uso neste processo e versões do registro"""
+        return {
+            'active': self.active.info(),
+            'registry_active': self.registry.active_version() if self.registry else None,
+            'versions': self.registry.versions() if self.registry else []
+        }
     
     def save_model(self, path):
-        """Salva modelo treinado"""
-        if self.model is not None:
+        """
+        Salva modelo treinado
+        
+        Com extensão .npz, converte para o formato sem pickle (convert_model);
+        senão, grava o pickle do objeto.
+        """
+        if self.model is None:
+            return
+        if path.endswith('.npz'):
+            save_npz_model(convert_model(self.model, self.model_features()), path)
+        else:
             with open(path, 'wb') as f:
                 pickle.dump(self.model, f)
     
     def load_model(self, path):
-        """Carrega modelo treinado"""
+        """Carrega modelo treinado (arquivo único .npz ou .pkl, fora do registro)"""
         try:
-            with open(path, 'rb') as f:
-                self.model = pickle.load(f)
+            predictor = load_artifact(path)
+            loaded = LoadedModel(
+                f"{os.path.basename(path)}@{int(os.path.getmtime(path))}",
+                predictor, getattr(predictor, 'features', FEATURE_NAMES),
+                meta={'path': os.path.abspath(path)}
+            )
+            loaded.warm()
+            self.active = loaded
             print(f"[WeightModel] Modelo carregado: {path}")
         except Exception as e:
             print(f"[WeightModel] Erro ao carregar modelo: {e}")
-            self.model = None
+            self.active = LoadedModel('empirical', None, EMPIRICAL_FEATURES)
 
 
 # Singleton para uso no servidor
 _estimator = None
 
-def get_estimator(model_path=None):
+def get_estimator(model_path=None, **options):
     """Retorna instância singleton do estimador"""
     global _estimator
     if _estimator is None:
-        _estimator = WeightEstimator(model_path)
+        _estimator = WeightEstimator(model_path, **options)
     return _estimator
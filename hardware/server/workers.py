@@ -0,0 +1,140 @@
+"""
+FaceBoi - Fila de estimativa de peso
+Executa o pipeline de visão computacional fora da requisição HTTP
+
+A imagem já está no arquivo de imagens quando a captura é enfileirada;
+o worker a lê pelo localizador (mmap, sem cópia), estima o peso e o
+resultado é gravado no banco pelo processo principal.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from weight_model import get_estimator
+from imagestore import get_image_store
+
+
+def _init_worker(model_path, options, image_store):
+    """Inicializa o estimador e o arquivo de imagens uma vez por processo worker"""
+    get_estimator(model_path, **options)
+    directory, store_options = image_store
+    get_image_store(directory, **store_options)
+
+
+def _estimate_file(image_path, device_id=None):
+    """Executado no worker: lê a imagem e estima o peso"""
+    return get_estimator().process_image(get_image_store().read(image_path), device_id)
+
+
+def _ping():
+    return os.getpid()
+
+
+class EstimationQueue:
+    """
+    Pool de processos para estimativa de peso.
+
+    Sob o gunicorn com ASYNC_ESTIMATION, start() é chamado em post_fork,
+    antes de o worker abrir suas threads: os processos do pool nascem de
+    um processo ainda com uma única thread. Sem ela (só ?async=1) e no
+    servidor de desenvolvimento o pool é criado na primeira submissão.
+    """
+
+    def __init__(self, model_path=None, max_workers=None, on_complete=None,
+                 estimator_options=None, image_store=None):
+        """
+        Args:
+            model_path: caminho do modelo carregado em cada worker
+            max_workers: número de processos (padrão: núcleos da CPU)
+            on_complete: callback(capture_id, result) no processo principal
+            estimator_options: kwargs repassados ao WeightEstimator
+            image_store: (diretório, kwargs) do ImageStore lido pelos workers
+        """
+        self.model_path = model_path
+        self.estimator_options = estimator_options or {}
+        self.image_store = image_store or ('uploads', {})
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.on_complete = on_complete
+
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        self._events = {}
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=_init_worker,
+                    initargs=(self.model_path, self.estimator_options, self.image_store)
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def start(self, max_workers=None):
+        """
+        Cria o pool agora e espera os processos subirem
+
+        Com fork, o ProcessPoolExecutor cria todos os processos na
+        primeira submissão; um ping aqui faz isso antes de existirem
+        outras threads neste processo.
+
+        Args:
+            max_workers: processos deste pool (padrão: o do construtor)
+        """
+        if max_workers is not None:
+            self.max_workers = max(1, max_workers)
+        self._get_pool().submit(_ping).result()
+
+    def submit(self, capture_id, image_path, device_id=None):
+        """Enfileira a estimativa de uma captura já salva (image_path é o localizador)"""
+        event = threading.Event()
+        with self._lock:
+            self._events[capture_id] = event
+
+        future = self._get_pool().submit(_estimate_file, image_path, device_id)
+        future.add_done_callback(lambda f: self._finish(capture_id, f))
+        return future
+
+    def _finish(self, capture_id, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+
+        try:
+            if self.on_complete:
+                self.on_complete(capture_id, result)
+        except Exception as e:
+            print(f"[Workers] Erro ao registrar captura {capture_id}: {e}")
+        finally:
+            with self._lock:
+                event = self._events.pop(capture_id, None)
+            if event:
+                event.set()
+
+    def wait(self, capture_id, timeout):
+        """
+        Aguarda a conclusão de uma captura deste processo
+
+        Returns:
+            bool: False se a captura não é conhecida aqui ou não terminou
+        """
+        with self._lock:
+            event = self._events.get(capture_id)
+        if event is None:
+            return False
+        return event.wait(timeout)
+
+    def pending(self):
+        """Número de capturas aguardando estimativa"""
+        with self._lock:
+            return len(self._events)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait)
+                self._pool = None